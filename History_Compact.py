@@ -0,0 +1,71 @@
+# Native Stuff
+import os,sys,json,argparse
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Classes as C
+import modules.History as HIST
+import modules.UserCache as UC
+
+"""
+Turns the [name]_[N].json copies older runs made of every changed video/user into history logs (See
+modules/History.py), then deletes them. Every version is checked to rebuild exactly before anything is deleted.
+Safe to stop and start again. Also prints any version of a video/user from its history.
+
+Examples:
+    python History_Compact.py --dry-run
+    python History_Compact.py
+    python History_Compact.py --show dQw4w9WgXcQ --version 2
+"""
+
+parser = argparse.ArgumentParser(description="Snapshot history compaction")
+parser.add_argument("--folder",action="append",help="Folder to compact (Repeatable). Defaults to the data folder and both users folders")
+parser.add_argument("--dry-run",action="store_true",help="Only report how much space it would save")
+parser.add_argument("--show",metavar="ID",help="Print a video/user from its history instead")
+parser.add_argument("--version",type=int,help="Version to --show, latest by default")
+args = parser.parse_args()
+
+folders = args.folder if args.folder is not None else [CFG.DATA_PATH,f"{CFG.DATA_PATH}/users",UC.USERS_PATH]
+folders = [folder for folder in folders if os.path.isdir(folder)]
+
+if args.show is not None:
+    for folder in folders:
+        if os.path.isfile(HIST.History_Path(folder,args.show)):
+            versions = [meta for meta, _ in HIST.Versions(folder,args.show)]
+            document = HIST.Load(folder,args.show,args.version)
+            if document is None:
+                LOG.logger.error(f"{args.show} has no version {args.version} (It has {versions[0]['version']} to {versions[-1]['version']}).")
+                sys.exit(1)
+            print(json.dumps(document,indent=4))
+            sys.exit(0)
+    LOG.logger.error(f"No history for {args.show} in {', '.join(folders)}")
+    sys.exit(1)
+
+total_before = 0
+total_after = 0
+compacted = 0
+removed = 0
+failed = 0
+
+for folder in folders:
+    legacy = HIST.Legacy_Snapshots(folder)
+    LOG.logger.info(f"{folder}: {len(legacy)} video(s)/user(s) with old copies.")
+    for name, copies in legacy.items():
+        try:
+            before, after = HIST.Compact(folder,name,copies,C.Fingerprint,dry_run=args.dry_run)
+        except Exception as e:
+            failed += 1
+            LOG.logger.error(f"Couldn't compact {name}: {e}")
+            continue
+        total_before += before
+        total_after += after
+        compacted += 1
+        removed += len(copies)
+
+LOG.logger.info(f"""
+{'Would compact' if args.dry_run else 'Compacted'}:  {compacted} video(s)/user(s), {removed} old copies {'to remove' if args.dry_run else 'removed'}
+Size:           {total_before / 1024:.0f}KB of copies -> {total_after / 1024:.0f}KB of history
+Failed:         {failed} (Left as they were)""")
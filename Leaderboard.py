@@ -0,0 +1,56 @@
+# Native Stuff
+import os,sys,argparse
+from datetime import datetime
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Leaderboard as LB
+
+"""
+Top chatters, words or emotes of the channel, a video or a time range. Approximate by default (From the sketches
+saved while writing messages, no database queries), --exact counts them from the messages table instead.
+Run with --rebuild once to build the sketches of videos written before they existed.
+
+Examples:
+    python Leaderboard.py chatters
+    python Leaderboard.py emotes --video dQw4w9WgXcQ --top 10
+    python Leaderboard.py words --start 2024-01-01 --end 2024-02-01 --exact
+    python Leaderboard.py chatters --rebuild
+"""
+
+parser = argparse.ArgumentParser(description="Chat leaderboards")
+parser.add_argument("kind",choices=["chatters","words","emotes"],help="What to rank")
+parser.add_argument("--video",default=None,help="Only this video")
+parser.add_argument("--start",default=None,type=datetime.fromisoformat,help="Earliest chat (YYYY-MM-DD[ HH:MM:SS], UTC)")
+parser.add_argument("--end",default=None,type=datetime.fromisoformat,help="Latest chat (YYYY-MM-DD[ HH:MM:SS], UTC)")
+parser.add_argument("--top",default=20,type=int,help="Places to show")
+parser.add_argument("--exact",action="store_true",help="Count from the messages table (Slow on big channels)")
+parser.add_argument("--rebuild",action="store_true",help="Build the missing sketches from the messages table first")
+args = parser.parse_args()
+
+db = None
+if args.exact == True or args.rebuild == True:
+    db = DB.PostgresClass()
+
+if args.rebuild == True:
+    LOG.logger.info(f"{LB.Rebuild(db)} video(s) sketched.")
+
+if args.exact == True:
+    leaders = LB.Exact(db.cursor,args.kind,args.top,args.video,args.start,args.end)
+    source = "messages table"
+else:
+    leaders, videos = LB.Approximate(args.kind,args.top,args.video,args.start,args.end)
+    source = f"sketches of {videos} video(s)"
+
+for place, leader in enumerate(leaders,1):
+    name = leader.label if leader.label == leader.item else f"{leader.label} ({leader.item})"
+    count = f"{leader.count}" if leader.error == 0 else f"~{leader.count} (At least {leader.count - leader.error})"
+    LOG.logger.info(f"{place:>3}. {name}: {count}")
+
+LOG.logger.info(f"\n{len(leaders)} place(s) from the {source}.")
+
+if db is not None:
+    db.Close()
@@ -5,14 +5,22 @@ sys.path.append(os.getcwd())
 
 # Installed Stuff
 from tqdm import tqdm
-import chat_downloader
-import chat_downloader.errors
 
 # Other Project Files
 import modules.Settings as CFG
 import modules.logconfig as LOG
 import modules.Classes as C
 import modules.Database as DB
+import modules.Export as EX
+import modules.Spool as SP
+import modules.WorkQueue as WQ
+import modules.Scheduler as SCH
+import modules.LiveStats as LS
+import modules.Fixtures as FX
+import modules.Images as IMG
+import modules.RunLedger as RL
+import modules.Profiler as PF
+import modules.Sketches as SK
 
 """
 ---------------
@@ -56,6 +64,9 @@ https://github.com/xenova/chat-downloader
 
 """
 
+# Sampling profiler, off unless PROFILE/YTDB_PROFILE/--profile asks for it or it's sent SIGUSR1 (See Profiler.py)
+PF.Install()
+
 # Create the data paths if they don't exist
 if os.path.isdir(CFG.DATA_PATH):
     pass
@@ -64,8 +75,30 @@ else:
 
 # Initialize database connection and setup the API calls
 db = DB.PostgresClass()
+# This run's numbers and how long each stage took go in the runs table (See RunLedger.py, Runs.py)
+run = RL.Run(db)
+run.Stage("startup")
 yt = C.YT_API(db)
 
+# Downloaded chat goes to the spool first, the committer writes it to the database in the background
+spool = SP.Spool()
+committer = SP.Committer(spool)
+committer.start()
+if spool.Pending() > 0:
+    LOG.logger.info(f"Replaying {spool.Pending()} spooled message(s) left over from the last run.")
+
+# Rolling numbers of live chats for overlays/dashboards (See LiveStats.py)
+live_stats_server = None
+if CFG.LIVE_STATS == True:
+    yt.live_stats = LS.LiveStats()
+    live_stats_server = LS.Serve(yt.live_stats)
+
+# Upcoming and live streams get their own chat watchers, so they never hold up the rest (See Scheduler.py)
+scheduler = None
+if CFG.LIVE_SCHEDULER == True:
+    scheduler = SCH.LiveScheduler(yt,spool)
+    scheduler.start()
+
 #################################
 ### VIDEO AND CHAT PROCESSING ###
 #################################
@@ -74,18 +107,100 @@ yt = C.YT_API(db)
 vid_stats = C.VideoStats()
 all_chat_stats = C.ChatStats()
 
+run.Stage("video_list")
 LOG.logger.info("\nObtaining all videos from Youtube API...")
 video_ids = yt.Get_All_Videos()
 LOG.logger.info(f"Total of {len(video_ids)} video(s) aquired.")
 
+# Everything the database already knows about the videos, in one pass: {id: processed}
+known_videos = {row[0]:row[1] for row in DB.StreamEntries(db.database,"videos","id,processed",as_dict=False)}
+
+# Database clock, so every worker agrees on when this run started
+db.cursor.execute("SELECT now()")
+run_started = db.cursor.fetchone()[0]
+db.database.commit()
+
+# Queue up everything that still needs doing. Other workers on the same database share the queue (See WorkQueue.py)
+WQ.Enqueue(db,WQ.VIDEO,[(video_id,None) for video_id in video_ids if known_videos.get(video_id) != True],run_started)
+vid_stats.skipped_videos = sum(1 for video_id in video_ids if known_videos.get(video_id) == True)
+
+# Keeps the leases of whatever this worker claims alive, streams stay leased for as long as they're being watched
+heartbeat = WQ.Heartbeat()
+heartbeat.start()
+
+# Streams already known to be coming up don't have to wait for the backfill to reach them. Only the ones this worker
+# gets to claim are watched here, the rest belong to whichever worker claimed them
+if scheduler is not None:
+    unfinished = SCH.Unfinished_Streams(db.cursor)
+    WQ.Enqueue(db,WQ.VIDEO,[(stream.id,None) for stream in unfinished],run_started)
+    claimed = {job["item"] for job in WQ.Claim(db,WQ.VIDEO,items=[stream.id for stream in unfinished])}
+    for stream in unfinished:
+        if stream.id in claimed and scheduler.Add(stream) == False:
+            WQ.Complete(db,WQ.VIDEO,stream.id) # Too far off, the next run queues it again
+
+# Videos whose chat is downloaded but still on its way to the database
+waiting_videos:list[C.VideoClass] = []
+
+def Complete_Videos(wait=False):
+    """Finishes up the videos the committer has fully written to the database. Set wait to block until all are done."""
+    for vid in list(waiting_videos):
+        if wait == True:
+            spool.Wait_Drained(vid.id)
+        elif spool.Pending(vid.id) > 0:
+            continue
+        waiting_videos.remove(vid)
+
+        chat_stats = committer.Take_Stats(vid.id)
+        if CFG.SKETCHES == True:
+            SK.Save_Chat_Sketches(vid.id,chat_stats.sketches) # Approximate leaderboards, see Leaderboard.py
+        chat_stats.append_all(all_chat_stats) # Update the global stats for chats and users
+        spool.Release(vid.id) # Writes the JSON file of the messages
+        DB.Refresh_Video_Summary(db.cursor,vid.id) # Only touches this video's partition
+        db.database.commit()
+        if CFG.COLUMNAR_EXPORT == True:
+            EX.Export_Video(db,vid.id)
+        # Only marked as processed once every message is safely in the database
+        if vid.livestream == False:
+            DB.UpdateEntry(db.cursor,"videos","processed",True,"id",vid.id)
+            db.database.commit()
+        WQ.Complete(db,WQ.VIDEO,vid.id)
+
+def Complete_Streams():
+    """
+    Picks up the streams whose watcher is done, refreshes their details (End time etc.) and finishes them like any other
+    video. Their queue items stay leased while they're watched and are completed once their chat is in (Complete_Videos).
+    """
+    if scheduler is None:
+        return
+    for video_id in scheduler.Finished():
+        stored = DB.GetEntries(db.cursor,"videos","fingerprint",{"id":video_id})
+        try:
+            vid = yt.Get_Video_Info(video_id,stored[0]["fingerprint"] if len(stored) > 0 else None,len(stored) > 0)
+        except Exception as u:
+            LOG.logger.error(f"Unknown error refreshing stream {video_id}, its chat is kept but it's left unprocessed: {u}")
+            db.database.rollback()
+            WQ.Fail(db,WQ.VIDEO,video_id,u)
+            continue
+        if vid is None:
+            WQ.Complete(db,WQ.VIDEO,video_id)
+            continue
+        if vid.status != "Existing":
+            DB.UpsertEntries(db.cursor,"videos",[vid.entry],"id")
+            db.database.commit()
+        waiting_videos.append(vid)
+
+run.Stage("videos")
 LOG.logger.info("Processing videos for details, thumbnail, and chat messages...")
 with LOG.TQDM_Logging():
-    with tqdm(desc='Videos Processed',total=len(video_ids),bar_format='{desc}: {n_fmt}/{total_fmt} || {postfix}',ncols=80,postfix="",position=0,leave=False) as vidbar:
-        # Get all videos in the hidden playlist then use generator to pass each id to loop
-        for video_id in video_ids:
+    with tqdm(desc='Videos Processed',total=len(video_ids),initial=vid_stats.skipped_videos,bar_format='{desc}: {n_fmt}/{total_fmt} || {postfix}',ncols=80,postfix="",position=0,leave=False) as vidbar:
+        # Claim videos from the queue one at a time until there's nothing left that nobody else is working on
+        for job in WQ.Claimed(db,WQ.VIDEO):
+            video_id = job["item"]
+            PF.Tag(video=video_id)
+            queue_state = WQ.Progress(db,WQ.VIDEO)
 
             def Update_Postfix_Videos():
-                return f"Current Video: {video_id} | Sucessful: {vid_stats.success_videos} | Skipped: {vid_stats.skipped_videos} | No Chat: {vid_stats.no_chat_videos} | Unavailable: {vid_stats.unavailable_videos} | Errors: {vid_stats.error_videos}"
+                return f"Current Video: {video_id} | Sucessful: {vid_stats.success_videos} | Skipped: {vid_stats.skipped_videos} | No Chat: {vid_stats.no_chat_videos} | Unavailable: {vid_stats.unavailable_videos} | Errors: {vid_stats.error_videos} | Queue: {queue_state['pending']} Pending, {queue_state['leased']} Claimed"
 
             vidbar.set_postfix_str(Update_Postfix_Videos())
 
@@ -93,11 +208,14 @@ with LOG.TQDM_Logging():
             #-- LOOK FOR VIDEO IN DATABASE --#
             #--------------------------------#
 
-            # Don't do any processing if the current video_id has already been processed
-            complete_video = DB.GetEntries(db.cursor,"videos","title,processed",{"id":video_id,"processed":True})
-            video_exists = True if len(DB.GetEntries(db.cursor,"videos","title",{"id":video_id})) > 0 else False
-            if len(complete_video) > 0:
+            # Checked again after claiming, another worker may have finished it since the run started
+            stored = DB.GetEntries(db.cursor,"videos","processed,fingerprint",{"id":video_id})
+            video_exists = len(stored) > 0
+            video_processed = stored[0]["processed"] if video_exists else False
+            video_fingerprint = stored[0]["fingerprint"] if video_exists else None
+            if video_processed == True:
                 vid_stats.skipped_videos += 1
+                WQ.Complete(db,WQ.VIDEO,video_id)
                 vidbar.set_postfix_str(Update_Postfix_Videos())
                 vidbar.update(1)
                 continue
@@ -108,10 +226,11 @@ with LOG.TQDM_Logging():
 
             # Get video data from API, check if it's been updated, and return the data as a class
             try:
-                vid = yt.Get_Video_Info(video_id)
+                vid = yt.Get_Video_Info(video_id,video_fingerprint,video_exists)
             except Exception as u:
                 vid_stats.error_videos += 1
                 LOG.logger.error(f"Unknown error parsing video: {u}")
+                WQ.Fail(db,WQ.VIDEO,video_id,u)
                 vidbar.set_postfix_str(Update_Postfix_Videos())
                 vidbar.update(1)
                 continue
@@ -119,6 +238,7 @@ with LOG.TQDM_Logging():
             # Make sure the video still exists before trying to process it.
             if vid is None:
                 vid_stats.skipped_videos += 1
+                WQ.Complete(db,WQ.VIDEO,video_id)
                 vidbar.set_postfix_str(Update_Postfix_Videos())
                 vidbar.update(1)
                 continue
@@ -127,90 +247,149 @@ with LOG.TQDM_Logging():
             #-- GET VIDEO THUMBNAIL --#
             #-------------------------#
 
-            # Currently has no relation to the database, just saving it to file
-            vid.Get_Thumbnail()
+            # Saved to file, the database only remembers the URL/ETag so unchanged thumbnails are skipped next time
+            vid.Get_Thumbnail(db)
 
             #---------------------------------------#
             #-- INSERT/UPDATE VIDEO INTO DATABASE --#
             #---------------------------------------#
 
-            # Will update the video in database if something changed in the returned JSON data
-            if video_exists == False:
-                DB.InsertEntries(db.cursor,"videos",[vid.entry])
+            # Will insert or update the video in one statement if its fingerprint changed
+            if vid.status != "Existing":
+                DB.UpsertEntries(db.cursor,"videos",[vid.entry],"id")
                 db.database.commit()
-            elif vid.status == "Update":
-                for column, value in vid.entry.items():
-                    DB.UpdateEntry(db.cursor,"videos",column,value,"id",vid.id)
-                    db.database.commit()
+
+            #-------------------------------#
+            #-- HAND STREAMS TO A WATCHER --#
+            #-------------------------------#
+
+            # Upcoming/live chat is watched in the background while the backfill moves on
+            if scheduler is not None and vid.livestream == True:
+                vid_stats.still_live += 1
+                if scheduler.Add(SCH.LiveStream.From_Video(vid)) == False:
+                    LOG.logger.info(f"Stream {vid.id} isn't within {CFG.LIVE_HORIZON_HOURS} hour(s) of its scheduled start, leaving it for a later run.")
+                    WQ.Complete(db,WQ.VIDEO,vid.id) # Not processed, so the next run queues it again if it's still not over
+                # Otherwise the item stays leased (And heartbeated) until Complete_Streams wraps the stream up, so no
+                # other worker downloads it too
+                Complete_Streams()
+                Complete_Videos()
+                vidbar.set_postfix_str(Update_Postfix_Videos())
+                vidbar.update(1)
+                continue
 
             #-----------------------------#
             #-- GET VIDEO CHAT MESSAGES --#
             #-----------------------------#
 
-            # Get the YTC messages from the video and put them into the database
+            # Get the YTC messages from the video and spool them for the database. The queue item is completed once it's all in.
             try:
-                message_stats = yt.Get_Messages(vid)
-                message_stats.append_all(all_chat_stats) # Update the global stats for chats and users
-                if vid.livestream == False:
-                    DB.UpdateEntry(db.cursor,"videos","processed",True,"id",vid.id)
-                    db.database.commit()
+                yt.Get_Messages(vid,spool,live=vid.islive)
+                waiting_videos.append(vid)
                 vid_stats.success_videos += 1
                 if vid.livestream == True:
                     vid_stats.still_live += 1
             # Regular videos (or streams that have been edited) have no chat
-            except chat_downloader.errors.NoChatReplay as e:
+            except C.NoChatReplay as e:
                 if vid.livestream == False:
                     DB.UpdateEntry(db.cursor,"videos","processed",True,"id",vid.id)
                     db.database.commit()
                 vid_stats.no_chat_videos += 1
+                WQ.Complete(db,WQ.VIDEO,vid.id)
                 LOG.logger.warning(f"No Chat Replay available.")
             # Catch when a video goes private or is members-only
-            except chat_downloader.errors.VideoUnplayable as f:
+            except C.VideoUnplayable as f:
                 vid_stats.unavailable_videos += 1
+                WQ.Complete(db,WQ.VIDEO,vid.id) # Not processed, so the next run queues it again
                 LOG.logger.warning(f"Video inaccessible, skipping.")
-            # Catch any unknown errors
+            # Catch any unknown errors, the video goes back in the queue for another try
             except Exception as u:
                 vid_stats.error_videos += 1
+                WQ.Fail(db,WQ.VIDEO,vid.id,u)
                 LOG.logger.error(f"Unknown error parsing video: {u}")
 
+            Complete_Streams()
+            Complete_Videos()
+
             vidbar.set_postfix_str(Update_Postfix_Videos())
             vidbar.update(1)
 
+# Streams still coming up or live keep this worker around until they're over
+run.Stage(RL.LIVE_WAIT)
+if scheduler is not None:
+    if scheduler.Active() > 0:
+        LOG.logger.info(f"Backfill done, waiting for {scheduler.Active()} upcoming/live stream(s) to finish...")
+    while scheduler.Active() > 0:
+        scheduler.Wait(60)
+        Complete_Streams()
+        Complete_Videos()
+    scheduler.Stop()
+    Complete_Streams()
+
+if live_stats_server is not None:
+    live_stats_server.shutdown()
+
+# Let the committer catch up on everything that was downloaded
+run.Stage("drain")
+if spool.Pending() > 0:
+    LOG.logger.info(f"Waiting for {spool.Pending()} spooled message(s) to reach the database...")
+Complete_Videos(wait=True)
+spool.Wait_Drained()
+for video_id in spool.Videos():
+    spool.Release(video_id) # Leftovers from failed downloads or an earlier run
+committer.Stop()
+spool.Close()
+
 LOG.logger.info("Video and chat processing complete.\n")
 
+# Catch up the columnar exports for any videos processed before exporting was turned on
+if CFG.COLUMNAR_EXPORT == True:
+    run.Stage("export")
+    LOG.logger.info("Checking columnar chat exports...")
+    LOG.logger.info(f"{EX.Export_Missing(db)} video(s) exported.\n")
+
 #######################
 ### USER PROCESSING ###
 #######################
 
 # Users have to be done in batches of 50 manually because the API call does not give a "next page" item like the videos....
-def Batch_Users(users):
-    """Yeilds users in batches of 50"""
-    for i in range(0,len(users),50):
-        yield users[i:i + 50]
-
-LOG.logger.info("Obtaining all unprocessed users from database...")
-# Get fresh users from the DB
-unique_users = DB.GetEntries(db.cursor,"user_ids","id",{"processed":False})
-LOG.logger.info(f"Total of {len(unique_users)} unique user(s) aquired.")
-
-# List of IDs
-user_list = [str(v) for d in unique_users for v in d.values()]
-
-if len(user_list) > 0:
+# The batches go through the work queue too, so several workers can split them.
+run.Stage("users")
+PF.Tag(video=None)
+LOG.logger.info("Queueing all unprocessed users from database...")
+WQ.Enqueue_User_Batches(db,run_started)
+# Count the fresh users for the progress bar
+user_count = DB.CountEntries(db.cursor,"user_ids",{"processed":False})
+LOG.logger.info(f"Total of {user_count} unique user(s) aquired.")
 
+if user_count > 0:
 
     def Update_Postfix_Users():
         return f"Skipped: {all_chat_stats.invalid_users}"
 
     with LOG.TQDM_Logging():
-        with tqdm(Batch_Users(user_list),desc='Users Processed',total=len(user_list),bar_format='{desc}: {n_fmt}/{total_fmt} || {postfix}',ncols=80,postfix=Update_Postfix_Users(),position=0,leave=False) as userbar:
-            for users in userbar:
-                all_chat_stats.invalid_users += yt.Get_User_Batch(users)
+        with tqdm(desc='Users Processed',total=user_count,bar_format='{desc}: {n_fmt}/{total_fmt} || {postfix}',ncols=80,postfix=Update_Postfix_Users(),position=0,leave=False) as userbar:
+            for job in WQ.Claimed(db,WQ.USERS):
+                users = job["payload"]
+                try:
+                    all_chat_stats.invalid_users += yt.Get_User_Batch(users)
+                    WQ.Complete(db,WQ.USERS,job["item"])
+                except Exception as u:
+                    LOG.logger.error(f"Unknown error getting users: {u}")
+                    db.database.rollback()
+                    WQ.Fail(db,WQ.USERS,job["item"],u)
                 userbar.set_postfix_str(Update_Postfix_Users())
                 userbar.update(len(users))
 
+heartbeat.Stop()
+
+if yt.user_cache is not None:
+    LOG.logger.info(yt.user_cache.Report())
+    yt.user_cache.Close()
+
 LOG.logger.info("User processing complete.\n")
 
+run.Finish(vid_stats,all_chat_stats,yt.api_units,yt.api_bytes + spool.downloaded_bytes + IMG.downloaded_bytes)
+
 LOG.logger.info(f"""
 ---VIDEO STATISTICS---
 
@@ -230,8 +409,18 @@ Existing:       {all_chat_stats.existing_messages}
 
 ---USER STATISTICS---
 
-Unique Users:   {all_chat_stats.new_user_ids + len(all_chat_stats.exist_user_ids)}
+Unique Users:   {len(all_chat_stats.unique_user_ids)}
 New:            {all_chat_stats.new_user_ids}
-Existing:       {len(all_chat_stats.exist_user_ids)}
+Existing:       {max(len(all_chat_stats.unique_user_ids) - all_chat_stats.new_user_ids,0)}
 Invalid:        {all_chat_stats.invalid_users}
-""")
\ No newline at end of file
+""")
+LOG.logger.info(run.Report())
+
+# Which database statements the run spent its time on
+if CFG.DB_TRACE == True:
+    LOG.logger.info(DB.Trace_Report())
+
+# What this run recorded or replayed instead of going to the network
+if CFG.FIXTURES is not None:
+    LOG.logger.info(FX.Store().Report())
+    FX.Store().Close()
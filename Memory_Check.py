@@ -0,0 +1,120 @@
+# Native Stuff
+import os,sys,time,argparse,tempfile,threading
+from typing import Any,Iterator
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Classes as C
+import modules.Spool as SP
+import modules.RunLedger as RL
+
+"""
+Checks that processing a chat doesn't need more memory the longer the chat is. Runs a synthetic chat through the
+same Get_Messages -> spool -> stats -> archive path as Main.py, in a temporary directory and without a database or
+the YouTube API, and fails if peak memory kept growing after the first 10% of it.
+
+The default 500k messages from 150k chatters (Past DISTINCT_EXACT_LIMIT, so the estimate takes over) takes about 2
+minutes. A 24 hour subathon is closer to 5M messages (--messages 5000000), which takes over half an hour.
+
+Examples:
+    python Memory_Check.py
+    python Memory_Check.py --messages 5000000 --chatters 250000
+"""
+
+parser = argparse.ArgumentParser(description="Memory regression check for long chats")
+parser.add_argument("--messages",default=500000,type=int,help="Length of the synthetic chat")
+parser.add_argument("--chatters",default=150000,type=int,help="Distinct users sending them")
+parser.add_argument("--max-growth-mb",default=64,type=int,help="Most the peak may grow after warm-up before the check fails")
+args = parser.parse_args()
+
+def Synthetic_Chat(count:int,chatters:int) -> Iterator[dict[str,Any]]:
+    """ChatDownloader shaped messages, generated as they're needed."""
+    for i in range(count):
+        user = f"UC{(i * 7919) % chatters:022d}"
+        yield {
+            "message_id":f"MEMCHECK.{i}",
+            "message":f"Synthetic message number {i} kiwawa",
+            "timestamp":1700000000000000 + i * 17000,
+            "time_in_seconds":i * 0.017,
+            "message_type":"text_message",
+            "author":{"id":user,"name":f"Chatter {user[-6:]}","badges":[{"title":"Member (2 months)"}]},
+        }
+
+def MB(value:float|None) -> str:
+    return f"{value:.0f}MB" if value is not None else "Unknown"
+
+class No_API:
+    """Stands in for the Youtube API, nothing in the check calls it."""
+
+with tempfile.TemporaryDirectory() as data_path:
+    CFG.DATA_PATH = data_path
+    CFG.USER_CACHE = False
+    video = C.VideoClass({"id":"MEMCHECK","snippet":{"title":"Memory Check","liveBroadcastContent":"none"}},"New")
+    spool = SP.Spool(f"{data_path}/Spool_Memory_Check.sqlite3")
+    yt = C.YT_API(None,api=No_API())
+    stats = C.ChatStats()
+
+    warmup_at = args.messages // 10
+    warmup_peak = None
+    started = time.perf_counter()
+
+    # Download side on its own thread like a live stream watcher, the synthetic chat stands in for ChatDownloader
+    download:dict[str,Any] = {"spooled":0,"error":None}
+    def Download():
+        try:
+            download["spooled"] = yt.Get_Messages(video,spool,show_progress=False,chat=Synthetic_Chat(args.messages,args.chatters))
+        except Exception as e:
+            download["error"] = e
+    downloader = threading.Thread(target=Download,name="Memory Check Download")
+    downloader.start()
+
+    # Committer side: drain in batches and count them like Write_Messages would into an empty database
+    drained = 0
+    while True:
+        finished = not downloader.is_alive()
+        rows = spool.Next_Batch(CFG.SPOOL_BATCH)
+        if len(rows) == 0:
+            if finished:
+                break
+            spool.Wait_For_Messages(1)
+            continue
+        new_users = {parsed["entry"]["user_id"] for _, _, parsed in rows}
+        new_messages = {(video_id,parsed["entry"]["message_id"]) for _, video_id, parsed in rows}
+        for batch_stats in SP.Batch_Stats(rows,new_users,new_messages).values():
+            batch_stats.append_all(stats)
+        spool.Mark([row[0] for row in rows],SP.COMMITTED)
+        drained += len(rows)
+        if warmup_peak is None and drained >= warmup_at:
+            warmup_peak = RL.Peak_Memory_MB()
+    spool_peak = RL.Peak_Memory_MB()
+
+    # Archive side: page the spool into [video_id]_Messages.json, then stream it back like a skip_download run
+    spool.Release(video.id)
+    release_peak = RL.Peak_Memory_MB()
+    archived = sum(1 for _ in C.Read_Message_Archive(video.id))
+    read_peak = RL.Peak_Memory_MB()
+    spool.Close()
+
+    if warmup_peak is None:
+        warmup_peak = spool_peak
+    growth = read_peak - warmup_peak if read_peak is not None and warmup_peak is not None else None
+    expected_chatters = min(args.messages,args.chatters)
+    LOG.logger.info(f"""
+Messages:       {download['spooled']} spooled, {stats.total_messages} drained, {archived} archived in {time.perf_counter() - started:.0f}s
+Chatters:       {len(stats.unique_user_ids)} counted ({'exact' if stats.unique_user_ids.exact else 'estimated'}), {expected_chatters} sent messages
+Peak Memory:    {MB(warmup_peak)} after {warmup_at} messages | {MB(spool_peak)} spooled | {MB(release_peak)} archived | {MB(read_peak)} read back
+Growth:         {MB(growth)} (Allowed {args.max_growth_mb}MB)""")
+
+    if download["error"] is not None:
+        LOG.logger.error(f"Get_Messages failed: {download['error']}")
+    if growth is None:
+        LOG.logger.error("Peak memory can't be read on this platform, nothing to check.")
+    failed = download["error"] is not None or growth is None or archived != args.messages or growth > args.max_growth_mb
+
+if failed:
+    LOG.logger.error("Memory check failed.")
+    sys.exit(1)
+LOG.logger.info("Memory check passed.")
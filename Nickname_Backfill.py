@@ -0,0 +1,25 @@
+# Native Stuff
+import os,sys
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Backfill as BF
+
+"""
+Run this after adding or removing rows in the nicknames table. Messages already in the database get their
+nickname_matches brought up to date (See modules/Backfill.py). Safe to stop and start again, it resumes.
+Refresh the nickname_summary materialized view afterwards.
+"""
+
+db = DB.PostgresClass()
+
+BF.Run_Backfill(db)
+
+if CFG.DB_TRACE == True:
+    LOG.logger.info(DB.Trace_Report())
+
+db.Close()
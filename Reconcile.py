@@ -0,0 +1,65 @@
+# Native Stuff
+import os,sys,time,argparse
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Spool as SP
+import modules.Reconcile as RC
+
+"""
+Checks that the messages table and the [video_id]_Messages.json archives hold the same messages (See
+modules/Reconcile.py), e.g. after a crash or fixing an archive by hand. Only reports by default, repairs with the
+flags below. Best run while no other worker is downloading.
+
+Examples:
+    python Reconcile.py
+    python Reconcile.py --video dQw4w9WgXcQ --show 20
+    python Reconcile.py --repair-database --repair-archive
+"""
+
+parser = argparse.ArgumentParser(description="Database/archive reconciliation")
+parser.add_argument("--video",action="append",help="Only check this video (Repeatable)")
+parser.add_argument("--workers",type=int,help=f"Parallel connections/readers (Default {CFG.RECONCILE_WORKERS})")
+parser.add_argument("--show",default=5,type=int,help="Missing message IDs to list per video")
+parser.add_argument("--repair-database",action="store_true",help="Write messages only the archives have to the database")
+parser.add_argument("--repair-archive",action="store_true",help="Append messages only the database has to the archives")
+args = parser.parse_args()
+
+db = DB.PostgresClass()
+spool = SP.Spool()
+started = time.perf_counter()
+
+checks = RC.Check(db,spool,args.video,args.workers)
+different = [check for check in checks if check.status != RC.VideoCheck.MATCH]
+
+for check in different:
+    details = f"{check.video_id} ({check.status}): {len(check.missing_in_database)} missing in the database, {len(check.missing_in_archive)} missing in the archive"
+    if check.duplicates > 0:
+        details += f", {check.duplicates} duplicate(s) in the archive"
+    if args.show > 0:
+        if len(check.missing_in_database) > 0:
+            details += f"\n    Not in the database: {', '.join(check.missing_in_database[:args.show])}"
+        if len(check.missing_in_archive) > 0:
+            details += f"\n    Not in the archive:  {', '.join(check.missing_in_archive[:args.show])}"
+    LOG.logger.warning(details)
+
+written = 0
+appended = 0
+for check in different:
+    if args.repair_database == True:
+        written += RC.Repair_Database(db,check)
+    if args.repair_archive == True:
+        appended += RC.Repair_Archive(db,spool,check)
+
+LOG.logger.info(f"""
+Videos:         {len(checks)} checked in {time.perf_counter() - started:.0f}s, {len(checks) - len(different)} match
+Database:       {sum(len(check.missing_in_database) for check in different)} message(s) missing{f', {written} written' if args.repair_database else ''}
+Archives:       {sum(len(check.missing_in_archive) for check in different)} message(s) missing{f', {appended} appended' if args.repair_archive else ''}
+Duplicates:     {sum(check.duplicates for check in different)} in the archives""")
+
+spool.Close()
+db.Close()
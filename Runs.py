@@ -0,0 +1,74 @@
+# Native Stuff
+import os,sys,argparse,statistics
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.RunLedger as RL
+
+"""
+Lists the latest runs of the channel from the runs table (See modules/RunLedger.py) with their throughput next to
+the median of the runs before them, flags the ones that were much slower, and compares the older half of the list
+with the newer half to show if runs are getting slower as the tables grow.
+
+Examples:
+    python Runs.py
+    python Runs.py --last 100 --window 20 --factor 2
+    python Runs.py --slow --stages
+"""
+
+parser = argparse.ArgumentParser(description="Run ledger report")
+parser.add_argument("--last",default=30,type=int,help="Runs to list")
+parser.add_argument("--window",type=int,help=f"Runs in the rolling median (Default {CFG.RUN_MEDIAN_WINDOW})")
+parser.add_argument("--factor",type=float,help=f"Times slower than the median that gets flagged (Default {CFG.RUN_SLOW_FACTOR})")
+parser.add_argument("--slow",action="store_true",help="Only list flagged runs")
+parser.add_argument("--stages",action="store_true",help="Also list the seconds of each stage")
+args = parser.parse_args()
+
+db = DB.PostgresClass()
+window = args.window if args.window is not None else CFG.RUN_MEDIAN_WINDOW
+# Runs before the first one listed are needed for its median
+runs = RL.Recent_Runs(db.cursor,args.last + window)
+db.database.commit()
+trends = RL.Analyze(runs,window,args.factor)[-args.last:]
+
+def Rate(value:float|None) -> str:
+    return f"{value:.0f}/s" if value is not None else "-"
+
+LOG.logger.info(f"{'Run':>6} {'Started':<16} {'Time':>7} {'Videos':>6} {'New Msgs':>9} {'Rate':>7} {'Median':>7} {'Users':>6} {'MB':>7} {'Units':>5} {'Peak MB':>7} {'In Table':>11}")
+for trend in trends:
+    run = trend.run
+    if args.slow == True and len(trend.flags) == 0:
+        continue
+    seconds = f"{float(run['seconds']) / 60:.1f}m" if run["seconds"] is not None else "-"
+    downloaded = f"{run['downloaded_bytes'] / 1048576:.1f}" if run["downloaded_bytes"] is not None else "-"
+    peak_memory = f"{float(run['peak_memory_mb']):.0f}" if run["peak_memory_mb"] is not None else "-"
+    line = (f"{run['run_id']:>6} {run['started']:%Y-%m-%d %H:%M} {seconds:>7} {run['videos'] or 0:>6} {run['new_messages'] or 0:>9} "
+            f"{Rate(trend.throughput):>7} {Rate(trend.median):>7} {run['new_users'] or 0:>6} {downloaded:>7} {run['api_units'] or 0:>5} "
+            f"{peak_memory:>7} {run['messages_in_table'] or 0:>11}")
+    if len(trend.flags) > 0:
+        LOG.logger.warning(f"{line}\n    {'; '.join(trend.flags)}")
+    else:
+        LOG.logger.info(line)
+    if args.stages == True and run["stages"] is not None:
+        LOG.logger.info("    " + ", ".join(f"{stage} {seconds:.0f}s" for stage, seconds in run["stages"].items()))
+
+# Older half against newer half of the listed runs
+rated = [trend for trend in trends if trend.throughput is not None]
+if len(rated) >= 4:
+    older, newer = rated[:len(rated) // 2], rated[len(rated) // 2:]
+    before = statistics.median(trend.throughput for trend in older)
+    after = statistics.median(trend.throughput for trend in newer)
+    table_before = statistics.median(trend.run["messages_in_table"] or 0 for trend in older)
+    table_after = statistics.median(trend.run["messages_in_table"] or 0 for trend in newer)
+    LOG.logger.info(f"""
+Throughput:     {before:.0f}/s -> {after:.0f}/s ({(after - before) / before * 100:+.0f}%), median of the older and newer {len(older)}/{len(newer)} runs
+Table Size:     {table_before:.0f} -> {table_after:.0f} messages
+Flagged:        {sum(1 for trend in trends if len(trend.flags) > 0)} of {len(trends)} run(s)""")
+else:
+    LOG.logger.info(f"\n{len(trends)} run(s), not enough with over {RL.MIN_MESSAGES} new messages to show a trend yet.")
+
+db.Close()
@@ -0,0 +1,45 @@
+# Native Stuff
+import os,sys,argparse
+from datetime import datetime
+
+sys.path.append(os.getcwd())
+
+# Other Project Files
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Search as S
+
+"""
+Searches the chat messages stored in the database. Uses the same Settings.py prompts as Main.py to pick the database.
+
+Examples:
+    python Search.py "good morning"
+    python Search.py kiwawa --words --video dQw4w9WgXcQ
+    python Search.py --user-name "Some Chatter" --start 2024-01-01 --end 2024-02-01
+"""
+
+parser = argparse.ArgumentParser(description="Search stored chat messages")
+parser.add_argument("text",nargs="?",default=None,help="Text to look for (Case-insensitive)")
+parser.add_argument("--words",action="store_true",help="Only match the text as whole words")
+parser.add_argument("--user-id",default=None,help="Channel ID of the sender")
+parser.add_argument("--user-name",default=None,help="Display name of the sender")
+parser.add_argument("--video",default=None,help="Video ID to search in")
+parser.add_argument("--start",default=None,type=datetime.fromisoformat,help="Earliest message time (YYYY-MM-DD[ HH:MM:SS], UTC)")
+parser.add_argument("--end",default=None,type=datetime.fromisoformat,help="Latest message time (YYYY-MM-DD[ HH:MM:SS], UTC)")
+parser.add_argument("--limit",default=50,type=int,help="Hits per page")
+parser.add_argument("--page",default=None,help="Page token printed at the end of a previous search")
+args = parser.parse_args()
+
+db = DB.PostgresClass()
+
+result = S.Search_Messages(db.cursor,text=args.text,user_id=args.user_id,user_name=args.user_name,video_id=args.video,
+                           start=args.start,end=args.end,whole_words=args.words,limit=args.limit,page=args.page)
+
+for hit in result.hits:
+    LOG.logger.info(f"[{hit['datetime']}] {hit['user_name']}: {hit['message']}\n    {hit['link']}")
+
+LOG.logger.info(f"\n{len(result.hits)} hit(s).")
+if result.next_page is not None:
+    LOG.logger.info(f"More results: --page {result.next_page}")
+
+db.Close()
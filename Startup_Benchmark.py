@@ -0,0 +1,69 @@
+# Native Stuff
+import os,sys,json,time,argparse,statistics,subprocess
+
+sys.path.append(os.getcwd())
+
+"""
+Measures how long a fresh run takes to get going: importing the project, authenticating and building the API client,
+and the first API request. Every sample is a new Python process (Imports are only slow the first time), the medians
+are reported.
+
+Set YTDB_LOG, YTDB_MEMBERS, YTDB_TIMEOUT, YTDB_DATA_DIRECTORY and YTDB_SECRETS_DIRECTORY first so the Settings.py
+prompts don't end up in the timings. Without a saved token (Or with --imports-only) only the imports are timed.
+To see which import is the slow one: python -X importtime -c "import modules.Classes"
+
+Examples:
+    python Startup_Benchmark.py
+    python Startup_Benchmark.py --runs 10 --imports-only
+"""
+
+parser = argparse.ArgumentParser(description="Startup time benchmark")
+parser.add_argument("--runs",default=5,type=int,help="Fresh processes to time")
+parser.add_argument("--imports-only",action="store_true",help="Don't authenticate or call the API (Works offline)")
+parser.add_argument("--child",action="store_true",help=argparse.SUPPRESS) # One sample, prints its timings as JSON
+args = parser.parse_args()
+
+def Child():
+    """Times one startup in this process and prints it for the parent."""
+    timings = {}
+    started = time.perf_counter()
+    import modules.Settings as CFG
+    timings["Settings"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    import modules.Classes as C
+    timings["Imports"] = time.perf_counter() - mark
+
+    if args.imports_only == False and os.path.exists(CFG.TOKEN_PICKLE_FILE):
+        mark = time.perf_counter()
+        yt = C.YT_API(None)
+        timings["Auth + API Client"] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        yt.Get_Upload_Count()
+        timings["First Request"] = time.perf_counter() - mark
+
+        if yt.user_cache is not None:
+            yt.user_cache.Close()
+
+    timings["Total"] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+if args.child == True:
+    Child()
+    sys.exit(0)
+
+import modules.logconfig as LOG
+
+samples:dict[str,list[float]] = {}
+for run in range(args.runs):
+    command = [sys.executable,os.path.abspath(__file__),"--child"] + (["--imports-only"] if args.imports_only else [])
+    result = subprocess.run(command,capture_output=True,text=True,cwd=os.getcwd())
+    if result.returncode != 0:
+        LOG.logger.error(f"Run {run + 1} failed:\n{result.stderr}")
+        sys.exit(1)
+    for stage, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items():
+        samples.setdefault(stage,[]).append(seconds)
+
+report = "\n".join(f"{stage + ':':<20}{statistics.median(times) * 1000:>8.0f}ms (Best {min(times) * 1000:.0f}ms)" for stage, times in samples.items())
+LOG.logger.info(f"Startup over {args.runs} fresh process(es), medians:\n{report}")
@@ -0,0 +1,182 @@
+# Native Stuff
+import threading
+from concurrent.futures import ThreadPoolExecutor,as_completed
+
+# Installed Stuff
+import xxhash
+from psycopg2.extras import execute_values
+from tqdm import tqdm
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Classes as C
+
+"""
+Re-matches stored messages against the nicknames table after nicknames are added or removed.
+
+Ingestion only matches nicknames on messages as they are inserted, so this job:
+    1. Diffs the nicknames table against nickname_backfill_state (The nicknames already applied to every stored message).
+    2. Splits messages into message_id ranges (Boundaries from a small table sample) and stores them in nickname_backfill_chunks.
+    3. Scans the chunks in parallel, each on its own connection, only reading messages that contain one of the changed nicknames.
+    4. Replaces the nickname_matches rows of those messages using the same rules as ingestion (Classes.Match_Nicknames).
+       Each chunk is committed together with its "done" flag, so an interrupted run picks up where it left off.
+    5. Records the new nickname set in nickname_backfill_state once every chunk is done.
+"""
+
+# Rows written to nickname_matches per round trip
+WRITE_BATCH = 1000
+
+def Nickname_Changes(database:DB.PostgresClass) -> tuple[set[str],set[str]]:
+    """
+    Works out which nicknames were added or removed since the last completed backfill.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    :return: (Added Nicknames, Removed Nicknames)
+    :rtype: Tuple of Sets
+    """
+    current = set(C.Load_Nicknames(database.cursor))
+    applied = {entry["nickname"] for entry in DB.GetEntries(database.cursor,"nickname_backfill_state","nickname")}
+    return current - applied, applied - current
+
+def _Run_Id(added:set[str],removed:set[str]):
+    """Same changes give the same run, which is how an interrupted run gets resumed."""
+    key = "\n".join(["+" + n for n in sorted(added)] + ["-" + n for n in sorted(removed)])
+    return xxhash.xxh128_hexdigest(key.encode())
+
+def _Plan_Chunks(database:DB.PostgresClass,run_id:str,chunks:int):
+    """Splits message_id into roughly even ranges using a 1% sample of the table and stores them for the run."""
+    if len(DB.GetEntries(database.cursor,"nickname_backfill_chunks","chunk",{"run_id":run_id})) > 0:
+        LOG.logger.info("Resuming previous nickname backfill run.")
+        return
+
+    fractions = [i / chunks for i in range(1,chunks)]
+    database.cursor.execute("SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY message_id) FROM messages TABLESAMPLE SYSTEM (1)",(fractions,))
+    row = database.cursor.fetchone()
+    # Tiny tables can come back from the sample empty, one chunk is fine then
+    boundaries = sorted({b for b in (row[0] or []) if b is not None})
+
+    lowers = [None] + boundaries
+    uppers = boundaries + [None]
+    entries = [{"run_id":run_id,"chunk":i,"lower_id":lo,"upper_id":hi} for i, (lo, hi) in enumerate(zip(lowers,uppers))]
+    DB.InsertEntries(database.cursor,"nickname_backfill_chunks",entries,"run_id,chunk")
+    database.database.commit()
+
+def _Process_Chunk(run_id:str,chunk:int,lower_id:str|None,upper_id:str|None,patterns:list[str],sorted_nicknames:list[str]) -> tuple[int,int]:
+    """
+    Re-matches one message_id range on its own connection and marks it done in the same transaction.
+
+    :return: (Messages Scanned, Matches Written)
+    :rtype: Tuple of Integers
+    """
+    db = DB.PostgresClass()
+    scanned = 0
+    matched = 0
+    try:
+        conditions = ["message ILIKE ANY(%s)"]
+        values:list = [patterns]
+        if lower_id is not None:
+            conditions.append("message_id >= %s")
+            values.append(lower_id)
+        if upper_id is not None:
+            conditions.append("message_id < %s")
+            values.append(upper_id)
+
+        reader = db.database.cursor(name=f"nickname_backfill_{chunk}")
+        reader.itersize = CFG.DB_FETCH_SIZE
+        reader.execute(f"SELECT video_id, message_id, message FROM messages WHERE {' AND '.join(conditions)}",values)
+
+        keys:list[tuple[str,str]] = []
+        rows:list[tuple] = []
+
+        def _flush():
+            # Clear whatever the message matched before, then write the fresh matches
+            if len(keys) > 0:
+                execute_values(db.cursor,"DELETE FROM nickname_matches nm USING (VALUES %s) AS k(video_id, message_id) WHERE nm.video_id = k.video_id AND nm.message_id = k.message_id",keys)
+            if len(rows) > 0:
+                execute_values(db.cursor,"INSERT INTO nickname_matches (video_id, message_id, matched_nickname, index_start, index_end) VALUES %s ON CONFLICT (message_id, index_start, index_end) DO NOTHING",rows)
+            keys.clear()
+            rows.clear()
+
+        for video_id, message_id, message in reader:
+            scanned += 1
+            keys.append((video_id,message_id))
+            for nick, start, end in C.Match_Nicknames(message,sorted_nicknames):
+                rows.append((video_id,message_id,nick,start,end))
+                matched += 1
+            if len(keys) >= WRITE_BATCH:
+                _flush()
+        _flush()
+        reader.close()
+
+        db.cursor.execute("UPDATE nickname_backfill_chunks SET done = true, scanned = %s, matched = %s WHERE run_id = %s AND chunk = %s",(scanned,matched,run_id,chunk))
+        db.database.commit()
+    except Exception as e:
+        db.database.rollback()
+        LOG.logger.error(f"Nickname backfill chunk {chunk} failed: {e}")
+        raise e
+    finally:
+        db.Close()
+
+    return scanned, matched
+
+def Run_Backfill(database:DB.PostgresClass,workers:int|None=None,chunks:int|None=None) -> tuple[int,int]:
+    """
+    Brings nickname_matches up to date with the nicknames table. Does nothing if no nicknames changed.
+
+    :param database: Initialized Database Object (Used for planning, each worker opens its own connection)
+    :type database: Database Object
+    :param workers: Parallel connections. Defaults to NICKNAME_BACKFILL_WORKERS in Settings.py
+    :type workers: Integer
+    :param chunks: Number of message_id ranges to split the work into. Defaults to NICKNAME_BACKFILL_CHUNKS in Settings.py
+    :type chunks: Integer
+    :return: (Messages Scanned, Matches Written)
+    :rtype: Tuple of Integers
+    """
+    workers = workers if workers is not None else CFG.NICKNAME_BACKFILL_WORKERS
+    chunks = chunks if chunks is not None else CFG.NICKNAME_BACKFILL_CHUNKS
+
+    added, removed = Nickname_Changes(database)
+    if len(added) == 0 and len(removed) == 0:
+        LOG.logger.info("Nicknames unchanged since the last backfill, nothing to do.")
+        return 0, 0
+
+    LOG.logger.info(f"Nicknames added: {len(added)} | Nicknames removed: {len(removed)}")
+
+    run_id = _Run_Id(added,removed)
+    _Plan_Chunks(database,run_id,chunks)
+
+    # Only messages containing a changed nickname can have different matches now.
+    # Matching itself always uses the full current list so the longest-wins rule still holds.
+    patterns = [f"%{DB.Escape_Like(nick)}%" for nick in sorted(added | removed)]
+    sorted_nicknames = C.Load_Nicknames(database.cursor)
+
+    all_chunks = DB.GetEntries(database.cursor,"nickname_backfill_chunks","chunk,lower_id,upper_id,done,scanned,matched",{"run_id":run_id})
+    pending = [c for c in all_chunks if c["done"] == False]
+
+    total_scanned = sum(c["scanned"] for c in all_chunks if c["done"] == True)
+    total_matched = sum(c["matched"] for c in all_chunks if c["done"] == True)
+    lock = threading.Lock()
+
+    with LOG.TQDM_Logging():
+        with tqdm(desc='Chunks Backfilled',total=len(all_chunks),initial=len(all_chunks) - len(pending),bar_format='{desc}: {n_fmt}/{total_fmt} || {postfix}',ncols=80,position=0,leave=False) as chunkbar:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_Process_Chunk,run_id,c["chunk"],c["lower_id"],c["upper_id"],patterns,sorted_nicknames) for c in pending]
+                for future in as_completed(futures):
+                    scanned, matched = future.result()
+                    with lock:
+                        total_scanned += scanned
+                        total_matched += matched
+                    chunkbar.set_postfix_str(f"Messages Scanned: {total_scanned} | Matches: {total_matched}")
+                    chunkbar.update(1)
+
+    # Every chunk is done, record the nicknames as applied and clean up the run
+    DB.DeleteEntries(database.cursor,"nickname_backfill_state")
+    DB.InsertEntries(database.cursor,"nickname_backfill_state",[{"nickname":nick} for nick in sorted_nicknames],"nickname")
+    DB.DeleteEntries(database.cursor,"nickname_backfill_chunks",{"run_id":run_id})
+    database.database.commit()
+
+    LOG.logger.info(f"Nickname backfill complete. Messages Scanned: {total_scanned} | Matches: {total_matched}")
+    return total_scanned, total_matched
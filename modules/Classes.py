@@ -1,26 +1,42 @@
 # Native Stuff
-import os,json,pickle,requests,re,xxhash
-from typing import Any
+import os,json,pickle,re,time,xxhash,contextlib
+from typing import Any,Iterable,Iterator
 from datetime import datetime
 
 # Installed Stuff
 from tqdm import tqdm
-from chat_downloader import ChatDownloader
-
-# Google Stuff
-import google.auth
-import google.auth.exceptions
-import google.auth.external_account_authorized_user
-import google.oauth2.credentials
-import google
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+
+# chat_downloader and the Google libraries take about half a second to import, so they're imported where they're
+# first used instead (YT_API and Get_Messages). Tools that only need the classes start without them.
 
 # Other Project Files
 import modules.logconfig as LOG
 import modules.Settings as CFG
 import modules.Database as DB
+import modules.Fixtures as FX
+import modules.History as HIST
+import modules.Images as IMG
+import modules.Pipeline as PL
+import modules.Profiler as PF
+import modules.Sketches as SK
+import modules.UserCache as UC
+
+class NoChatReplay(Exception):
+    """The video has no chat (Regular videos, or streams with the chat replay turned off)."""
+
+class VideoUnplayable(Exception):
+    """The video went private, members-only or was taken down."""
+
+@contextlib.contextmanager
+def _Chat_Errors() -> Iterator[None]:
+    """Raises chat_downloader's errors as the ones above, so callers don't have to import chat_downloader to catch them."""
+    import chat_downloader.errors
+    try:
+        yield
+    except chat_downloader.errors.NoChatReplay as e:
+        raise NoChatReplay(str(e)) from e
+    except chat_downloader.errors.VideoUnplayable as e:
+        raise VideoUnplayable(str(e)) from e
 
 class VideoStats:
     """Statistics about all the videos."""
@@ -39,8 +55,9 @@ class ChatStats:
         self.new_messages:int = 0
         self.existing_messages:int = 0
         self.new_user_ids:int = 0
-        self.exist_user_ids = set()
+        self.unique_user_ids = SK.DistinctCounter() # Everyone who chatted. Exact while small, fixed size estimate past DISTINCT_EXACT_LIMIT
         self.invalid_users:int = 0
+        self.sketches = SK.ChatSketches() # Top chatters/words/emotes of the new messages (With SKETCHES on)
     
     def append_all(self,all_chat_stats:'ChatStats'):
         """Updates the total stats with additional numbers"""
@@ -48,7 +65,8 @@ class ChatStats:
         all_chat_stats.new_messages += self.new_messages
         all_chat_stats.existing_messages += self.existing_messages
         all_chat_stats.new_user_ids += self.new_user_ids
-        all_chat_stats.exist_user_ids = all_chat_stats.exist_user_ids.union(self.exist_user_ids)
+        all_chat_stats.unique_user_ids.merge(self.unique_user_ids)
+        all_chat_stats.sketches.merge(self.sketches)
 
 class VideoClass:
     """
@@ -138,56 +156,18 @@ class VideoClass:
             LOG.logger.error(f"Video file {self.id} not initialized:\n{e}")
             raise e
     
-    def Get_Thumbnail(self):
-        """Will download the video thumbnail. Checks if there's an updated one and renames the old one and downloads a new one."""
+    def Get_Thumbnail(self,database:DB.PostgresClass):
+        """
+        Will download the video thumbnail. Checks if there's an updated one and renames the old one and downloads a new one.
+        Thumbnails whose URL hasn't changed since the last run aren't downloaded again (See Images.py).
+
+        :param database: Initialized Database Object, used to remember what was downloaded
+        :type database: Database Object
+        :return: What happened with the thumbnail (See Images.ImageResult)
+        :rtype: String
+        """
         if self.thumbnail is not None:
-            temp_thumb = f"{CFG.DATA_PATH}/{self.id}_Thumbnail_TEMP.jpg"
-
-            # Download a fresh thumbnail
-            with open(temp_thumb,'wb') as handle:
-                img_response = requests.get(self.thumbnail,stream=True)
-                if not img_response.ok:
-                    LOG.logger.info(img_response)
-                for block in img_response.iter_content(1024):
-                    if not block:
-                        break
-                    handle.write(block)
-            # Hash the fresh thumbnail
-            with open(temp_thumb,"rb") as image:
-                new_hash = xxhash.xxh128_hexdigest(image.read())
-
-            # Check for previously downloaded thumbnails
-            thumbnail_hashes = set()
-            thumb_path = f"{CFG.DATA_PATH}/{self.id}_Thumbnail.jpg"
-
-            # Check if a thumbnail already exists
-            if os.path.isfile(thumb_path):
-
-                # Hash the file and store it for cross referencing
-                with open(thumb_path,"rb") as image:
-                    thumbnail_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                # Create a new filename
-                number = 1
-                new_path = f"{CFG.DATA_PATH}/{self.id}_Thumbnail_{number}.jpg"
-
-                # Increment until no overlapping name
-                while os.path.isfile(new_path):
-                    # Hash the file and store it for cross referencing
-                    with open(new_path,"rb") as image:
-                        thumbnail_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                    number += 1
-                    new_path = f"{CFG.DATA_PATH}/{self.id}_Thumbnail_{number}.jpg"
-
-                # Delete it if it already matches another one
-                if new_hash in thumbnail_hashes:
-                    os.remove(temp_thumb)
-                else:
-                    os.rename(thumb_path,new_path)
-                    os.rename(temp_thumb,thumb_path)
-            else:
-                os.rename(temp_thumb,thumb_path)
+            return IMG.Fetch_Image(database,self.thumbnail,CFG.DATA_PATH,f"{self.id}_Thumbnail")
 
 class MessageClass:
     """
@@ -384,8 +364,10 @@ class YT_API:
 
     :param database: Initialized Database Object the methods can use to make queries on.
     :type database: Database Object
+    :param api: Youtube API object to use instead of logging in (e.g. a stand-in for checks that never call the API)
+    :type api: API Object
     """
-    def __init__(self,database:DB.PostgresClass):
+    def __init__(self,database:DB.PostgresClass,api:Any=None):
         
         def get_authenticated_service():
             """
@@ -394,35 +376,64 @@ class YT_API:
             :return: Youtube API object for making calls with.
             :rtype: API Object
             """
-            credentials:Any | google.auth.external_account_authorized_user.Credentials | google.oauth2.credentials.Credentials = None
+            # Only what this run needs gets imported, a saved and still valid token needs neither the login flow nor a refresh
+            from googleapiclient.discovery import build
+
+            # A replay answers from the fixture file, there's nobody to log in as (See Fixtures.py)
+            if CFG.FIXTURES == FX.REPLAY:
+                return build('youtube', 'v3', http=FX.ReplayHttp(), static_discovery=True, cache_discovery=False)
+
+            import google.auth.exceptions
+
+            def login() -> Any:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(CFG.CLIENT_SECRETS_FILE, ['https://www.googleapis.com/auth/youtube.readonly'])
+                return flow.run_local_server(port=0)
+
+            credentials:Any = None
             
             # Check if we have saved credentials
             if os.path.exists(CFG.TOKEN_PICKLE_FILE):
                 with open(CFG.TOKEN_PICKLE_FILE, 'rb') as token:
                     credentials = pickle.load(token)
             
-            # If credentials don't exist or are invalid, run the flow
+            # If credentials don't exist or are invalid, run the flow (valid stays True until the token is about to expire)
             if not credentials or not credentials.valid:
                 if credentials and credentials.expired and credentials.refresh_token:
+                    from google.auth.transport.requests import Request
                     try:
                         credentials.refresh(Request())
                     except google.auth.exceptions.RefreshError:
-                        flow = InstalledAppFlow.from_client_secrets_file(CFG.CLIENT_SECRETS_FILE, ['https://www.googleapis.com/auth/youtube.readonly'])
-                        credentials = flow.run_local_server(port=0)
+                        credentials = login()
                 else:
-                    flow = InstalledAppFlow.from_client_secrets_file(CFG.CLIENT_SECRETS_FILE, ['https://www.googleapis.com/auth/youtube.readonly'])
-                    credentials = flow.run_local_server(port=0)
+                    credentials = login()
                 
                 # Save credentials for future use
                 with open(CFG.TOKEN_PICKLE_FILE, 'wb') as token:
                     pickle.dump(credentials, token)
             
-            api_resource = build('youtube', 'v3', credentials=credentials)
+            # The discovery document ships with googleapiclient, no request for it and nothing to cache
+            if CFG.FIXTURES == FX.RECORD:
+                import google_auth_httplib2
+                api_resource = build('youtube', 'v3', http=FX.RecordingHttp(google_auth_httplib2.AuthorizedHttp(credentials)), static_discovery=True, cache_discovery=False)
+            else:
+                api_resource = build('youtube', 'v3', credentials=credentials, static_discovery=True, cache_discovery=False)
             
             return api_resource
 
-        self.api = get_authenticated_service()
+        self.api = api if api is not None else get_authenticated_service()
         self.db = database
+        self.user_cache = UC.UserCache() if CFG.USER_CACHE == True else None # Shared with the other channels, see UserCache.py
+        self.live_stats:Any = None # LiveStats.LiveStats fed by live chat downloads, set by Main.py when LIVE_STATS is on
+        self.api_units = 0 # Quota used so far (Every list call costs 1 unit), for the run ledger
+        self.api_bytes = 0 # Size of the API responses so far (As compact JSON)
+
+    def _Execute(self,request:Any) -> dict[str,Any]:
+        """Sends an API request, counting the quota it costs and the size of the response (See RunLedger.py)."""
+        response = request.execute()
+        self.api_units += 1
+        self.api_bytes += len(json.dumps(response,separators=(',',':')))
+        return response
 
     def Get_Upload_Count(self):
         """
@@ -433,17 +444,30 @@ class YT_API:
 
         request = self.api.playlists().list(part="contentDetails",channelId=CFG.YT_CHANNEL_ID,id=CFG.PLAYLIST)
 
-        response = request.execute()
+        response = self._Execute(request)
 
         video_count = response["contentDetails"]["itemCount"]
 
         LOG.logger.info(f"{video_count} video(s) found!")
         return video_count
     
-    def Get_Video_Info(self,id:str):
+    def Get_Video_Info(self,id:str,fingerprint:str|None=None,exists:bool=False):
+        """
+        Gets the details of a video from the API and works out if anything changed since it was last stored.
+        The JSON snapshot on disk is only rewritten when the fingerprint changes.
+
+        :param id: Video ID
+        :type id: String
+        :param fingerprint: Fingerprint stored in the database for the video, if any (Prefetch these, see Main.py)
+        :type fingerprint: String
+        :param exists: Whether the video is already in the database
+        :type exists: Boolean
+        :return: The video with its status set to New, Existing or Update. None if the video is gone.
+        :rtype: VideoClass
+        """
         request = self.api.videos().list(part="contentDetails,id,snippet,status,liveStreamingDetails",id=id)
 
-        response = request.execute()
+        response = self._Execute(request)
 
         videos:list[dict] = response["items"]
 
@@ -454,52 +478,21 @@ class YT_API:
             del video["kind"]
             del video["etag"]
 
-            temp_path = f"{CFG.DATA_PATH}/{id}_TEMP.json"
-
-            # Write Video data to file
-            with open(temp_path,'w') as file:
-                file.write(json.dumps(video,indent=4))
-
-            # Hash the video data
-            with open(temp_path,"rb") as image:
-                new_hash = xxhash.xxh128_hexdigest(image.read())
-
-            data_hashes = set()
-            filepath = f"{CFG.DATA_PATH}/{id}.json"
-
-            # Check if video data already exists
-            if os.path.isfile(filepath):
-
-                # Hash the file and store it for cross referencing
-                with open(filepath,"rb") as data:
-                    data_hashes.add(xxhash.xxh128_hexdigest(data.read()))
-
-                # Create a new filename
-                number = 1
-                new_path = f"{CFG.DATA_PATH}/{id}_{number}.json"
+            new_fingerprint = Fingerprint(video)
 
-                # Increment until no overlapping name
-                while os.path.isfile(new_path):
-                    # Hash the file and store it for cross referencing
-                    with open(new_path,"rb") as image:
-                        data_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                    number += 1
-                    new_path = f"{CFG.DATA_PATH}/{id}_{number}.json"
-
-                # Delete it if it already matches another one
-                if new_hash in data_hashes:
-                    os.remove(temp_path)
-                    status = "Existing"
-                else:
-                    os.rename(filepath,new_path)
-                    os.rename(temp_path,filepath)
-                    status = "Update"
-            else:
-                os.rename(temp_path,filepath)
+            if exists == False:
                 status = "New"
+            elif new_fingerprint == fingerprint:
+                status = "Existing"
+            else:
+                status = "Update"
+
+            if status != "Existing":
+                _Write_Snapshot(CFG.DATA_PATH,id,video,new_fingerprint)
 
             vid_obj = VideoClass(video,status)
+            vid_obj.fingerprint = new_fingerprint
+            vid_obj.entry["fingerprint"] = new_fingerprint
 
             return vid_obj
         else:
@@ -520,7 +513,7 @@ class YT_API:
 
                 request = self.api.playlistItems().list(part="contentDetails,id,snippet,status",playlistId=CFG.PLAYLIST,maxResults=50)
 
-                response = request.execute()
+                response = self._Execute(request)
 
                 next_page = response["nextPageToken"]
 
@@ -533,7 +526,7 @@ class YT_API:
                         break
                     else:
                         next_request = self.api.playlistItems().list(part="contentDetails,id,snippet,status",playlistId=CFG.PLAYLIST,maxResults=50,pageToken=next_page)
-                        next_response = next_request.execute()
+                        next_response = self._Execute(next_request)
 
                         try:
                             next_page = next_response["nextPageToken"]
@@ -557,183 +550,109 @@ class YT_API:
         
         return ids
 
-    def Get_Messages(self,video:VideoClass,skip_download=False):
+    def Get_Messages(self,video:VideoClass,spool,skip_download=False,timeout:bool|None=None,show_progress:bool=True,live:bool=False,
+                     chat:Iterable[dict[str,Any]]|None=None) -> int:
         """
-        Retrieves all chat messages from a given video, saves them to JSON files, and enters them into the database.
-        
-        Writes a JSON formatted file for each video. File is named "[YT URL]_Messages.json"
+        Retrieves all chat messages from a given video and writes them to the spool (See Spool.py).
+        The spool's Committer enters them into the database, and the JSON file named "[YT URL]_Messages.json" is
+        written once the video's messages have all reached the database.
 
-        :param video: The video that is used to get the chats from
+        :param video: The video that is used to get the chats from (Anything with an id, see Scheduler.LiveStream)
         :type video: Video Class Object
-        :return: Stats about the messages that were parsed, and the users who sent them
-        :rtype: ChatStats object
+        :param spool: Where downloaded messages are stored until they're in the database
+        :type spool: Spool.Spool Object
+        :param timeout: Stop once a live chat goes quiet for 5 seconds. Defaults to TIMEOUT in Settings.py
+        :type timeout: Boolean
+        :param show_progress: Set to False when several chats download at once (Live stream watchers)
+        :type show_progress: Boolean
+        :param live: The chat is being downloaded as it happens, count it in live_stats (See LiveStats.py)
+        :type live: Boolean
+        :param chat: ChatDownloader shaped messages to spool instead of downloading the chat (See Memory_Check.py)
+        :type chat: Iterable of Dictionaries
+        :return: Number of messages downloaded
+        :rtype: Integer
         """
-
-        def _WriteFile():
-            """
-            Writes the downloaded chat data to a file with the name of the video ID.
-            If the file already exists, load up all existsing chat meessages and
-            add any new ones to the file.
-            """
-            
-            message_path = f'{CFG.DATA_PATH}/{v.id}_Messages.json'
-
-            if os.path.isfile(message_path):
-                e_ids = set()
-                
-                with open(message_path,'r') as file:
-                    all_messages = json.load(file) #type: list[dict]
-                
-                for ex_message in all_messages:
-                    em_id = ex_message["message_id"]
-                    e_ids.add(em_id)
-
-                for n_message in message_list:
-                    nm_id = n_message["message_id"]
-                    if nm_id in e_ids:
-                        continue
-                    else:
-                        all_messages.append(n_message)
-
-                with open(message_path,'w') as file:
-                    file.write(json.dumps(all_messages,indent=4))
-            else:
-                with open(message_path,'w') as file:
-                    file.write(json.dumps(message_list,indent=4))
-        
         v = video
+        PF.Tag(video=v.id) # Live stream watchers download on their own threads
 
         #-----------------------#
         #-- GET ALL CHAT DATA --#
         #-----------------------#
 
+        messages_on_file = None
         if skip_download == True:
-            message_path = f'{CFG.DATA_PATH}/{v.id}_Messages.json'
-            if os.path.isfile(message_path):
-                with open(message_path,'r') as file:
-                    messages_on_file = json.load(file) #type: list[dict]
+            # Read a message at a time, the archive of a long stream doesn't fit in memory
+            if os.path.isfile(Message_Archive_Path(v.id)):
+                messages_on_file = Read_Message_Archive(v.id)
+        elif chat is not None:
+            pass # Handed over by the caller
+        elif CFG.FIXTURES == FX.REPLAY:
+            chat = FX.Store().Replay_Chat(v.id,{"NoChatReplay":NoChatReplay,"VideoUnplayable":VideoUnplayable})
         else:
-            # Timeout will prevent sitting endlessly on a waiting room or livestream
-            if CFG.TIMEOUT == True:
-                chat = ChatDownloader(cookies=CFG.COOKIES).get_chat(url=v.id, message_types=['text_message', 'membership_item', 'paid_message', 'paid_sticker'],inactivity_timeout=5)
-            else:
-                chat = ChatDownloader(cookies=CFG.COOKIES).get_chat(url=v.id, message_types=['text_message', 'membership_item', 'paid_message', 'paid_sticker'])
+            from chat_downloader import ChatDownloader
 
-        message_list = []
-        chat_stats = ChatStats()
+            def Get_Chat():
+                # Timeout will prevent sitting endlessly on a waiting room or livestream
+                with _Chat_Errors():
+                    if (timeout if timeout is not None else CFG.TIMEOUT) == True:
+                        return ChatDownloader(cookies=CFG.COOKIES).get_chat(url=v.id, message_types=['text_message', 'membership_item', 'paid_message', 'paid_sticker'],inactivity_timeout=5)
+                    else:
+                        return ChatDownloader(cookies=CFG.COOKIES).get_chat(url=v.id, message_types=['text_message', 'membership_item', 'paid_message', 'paid_sticker'])
+
+            # Recording starts the download on the first message wanted, so a chat that fails to start is recorded too
+            chat = Get_Chat() if CFG.FIXTURES != FX.RECORD else FX.Store().Record_Chat(v.id,Get_Chat)
 
         chat_list = chat if skip_download == False else messages_on_file
 
         if chat_list is None:
-            return chat_stats
+            return 0
+
+        spooled = 0
+        buffer:list[tuple[dict[str,Any],dict[str,Any]]] = []
+        live_stats = self.live_stats if live == True and skip_download == False else None
+        last_flush = time.monotonic()
+
+        # Downloading, parsing and spooling each run on their own thread so the network never waits on the disk
+        pipe = PL.Pipeline(chat_list,[("Parse",lambda message: _Parse_Message(message,v))])
 
         def Update_Postfix_Messages():
-            return f"New Messages: {chat_stats.new_messages} | Existing Messages: {chat_stats.existing_messages} | New Users: {chat_stats.new_user_ids} | Existing Users: {len(chat_stats.exist_user_ids)}"
+            return f"Spooled: {spooled} | Waiting For Database: {spool.Pending()} | Queues: {pipe.Depths()}"
 
-        with LOG.TQDM_Logging():
-            with tqdm(desc='Messages Processed',bar_format='{desc}: {n_fmt} || {postfix}',ncols=80, postfix=Update_Postfix_Messages() ,position=1, leave=False) as messbar:
+        with LOG.TQDM_Logging() if show_progress == True else contextlib.nullcontext():
+            with tqdm(desc='Messages Downloaded',bar_format='{desc}: {n_fmt} || {postfix}',ncols=80, postfix=Update_Postfix_Messages() ,position=1, leave=False, disable=not show_progress) as messbar:
+                progress = LOG.ProgressThrottle(messbar,Update_Postfix_Messages)
                 try:
-                    unique_user_ids = set()
-                    # Process all chats collected by Chat_Downloader
-                    for message in chat_list:
-                        chat_stats.total_messages += 1
-                        try:
-                            msg = MessageClass(message,v)
-
-                            #----------------------#
-                            #-- USER ID DATABASE --#
-                            #----------------------#
-
-                            # Add Unique UserIDs if they don't already exist in DB (User's names may change over time, but not the UniqueID)
-                            if len(DB.GetEntries(self.db.cursor,"user_ids",filter={"id":msg.usr_id})) == 0:
-                                DB.InsertEntries(self.db.cursor,"user_ids",[{"id":msg.usr_id}])
-                                self.db.database.commit()
-                                chat_stats.new_user_ids += 1
-                                unique_user_ids.add(msg.usr_id)
-                            else:
-                                unique_user_ids.add(msg.usr_id)
-                                chat_stats.exist_user_ids.add(msg.usr_id)
-
-                            #--------------------#
-                            #-- EMOTE DATABASE --#
-                            #--------------------#
-
-                            # Add Unique Emotes if they don't already exist in DB
-                            if len(msg.e_emote_entries) > 0:
-                                DB.InsertEntries(self.db.cursor,"emotes",msg.e_emote_entries,"id")
-
-                            #----------------------#
-                            #-- MESSAGE DATABASE --#
-                            #----------------------#
-
-                            # Add message to DB if it doesn't already exist
-                            if len(DB.GetEntries(self.db.cursor,"messages",filter={"message_id":msg.id})) == 0:
-                                DB.InsertEntries(self.db.cursor,"messages",[msg.entry])
-                                self.db.database.commit()
-
-                                #-----------------------#
-                                #-- NICKNAME DATABASE --#
-                                #-----------------------#
-
-                                # Get all the nicknames to search for
-                                nickname_entries = DB.GetEntries(self.db.cursor,"nicknames","nickname")
-                                nicknames:list[str] = []
-                                for nick_entry in nickname_entries:
-                                    for key in nick_entry.keys():
-                                        nicknames.append(key)
-                                sorted_nicknames = sorted(nicknames, key=len, reverse=True)
-
-                                entries = []
-                                used_positions = set()
-
-                                #-------------------------------#
-                                #-- NICKNAME MATCHES DATABASE --#
-                                #-------------------------------#
-
-                                # Only look for nicknames if there are any to look for in the database
-                                if len(sorted_nicknames) > 0:
-                                    for nick in sorted_nicknames:
-                                        search_pattern = r'\b' + re.escape(nick) + r'\b'
-                                        if msg.message is not None:
-                                            for match in re.finditer(pattern=search_pattern, string=msg.message, flags=re.IGNORECASE):
-                                                start, end = match.span()
-                                                if not any(pos in used_positions for pos in range(start, end)):
-                                                    entry = {
-                                                        "message_id":msg.id,
-                                                        "matched_nickname":nick,
-                                                        "index_start":start,
-                                                        "index_end":end
-                                                    }
-                                                    used_positions.update(range(start, end))
-                                                    entries.append(entry)
-                                    
-                                    DB.InsertEntries(self.db.cursor,"nickname_matches",entries,"message_id,index_start,index_end")
-                                    self.db.database.commit()
-
-                                chat_stats.new_messages += 1
-                                messbar.set_postfix_str(Update_Postfix_Messages())
-                                messbar.update(1)
-                            else:
-                                chat_stats.existing_messages += 1
-                                messbar.set_postfix_str(Update_Postfix_Messages())
-                                messbar.update(1)
-
-                            message_list.append(message)
-                        except Exception as e:
-                            messbar.update(1)
-                            raise e
-                except Exception as r:
-                    _WriteFile() # If it crashes, at least we get some of the messages to file so we can debug.
-                    raise r
-
-                _WriteFile()
-
-        return chat_stats
+                    with _Chat_Errors(), pipe:
+                        # None means nothing arrived for a while, which is still a chance to flush
+                        for parsed in pipe.Results(timeout=CFG.SPOOL_FLUSH_SECONDS):
+                            if parsed is not None:
+                                buffer.append(parsed)
+                                progress.update()
+                                if live_stats is not None:
+                                    live_stats.Add(v.id,parsed[1])
+
+                            # Make the messages durable often enough that a crash only loses the last moment of chat
+                            if len(buffer) >= CFG.SPOOL_FLUSH_MESSAGES or (len(buffer) > 0 and time.monotonic() - last_flush >= CFG.SPOOL_FLUSH_SECONDS):
+                                spool.Append(v.id,buffer)
+                                spooled += len(buffer)
+                                buffer = []
+                                last_flush = time.monotonic()
+                finally:
+                    # Whatever was downloaded before a failure still gets to the database
+                    spool.Append(v.id,buffer)
+                    spooled += len(buffer)
+                    progress.flush()
+                    LOG.logger.debug(f"Chat pipeline for {v.id}:\n{pipe.Report()}")
+                    if live_stats is not None:
+                        live_stats.Finish(v.id)
+
+        return spooled
 
     def Get_User_Batch(self,users:list[str]):
         """Gets data about all users in the list of users. Will keep track of invalid users.
         
         NOTE: the Youtube API call will only return 50 at most, break lists up into chunks of 50.
+        With USER_CACHE on, users any channel looked up recently are taken from the shared cache instead (See UserCache.py).
 
         :param users: List of 50 or less users
         :type users: List of Strings
@@ -741,24 +660,39 @@ class YT_API:
         :rtype: Integer
         """
         invalid:int = 0
+        cache = self.user_cache
+        users_folder = UC.USERS_PATH if cache is not None else f"{CFG.DATA_PATH}/users"
 
         #-------------------#
         #-- GET USER DATA --#
         #-------------------#
 
-        request = self.api.channels().list(part="id,snippet,statistics,status,brandingSettings",id=users)
-        response = request.execute()
-        if "items" in response:
-            user_list = response["items"]
-        else:
-            user_list = []
+        # Users another channel (Or this one) looked up recently don't cost an API call
+        cached = cache.Lookup(users) if cache is not None else {}
+        user_list:list[tuple[dict[str,Any],str]] = [(user,fingerprint) for user, fingerprint in cached.values() if user is not None]
+
+        to_fetch = [user for user in users if user not in cached]
+        if len(to_fetch) > 0:
+            request = self.api.channels().list(part="id,snippet,statistics,status,brandingSettings",id=to_fetch)
+            response = self._Execute(request)
+            fetched:list[tuple[dict[str,Any],str]] = []
+            for user in response.get("items",[]):
+                user.pop("kind",None)
+                user.pop("etag",None)
+                fetched.append((user,Fingerprint(user)))
+            user_list.extend(fetched)
+
+            if cache is not None:
+                returned = {user["id"] for user, _ in fetched}
+                cache.Store(fetched,[user for user in to_fetch if user not in returned])
         valid_ids = set()
 
+        # Fingerprints of what's stored for this batch, one query for all of them
+        known_fingerprints = {entry["id"]:entry["fingerprint"] for entry in DB.GetEntries(self.db.cursor,"user_ids","id,fingerprint",{"id":list(users)})}
+        user_entries:list[dict[str,Any]] = []
+
         try:
-            for user in user_list:
-                
-                del user["kind"]
-                del user["etag"]
+            for user, fingerprint in user_list:
 
                 u = UserClass(user)
 
@@ -766,126 +700,254 @@ class YT_API:
                 #-- WRITE USER DATA TO DISK --#
                 #-----------------------------#
 
-                temp_path = f"{CFG.DATA_PATH}/users/{u.id}_TEMP.json"
-
-                # Write user data to file
-                with open(temp_path,'w') as file:
-                    file.write(json.dumps(user,indent=4))
-
-                # Hash the user data
-                with open(temp_path,"rb") as image:
-                    new_hash = xxhash.xxh128_hexdigest(image.read())
-
-                data_hashes = set()
-                user_path = f"{CFG.DATA_PATH}/users/{u.id}.json"
-
-                # Check if user data already exists
-                if os.path.isfile(user_path):
-                    # Hash the file and store it for cross referencing
-                    with open(user_path,"rb") as data:
-                        data_hashes.add(xxhash.xxh128_hexdigest(data.read()))
-                    # Create a new filename
-                    number = 1
-                    new_path = f"{CFG.DATA_PATH}/users/{u.id}_{number}.json"
-
-                    # Increment until no overlapping name
-                    while os.path.isfile(new_path):
-                        # Hash the file and store it for cross referencing
-                        with open(new_path,"rb") as image:
-                            data_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                        number += 1
-                        new_path = f"{CFG.DATA_PATH}/users/{u.id}_{number}.json"
-                    # Delete it if it already matches another one
-                    if new_hash in data_hashes:
-                        os.remove(temp_path)
-                    else:
-                        os.rename(user_path,new_path)
-                        os.rename(temp_path,user_path)
-                else:
-                    os.rename(temp_path,user_path)
+                # Only touch the disk when something changed
+                if known_fingerprints.get(u.id) != fingerprint:
+                    _Write_Snapshot(users_folder,u.id,user,fingerprint)
 
                 #------------------------------#
                 #-- PROFILE PICTURE DOWNLOAD --#
                 #------------------------------#
 
+                # Skips the download if the PFP URL is the same as last time (For any channel when the cache is shared)
                 if u.pfp is not None:
-                    temp_pfp = f"{CFG.DATA_PATH}/users/{u.id}_pfp_TEMP.jpg"
-
-                    # Download a fresh pfp
-                    with open(temp_pfp,'wb') as handle:
-                        img_response = requests.get(u.pfp,stream=True)
-                        if not img_response.ok:
-                            LOG.logger.info(img_response)
-                        for block in img_response.iter_content(1024):
-                            if not block:
-                                break
-                            handle.write(block)
-                    # Hash the fresh profile picture
-                    with open(temp_pfp,"rb") as image:
-                        new_hash = xxhash.xxh128_hexdigest(image.read())
-
-                    # Check for previously downloaded profile picture
-                    pfp_hashes = set()
-                    pfp_path = f"{CFG.DATA_PATH}/users/{u.id}_pfp.jpg"
-
-                    # Check if a profile picture already exists
-                    if os.path.isfile(pfp_path):
-
-                        # Hash the file and store it for cross referencing
-                        with open(pfp_path,"rb") as image:
-                            pfp_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                        # Create a new filename
-                        number = 1
-                        new_path = f"{CFG.DATA_PATH}/users/{u.id}_pfp_{number}.jpg"
-
-                        # Increment until no overlapping name
-                        while os.path.isfile(new_path):
-                            # Hash the file and store it for cross referencing
-                            with open(new_path,"rb") as image:
-                                pfp_hashes.add(xxhash.xxh128_hexdigest(image.read()))
-
-                            number += 1
-                            new_path = f"{CFG.DATA_PATH}/users/{u.id}_pfp_{number}.jpg"
-
-                        # Delete it if it already matches another one
-                        if new_hash in pfp_hashes:
-                            os.remove(temp_pfp)
-                        else:
-                            os.rename(pfp_path,new_path)
-                            os.rename(temp_pfp,pfp_path)
+                    if cache is not None:
+                        IMG.Fetch_Image(None,u.pfp,users_folder,f"{u.id}_pfp",records=cache.images)
                     else:
-                        os.rename(temp_pfp,pfp_path)
-
-                #------------------------------#
-                #-- USER DATABASE OPERATIONS --#
-                #------------------------------#
-
-                # Update the unprocessed User_ID with additional information
-                for column, value in u.entry.items():
-                    DB.UpdateEntry(self.db.cursor,"user_ids",column,value,"id",u.id)
-                    self.db.database.commit()
-
-                DB.UpdateEntry(self.db.cursor,"user_ids","processed",True,"id",u.id)
-                self.db.database.commit()
+                        IMG.Fetch_Image(self.db,u.pfp,users_folder,f"{u.id}_pfp")
 
+                user_entries.append({"id":u.id,**u.entry,"fingerprint":fingerprint,"processed":True})
                 valid_ids.add(u.id)
         except:
             invalid += 1
-        
-        all_users = users
-
-        for user in all_users:
-            if user not in valid_ids:
-                DB.UpdateEntry(self.db.cursor,"user_ids","exists",False,"id",user)
-                DB.UpdateEntry(self.db.cursor,"user_ids","processed",True,"id",user)
-                self.db.database.commit()
-                invalid += 1
+
+        #------------------------------#
+        #-- USER DATABASE OPERATIONS --#
+        #------------------------------#
+
+        # Update the unprocessed User_IDs with additional information, all in one statement
+        DB.UpsertEntries(self.db.cursor,"user_ids",user_entries,"id")
+
+        # Users the API didn't return don't exist anymore
+        missing = [{"id":user,"exists":False,"processed":True} for user in users if user not in valid_ids]
+        DB.UpsertEntries(self.db.cursor,"user_ids",missing,"id")
+        invalid += len(missing)
+
+        self.db.database.commit()
         
         return invalid
 
 
+def Fingerprint(data:dict[str,Any]) -> str:
+    """
+    Hash of an API response that only changes when the content does (Keys sorted, no whitespace).
+
+    :param data: API response item
+    :type data: Dictionary
+    :return: xxh128 hex digest
+    :rtype: String
+    """
+    canonical = json.dumps(data,sort_keys=True,separators=(',',':'),ensure_ascii=False,default=str)
+    return xxhash.xxh128_hexdigest(canonical.encode('utf-8'))
+
+def _Write_Snapshot(folder:str,name:str,data:dict[str,Any],fingerprint:str):
+    """
+    Saves an API response to [folder]/[name].json and adds it to the version history (See History.py).
+    Nothing is written if the file on disk already holds the same content.
+    """
+    filepath = f"{folder}/{name}.json"
+
+    if os.path.isfile(filepath):
+        # Rows stored before fingerprints existed get compared against the file once
+        with open(filepath,'r') as file:
+            try:
+                if Fingerprint(json.load(file)) == fingerprint:
+                    return
+            except json.JSONDecodeError:
+                pass
+
+    HIST.Save(folder,name,data,fingerprint)
+
+def _Parse_Message(message:dict[str,Any],video:VideoClass) -> tuple[dict[str,Any],dict[str,Any]]:
+    """Turns a raw chat message into the (Raw, Parsed) pair the spool stores."""
+    msg = MessageClass(message,video)
+    return message, {"entry":msg.entry,"emotes":msg.e_emote_entries}
+
+def Message_Archive_Path(video_id:str) -> str:
+    """Where a video's downloaded chat is archived."""
+    return f'{CFG.DATA_PATH}/{video_id}_Messages.json'
+
+def Read_Message_Archive(video_id:str,chunk_size:int=1 << 20) -> Iterator[dict[str,Any]]:
+    """
+    Yields the messages in a video's archive one at a time, reading the file in chunks so memory doesn't grow with
+    the length of the chat. A damaged tail (e.g. the process was killed mid-write) ends the archive early.
+
+    :param video_id: Video the messages are from
+    :type video_id: String
+    :param chunk_size: Characters read at a time
+    :type chunk_size: Integer
+    :return: Generator of raw messages from the ChatDownloader tool
+    :rtype: Dictionary
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    with open(Message_Archive_Path(video_id),'r') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer += chunk
+            pos = 0
+            while True:
+                # Skip the whitespace and commas between messages
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                if started == False:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{Message_Archive_Path(video_id)} isn't a JSON list")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    message, pos = decoder.raw_decode(buffer,pos)
+                except json.JSONDecodeError:
+                    break # Message continues in the next chunk
+                yield message
+            buffer = buffer[pos:]
+
+            if chunk == "":
+                if buffer.strip() != "":
+                    LOG.logger.warning(f"{Message_Archive_Path(video_id)} ends mid-message, the rest of it was skipped.")
+                return
+
+class MessageArchive:
+    """
+    Appends messages to a video's [video_id]_Messages.json without loading what's already in it.
+    The file stays a JSON list formatted like json.dumps(indent=4). Use as a context manager, the list is closed on exit.
+    Doesn't check for duplicates, see Spool.Release for that.
+
+    :param video_id: Video the messages are from
+    :type video_id: String
+    """
+    # Every top-level message ends like this when dumped with indent=4
+    _ITEM_END = b"\n    }"
+
+    def __init__(self,video_id:str):
+        self.path = Message_Archive_Path(video_id)
+        self.created = False # Set when there was no archive yet
+        self.repaired = False # Set when a damaged end of the file had to be dropped
+        if os.path.isfile(self.path) == False or os.path.getsize(self.path) == 0:
+            self._file = open(self.path,'wb')
+            self._file.write(b"[")
+            self._empty = True
+            self.created = True
+        else:
+            self._file = open(self.path,'r+b')
+            self._empty = self._Reopen()
+        self._file.flush()
+
+    def _Reopen(self) -> bool:
+        """Moves to just before the closing bracket. Returns whether the list is empty."""
+        end = self._file.seek(0,os.SEEK_END)
+        size = min(end,65536)
+        while True:
+            self._file.seek(end - size)
+            tail = self._file.read(size)
+            stripped = tail.rstrip()
+            if stripped.endswith(b"]"):
+                body = stripped[:-1].rstrip()
+                if body.endswith(self._ITEM_END):
+                    self._Truncate(end - size + len(body))
+                    return False
+                if size == end and body.lstrip() == b"[":
+                    self._Truncate(len(body))
+                    return True
+            # No closing bracket after the last message, the last write didn't finish
+            found = tail.rfind(self._ITEM_END)
+            if found != -1:
+                LOG.logger.warning(f"{self.path} was cut off mid-message, dropping the partial message and appending after it.")
+                self._Truncate(end - size + found + len(self._ITEM_END))
+                self.repaired = True
+                return False
+            if size == end:
+                break
+            size = min(end,size * 2)
+
+        # Not something this class wrote, keep it around instead of appending to it
+        self._file.close()
+        os.replace(self.path,f"{self.path}.damaged")
+        LOG.logger.warning(f"{self.path} couldn't be appended to, moved it to {self.path}.damaged and started a new one.")
+        self._file = open(self.path,'wb')
+        self._file.write(b"[")
+        self.repaired = True
+        return True
+
+    def _Truncate(self,size:int):
+        self._file.seek(size)
+        self._file.truncate()
+
+    def Append(self,messages:Iterable[dict[str,Any]]):
+        """Writes messages to the end of the archive and flushes them to disk."""
+        for message in messages:
+            text = "\n".join("    " + line for line in json.dumps(message,indent=4).splitlines())
+            self._file.write(("\n" if self._empty else ",\n").encode() + text.encode())
+            self._empty = False
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def Close(self):
+        self._file.write(b"]" if self._empty else b"\n]")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        self.Close()
+        return False
+
+def Load_Nicknames(cursor) -> list[str]:
+    """
+    Gets every nickname to search chat messages for, longest first (The order Match_Nicknames expects).
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :return: Nicknames sorted by length, longest first
+    :rtype: List of Strings
+    """
+    nickname_entries = DB.GetEntries(cursor,"nicknames","nickname")
+    nicknames:list[str] = [nick_entry["nickname"] for nick_entry in nickname_entries]
+    return sorted(nicknames, key=len, reverse=True)
+
+def Match_Nicknames(message:str|None,sorted_nicknames:list[str]) -> list[tuple[str,int,int]]:
+    """
+    Finds whole-word, case-insensitive nickname matches in a message. Longer nicknames win, and a part of the message
+    can only be matched once, so "Calli Mori" doesn't also count as "Calli". Shared by message ingestion and the backfill.
+
+    :param message: Message text
+    :type message: String
+    :param sorted_nicknames: Nicknames sorted longest first (See Load_Nicknames)
+    :type sorted_nicknames: List of Strings
+    :return: (Nickname, Start Index, End Index) for each match
+    :rtype: List of Tuples
+    """
+    matches:list[tuple[str,int,int]] = []
+    if message is None:
+        return matches
+
+    used_positions = set()
+    for nick in sorted_nicknames:
+        search_pattern = r'\b' + re.escape(nick) + r'\b'
+        for match in re.finditer(pattern=search_pattern, string=message, flags=re.IGNORECASE):
+            start, end = match.span()
+            if not any(pos in used_positions for pos in range(start, end)):
+                used_positions.update(range(start, end))
+                matches.append((nick, start, end))
+    return matches
+
 def _get_date_time(timestamp:str):
     """Some timestamp strings in the API include fractions of a second."""
     pattern = r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d{1,6}))?Z?$'
@@ -1,20 +1,140 @@
 # Native Stuff
-from typing import Any,LiteralString
+import os,re,sys,time,itertools,threading
+from typing import Any,LiteralString,Iterator
 
 # Installed Stuff
 import psycopg2
+import psycopg2.extras
 
 # Other Project Files
 import modules.Settings as CFG
 import modules.logconfig as LOG
 
+#-------------------#
+#-- QUERY TRACING --#
+#-------------------#
+
+# Every cursor made from a PostgresClass connection times its statements (Including named cursors and execute_values,
+# but not the fetching of rows afterwards). Timings are grouped by statement shape (Operation + table) and the code
+# that ran it, slow ones are logged, and Trace_Report() prints the shapes that took the most time overall.
+
+class QueryStats:
+    """Running totals for one statement shape from one call site."""
+    def __init__(self) -> None:
+        self.calls:int = 0
+        self.total:float = 0.0
+        self.max:float = 0.0
+        self.slow:int = 0
+
+_trace_lock = threading.Lock()
+_trace:dict[tuple[str,str],QueryStats] = {}
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+([\w."]+)',re.IGNORECASE)
+_THIS_FILE = os.path.normcase(__file__)
+
+def _Statement_Shape(query:str|bytes) -> str:
+    """Reduces a statement to its operation and main table, e.g. 'SELECT messages'."""
+    # Only the start is needed, execute_values statements can be megabytes long
+    text = query[:512].decode('utf-8','replace') if isinstance(query,bytes) else query[:512]
+    words = text.split(None,1)
+    operation = words[0].upper() if len(words) > 0 else '?'
+    table = _TABLE_PATTERN.search(text)
+    return f'{operation} {table.group(1).strip(chr(34)) if table is not None else "-"}'
+
+def _Call_Site() -> str:
+    """The first function outside of this file and psycopg2 that led to the statement."""
+    frame = sys._getframe(3)
+    while frame is not None:
+        filename = os.path.normcase(frame.f_code.co_filename)
+        if filename != _THIS_FILE and f'{os.sep}psycopg2{os.sep}' not in filename:
+            return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+def _Sample(values:Any) -> str:
+    """Short version of the statement parameters for the log."""
+    text = repr(values)
+    return text if len(text) <= 300 else f'{text[:300]}... ({len(text)} chars)'
+
+def _Record(query:str|bytes,values:Any,seconds:float):
+    shape = _Statement_Shape(query)
+    site = _Call_Site()
+
+    with _trace_lock:
+        stats = _trace.get((shape,site))
+        if stats is None:
+            stats = _trace[(shape,site)] = QueryStats()
+        stats.calls += 1
+        stats.total += seconds
+        stats.max = max(stats.max,seconds)
+        slow = seconds * 1000 >= CFG.DB_SLOW_QUERY_MS
+        if slow:
+            stats.slow += 1
+            slow_count = stats.slow
+
+    if slow:
+        # Parameters only for the first few of each shape, after that it's just noise
+        if slow_count <= CFG.DB_TRACE_SAMPLES:
+            LOG.logger.warning(f'Slow query ({seconds * 1000:.0f} ms) {shape} from {site}\nValues: {_Sample(values)}')
+        else:
+            LOG.logger.debug(f'Slow query ({seconds * 1000:.0f} ms) {shape} from {site}')
+
+class TracedCursor(psycopg2.extensions.cursor):
+    """Cursor that records how long each statement takes (See Trace_Report). Turned off with DB_TRACE in Settings.py."""
+    def execute(self,query,vars=None):
+        if CFG.DB_TRACE == False:
+            return super().execute(query,vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query,vars)
+        finally:
+            _Record(query,vars,time.perf_counter() - started)
+
+    def executemany(self,query,vars_list):
+        if CFG.DB_TRACE == False:
+            return super().executemany(query,vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query,vars_list)
+        finally:
+            _Record(query,None,time.perf_counter() - started)
+
+def Trace_Report(top:int|None=None) -> str:
+    """
+    Table of the statement shapes that took the most total time so far.
+
+    :param top: Number of rows. Defaults to DB_TRACE_TOP in Settings.py
+    :type top: Integer
+    :return: Formatted table, ready to log
+    :rtype: String
+    """
+    top = top if top is not None else CFG.DB_TRACE_TOP
+    with _trace_lock:
+        rows = sorted(_trace.items(),key=lambda item: item[1].total,reverse=True)
+        total_calls = sum(stats.calls for _, stats in rows)
+        total_time = sum(stats.total for _, stats in rows)
+
+    if len(rows) == 0:
+        return 'No database statements were traced.'
+
+    lines = [f'---DATABASE STATEMENTS (Top {min(top,len(rows))} of {len(rows)} by total time)---','',
+             f'{"Statement":<32} {"Called From":<36} {"Calls":>9} {"Total s":>9} {"Avg ms":>8} {"Max ms":>8} {"Slow":>6}']
+    for (shape, site), stats in rows[:top]:
+        lines.append(f'{shape[:32]:<32} {site[:36]:<36} {stats.calls:>9} {stats.total:>9.2f} {stats.total / stats.calls * 1000:>8.2f} {stats.max * 1000:>8.1f} {stats.slow:>6}')
+    lines.append('')
+    lines.append(f'All Statements: {total_calls} in {total_time:.2f}s')
+    return '\n'.join(lines)
+
+# Rows per statement for the multi-row helpers (execute_values)
+_PAGE_SIZE = 1000
+
 class PostgresClass:
     """
     Initializes a PostgreSQL database connection. See Settings.py for database configuration.
     """
     def __init__(self):
         LOG.logger.debug('Connecting to database...')
-        self.database = psycopg2.connect(host=CFG.DB_HOST,port=CFG.DB_PORT,database=CFG.DB_NAME,user=CFG.DB_USR,password=CFG.DB_PASS)
+        self.database = psycopg2.connect(host=CFG.DB_HOST,port=CFG.DB_PORT,database=CFG.DB_NAME,user=CFG.DB_USR,password=CFG.DB_PASS,cursor_factory=TracedCursor)
         self.cursor = self.database.cursor()
 
     def Close(self):
@@ -37,9 +157,21 @@ class PostgresClass:
             self.database.commit()
             LOG.logger.info(f'Data from {table} deleted.')
 
-def InsertEntries(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dict[str,Any]],conflict:str|None=None) -> None:
+def _Filter_Columns(filter:dict[str,Any]) -> str:
+    """Builds the WHERE conditions for a filter. List/Tuple/Set values match any of their items."""
+    return " AND ".join([f'{col} = ANY(%s)' if isinstance(value,(list,tuple,set)) else f'{col} = %s' for col, value in filter.items()])
+
+def Escape_Like(text:str) -> str:
+    """Escapes the LIKE wildcards so text is matched literally (Backslash is the default LIKE escape)."""
+    return text.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+
+def InsertEntries(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dict[str,Any]],conflict:str|None=None,returning:str|None=None) -> list[dict[str,Any]]|None:
     """
     Inserts a given list of dictionaries into a target table.
+
+    With returning set, every entry goes in with a single multi-row statement and the given columns of the rows that
+    were actually inserted come back. Rows skipped by the conflict aren't returned, which tells new entries apart from
+    existing ones without looking them up first. All dictionaries need the same keys in that case.
     
     :param cursor: Database cursor object to execute commands.
     :type cursor: Cursor
@@ -49,7 +181,14 @@ def InsertEntries(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dic
     :type data_list: List of Dictionaries
     :param conflict: A column name that is either a Primary Key, or contains a Unique Constraint
     :type conflict: String
+    :param returning: Column name(s) to return for the inserted rows, formatted as '[ColName], [Colname], etc.'
+    :type returning: String
+    :return: Returned columns of each inserted row (Only when returning is set)
+    :rtype: List of Dictionaries {[Colname] , [Value]}
     """
+    if returning is not None:
+        return _Insert_Returning(cursor,table,data_list,conflict,returning)
+
     try:
         LOG.logger.debug(f'{len(data_list)} item(s) to add to table {table} in database.')
         for item in data_list:
@@ -64,15 +203,31 @@ def InsertEntries(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dic
 
             
 
-            if CFG.DB_VERBOSE == True:
-                LOG.logger.info(query)
-                LOG.logger.info(values)
-
             cursor.execute(query,values)
     except Exception as e:
         LOG.logger.error(f'Query: {query} ({type(query)})\nValues: {values} ({type(values)})\n')
         raise e
 
+def _Insert_Returning(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dict[str,Any]],conflict:str|None,returning:str) -> list[dict[str,Any]]:
+    """Multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING for InsertEntries."""
+    if len(data_list) == 0:
+        return []
+
+    columns = list(data_list[0].keys())
+    conflict_text = f' ON CONFLICT ({conflict}) DO NOTHING' if conflict else ''
+    query: str = f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s{conflict_text} RETURNING {returning}'
+    values = [tuple(item[col] for col in columns) for item in data_list]
+
+    try:
+        LOG.logger.debug(f'{len(data_list)} item(s) to add to table {table} in database.')
+        rows = psycopg2.extras.execute_values(cursor,query,values,page_size=_PAGE_SIZE,fetch=True)
+    except Exception as e:
+        LOG.logger.error(f'Query: {query}\nValues: {values}\n')
+        raise e
+
+    entry_columns:list[str] = [description[0] for description in cursor.description]
+    return [dict(zip(entry_columns,row)) for row in rows]
+
 def UpdateEntry(cursor:psycopg2.extensions.cursor,table:str,data_column:str,data_value:Any,filter_column:str,filter_value:Any):
     """
     Updates an entry with a new value for a single column.
@@ -97,15 +252,44 @@ def UpdateEntry(cursor:psycopg2.extensions.cursor,table:str,data_column:str,data
 
         query: str = f'UPDATE {table} SET {data_column} = %s WHERE {filter_column} = %s'
 
-        if CFG.DB_VERBOSE == True:
-            LOG.logger.info(query)
-            LOG.logger.info(values)
-
         cursor.execute(query,values)
     except Exception as e:
         LOG.logger.error(f'Query: {query} ({type(query)})\nValues: {values} ({type(values)})\n')
         raise e
 
+def UpsertEntries(cursor:psycopg2.extensions.cursor,table:str,data_list:list[dict[str,Any]],conflict:str) -> None:
+    """
+    Inserts a list of dictionaries into a target table in a single statement. Rows that hit the conflict columns
+    get every other given column overwritten instead. All dictionaries need the same keys.
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :param table: Target table
+    :type table: String
+    :param data_list: A list of entries to insert or update.
+    :type data_list: List of Dictionaries
+    :param conflict: Column name(s) of the Primary Key or Unique Constraint, formatted as '[ColName], [Colname], etc.'
+    :type conflict: String
+    """
+    if len(data_list) == 0:
+        return
+
+    columns = list(data_list[0].keys())
+    conflict_columns = {col.strip() for col in conflict.split(',')}
+    updates = ', '.join([f'{col} = EXCLUDED.{col}' for col in columns if col not in conflict_columns])
+    action = f'DO UPDATE SET {updates}' if updates != '' else 'DO NOTHING'
+
+    query: str = f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s ON CONFLICT ({conflict}) {action}'
+    values = [tuple(item[col] for col in columns) for item in data_list]
+
+    try:
+        LOG.logger.debug(f'{len(data_list)} item(s) to upsert into table {table} in database.')
+
+        psycopg2.extras.execute_values(cursor,query,values,page_size=_PAGE_SIZE)
+    except Exception as e:
+        LOG.logger.error(f'Query: {query}\nValues: {values}\n')
+        raise e
+
 def DeleteEntries(cursor:psycopg2.extensions.cursor,table:str,filter:dict[str,Any]|None=None) -> None:
     """
     Deletes an entry in the target table matching a given filter. Deletes ALL entries if no filter given.
@@ -122,15 +306,11 @@ def DeleteEntries(cursor:psycopg2.extensions.cursor,table:str,filter:dict[str,An
 
     try:
         if filter != None:
-            column_list:str = " AND ".join([f'{col} = %s' for col in filter.keys()])
-            values = list(filter.values())
+            column_list:str = _Filter_Columns(filter)
+            values = [list(value) if isinstance(value,(tuple,set)) else value for value in filter.values()]
 
             query: str = f'{base_query} WHERE {column_list}'
 
-            if CFG.DB_VERBOSE == True:
-                LOG.logger.info(query)
-                LOG.logger.info(values)
-
             cursor.execute(query,values)
         else:
             LOG.logger.info(base_query)
@@ -150,7 +330,7 @@ def GetEntries(cursor:psycopg2.extensions.cursor,table:str,columns:str='*',filte
     :param columns: Retrieves values from specified columns. If none are specified, get all values from entries.
     :type columns: String formatted as '[ColName], [Colname], etc.'
     :param filter: Get results that contain specific values in specific columns. If non specified, don't filter anything
-    :type filter: Dictionary of {[Column] , [Value]}
+    :type filter: Dictionary of {[Column] , [Value]} (A list as the value matches any of its items)
     :return: List of entries
     :rtype: Format matching Entry Objects (List of Dictionaries {[Colname] , [Value]})
     """
@@ -158,9 +338,9 @@ def GetEntries(cursor:psycopg2.extensions.cursor,table:str,columns:str='*',filte
 
     if filter != None:
         
-        column_list:str = " AND ".join([f'{col} = %s' for col in filter.keys()])
+        column_list:str = _Filter_Columns(filter)
 
-        values = list(filter.values())
+        values = [list(value) if isinstance(value,(tuple,set)) else value for value in filter.values()]
 
         query = f'{base_query} WHERE {column_list}'
         cursor.execute(query,values)
@@ -176,4 +356,130 @@ def GetEntries(cursor:psycopg2.extensions.cursor,table:str,columns:str='*',filte
         row_dict = dict(zip(entry_columns,row))
         results.append(row_dict)
 
-    return results
\ No newline at end of file
+    return results
+
+# Server-side cursors need a unique name per connection
+_cursor_ids = itertools.count(1)
+
+def StreamEntries(database:psycopg2.extensions.connection,table:str,columns:str='*',filter:dict[str,Any]|None=None,
+                  fetch_size:int|None=None,as_dict:bool=True,order_by:str|None=None) -> Iterator[dict[str,Any]|tuple]:
+    """
+    Same as GetEntries, but streams the rows from a named server-side cursor instead of loading them all into memory.
+    Rows are pulled fetch_size at a time as the generator is consumed.
+
+    The cursor is declared WITH HOLD so it survives commits made on the same connection while iterating.
+    Close the generator (or run it to the end) to release the cursor on the server.
+
+    :param database: Database connection object (NOT a cursor, the named cursor is created from it).
+    :type database: Connection
+    :param table: Table name
+    :type table: String
+    :param columns: Retrieves values from specified columns. If none are specified, get all values from entries.
+    :type columns: String formatted as '[ColName], [Colname], etc.'
+    :param filter: Get results that contain specific values in specific columns. If non specified, don't filter anything
+    :type filter: Dictionary of {[Column] , [Value]}
+    :param fetch_size: Rows per round trip to the server. Defaults to DB_FETCH_SIZE in Settings.py
+    :type fetch_size: Integer
+    :param as_dict: Yield dictionaries of {[Colname] , [Value]} like GetEntries. Set to False to yield the raw tuples (Faster).
+    :type as_dict: Boolean
+    :param order_by: Optional ORDER BY clause contents
+    :type order_by: String
+    :return: Generator of entries
+    :rtype: Dictionaries {[Colname] , [Value]} or Tuples
+    """
+    query: str = f'SELECT {columns} FROM {table}'
+    values: list[Any] = []
+
+    if filter != None:
+        column_list:str = _Filter_Columns(filter)
+        values = [list(value) if isinstance(value,(tuple,set)) else value for value in filter.values()]
+        query = f'{query} WHERE {column_list}'
+
+    if order_by != None:
+        query = f'{query} ORDER BY {order_by}'
+
+    cursor = database.cursor(name=f'stream_{table}_{next(_cursor_ids)}',withhold=True)
+    cursor.itersize = fetch_size if fetch_size is not None else CFG.DB_FETCH_SIZE
+
+    try:
+        cursor.execute(query,values)
+
+        if as_dict == False:
+            yield from cursor
+        else:
+            entry_columns:list[str]|None = None
+            for row in cursor:
+                # Named cursors only get a description after the first fetch
+                if entry_columns is None:
+                    entry_columns = [description[0] for description in cursor.description]
+                yield dict(zip(entry_columns,row))
+    except Exception as e:
+        LOG.logger.error(f'Query: {query}\nValues: {values}\n')
+        raise e
+    finally:
+        cursor.close()
+
+def CountEntries(cursor:psycopg2.extensions.cursor,table:str,filter:dict[str,Any]|None=None) -> int:
+    """
+    Counts the entries in a table matching a filter. Useful for sizing progress bars when streaming with StreamEntries.
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :param table: Table name
+    :type table: String
+    :param filter: Count entries that contain specific values in specific columns. If non specified, count everything.
+    :type filter: Dictionary of {[Column] , [Value]}
+    :return: Number of matching entries
+    :rtype: Integer
+    """
+    query: str = f'SELECT count(*) FROM {table}'
+    values: list[Any] = []
+
+    if filter != None:
+        column_list:str = _Filter_Columns(filter)
+        values = [list(value) if isinstance(value,(tuple,set)) else value for value in filter.values()]
+        query = f'{query} WHERE {column_list}'
+
+    cursor.execute(query,values)
+    return cursor.fetchone()[0]
+
+def Refresh_Video_Summary(cursor:psycopg2.extensions.cursor,video_id:str) -> None:
+    """
+    Rebuilds the video_chat_summary row for a single video. Only reads the one messages partition the video lives in,
+    so it's cheap enough to run after every video instead of refreshing a materialized view over the whole table.
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :param video_id: The video to summarize
+    :type video_id: String
+    """
+    query: str = '''INSERT INTO video_chat_summary (video_id, messages, first_message, last_message, chat_duration, chats_per_min, unique_users)
+        SELECT video_id,
+            count(*),
+            min(datetime),
+            max(datetime),
+            EXTRACT(epoch FROM max(datetime) - min(datetime)),
+            CASE
+                WHEN EXTRACT(epoch FROM max(datetime) - min(datetime)) > 0 THEN count(*)::numeric / (EXTRACT(epoch FROM max(datetime) - min(datetime)) / 60)
+                ELSE 0
+            END,
+            count(DISTINCT user_id)
+        FROM messages
+        WHERE video_id = %s
+        GROUP BY video_id
+        ON CONFLICT (video_id) DO UPDATE SET
+            messages = EXCLUDED.messages,
+            first_message = EXCLUDED.first_message,
+            last_message = EXCLUDED.last_message,
+            chat_duration = EXCLUDED.chat_duration,
+            chats_per_min = EXCLUDED.chats_per_min,
+            unique_users = EXCLUDED.unique_users'''
+    values = (video_id,)
+
+    try:
+        LOG.logger.debug(f'Refreshing chat summary for video {video_id}.')
+
+        cursor.execute(query,values)
+    except Exception as e:
+        LOG.logger.error(f'Query: {query}\nValues: {values}\n')
+        raise e
@@ -0,0 +1,201 @@
+# Native Stuff
+import os
+from typing import Any
+
+# Installed Stuff
+import pyarrow as pa
+import pyarrow.dataset
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+
+"""
+Columnar export of the messages table, one Arrow IPC (Feather v2) file per video.
+
+Files hold the same columns as the messages table. user_id, type, currency and video_id are dictionary encoded since
+they repeat constantly. Files are written to a temp name and renamed into place, so readers never see a partial file.
+
+Reading:
+    table = Export.Read_Video("dQw4w9WgXcQ")                   # One video, memory mapped
+    catalogue = Export.Open_Catalogue()                        # pyarrow.dataset over every exported video
+    catalogue.to_table(columns=["user_id","amount"],filter=pyarrow.dataset.field("amount") > 0)
+"""
+
+EXPORT_PATH = f"{CFG.DATA_PATH}/columnar"
+
+# Rows per record batch in the file. Also the number of rows held in Python lists at any one time while exporting.
+BATCH_ROWS = 65536
+
+MESSAGE_SCHEMA = pa.schema([
+    ("message_id",pa.string()),
+    ("message",pa.string()),
+    ("timestamp",pa.int64()),
+    ("time_in_seconds",pa.float32()),
+    ("type",pa.dictionary(pa.int32(),pa.string())),
+    ("video_id",pa.dictionary(pa.int32(),pa.string())),
+    ("user_id",pa.dictionary(pa.int32(),pa.string())),
+    ("user_name",pa.string()),
+    ("user_member_status",pa.int64()),
+    ("ismoderator",pa.bool_()),
+    ("isverified",pa.bool_()),
+    ("isowner",pa.bool_()),
+    ("amount",pa.float32()),
+    ("currency",pa.dictionary(pa.int32(),pa.string())),
+    ("symbol",pa.string()),
+    ("color",pa.string()),
+    ("datetime",pa.timestamp("us")),
+])
+
+def Video_Path(video_id:str):
+    """Path of the exported file for a video."""
+    return f"{EXPORT_PATH}/{video_id}.arrow"
+
+def Exported_Rows(video_id:str) -> int|None:
+    """
+    Number of rows in the exported file for a video, read from the file footer without loading the data.
+
+    :return: Row count, or None if the video hasn't been exported.
+    :rtype: Integer
+    """
+    path = Video_Path(video_id)
+    if not os.path.isfile(path):
+        return None
+    with pa.memory_map(path,'r') as source:
+        reader = pa.ipc.open_file(source)
+        metadata = reader.schema.metadata or {}
+        if b"rows" in metadata:
+            return int(metadata[b"rows"])
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+class _Dictionary:
+    """
+    Dictionary of one column shared by every batch of a file. Values only get added to the end, so each batch's
+    dictionary starts with the previous one and the writer only has to add the new values (A delta) to the file.
+    """
+    def __init__(self,value_type:pa.DataType) -> None:
+        self.value_type = value_type
+        self.indices:dict[Any,int] = {}
+        self.values:list[Any] = []
+
+    def encode(self,values:list[Any]) -> pa.DictionaryArray:
+        indices = []
+        for value in values:
+            if value is None:
+                indices.append(None)
+                continue
+            index = self.indices.get(value)
+            if index is None:
+                index = self.indices[value] = len(self.values)
+                self.values.append(value)
+            indices.append(index)
+        return pa.DictionaryArray.from_arrays(pa.array(indices,type=pa.int32()),pa.array(self.values,type=self.value_type))
+
+def _to_batch(columns:list[list[Any]],dictionaries:dict[str,_Dictionary]):
+    """Turns a list of column value lists into a record batch matching MESSAGE_SCHEMA."""
+    arrays = []
+    for field, values in zip(MESSAGE_SCHEMA,columns):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(dictionaries[field.name].encode(values))
+        else:
+            arrays.append(pa.array(values,type=field.type))
+    return pa.RecordBatch.from_arrays(arrays,schema=MESSAGE_SCHEMA)
+
+def Export_Video(database:DB.PostgresClass,video_id:str,expected_rows:int|None=None) -> int:
+    """
+    Exports every message of a video from the database to its columnar file, replacing any older export.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    :param video_id: Video to export
+    :type video_id: String
+    :param expected_rows: If given and the existing export already has this many rows, the export is skipped.
+    :type expected_rows: Integer
+    :return: Number of rows written (0 when skipped)
+    :rtype: Integer
+    """
+    if expected_rows is not None and Exported_Rows(video_id) == expected_rows:
+        LOG.logger.debug(f'Columnar export for {video_id} is up to date.')
+        return 0
+
+    os.makedirs(EXPORT_PATH,exist_ok=True)
+
+    # The row count goes in the schema, which is written before the rows. Nothing else writes a video's messages while
+    # it's being exported (See WorkQueue.py), if something did the export is dropped below and tried again later.
+    database.cursor.execute("SELECT count(*) FROM messages WHERE video_id = %s",(video_id,))
+    expected = database.cursor.fetchone()[0]
+    schema = MESSAGE_SCHEMA.with_metadata({"rows":str(expected),"video_id":video_id})
+
+    columns = ", ".join(f'"{name}"' for name in MESSAGE_SCHEMA.names)
+    rows = DB.StreamEntries(database.database,"messages",columns,{"video_id":video_id},as_dict=False,order_by="time_in_seconds, message_id")
+
+    path = Video_Path(video_id)
+    temp_path = f"{EXPORT_PATH}/{video_id}_TEMP.arrow"
+    options = pa.ipc.IpcWriteOptions(compression=CFG.COLUMNAR_COMPRESSION,emit_dictionary_deltas=True)
+    dictionaries = {field.name:_Dictionary(field.type.value_type) for field in MESSAGE_SCHEMA if pa.types.is_dictionary(field.type)}
+    buffer:list[list[Any]] = [[] for _ in MESSAGE_SCHEMA]
+    total = 0
+
+    # Batches go into the file as they fill up, so only BATCH_ROWS rows are in memory however long the video is
+    with pa.OSFile(temp_path,'wb') as sink:
+        with pa.ipc.new_file(sink,schema,options=options) as writer:
+            for row in rows:
+                for column, value in zip(buffer,row):
+                    column.append(value)
+                if len(buffer[0]) >= BATCH_ROWS:
+                    writer.write_batch(_to_batch(buffer,dictionaries))
+                    total += len(buffer[0])
+                    buffer = [[] for _ in MESSAGE_SCHEMA]
+            if len(buffer[0]) > 0:
+                writer.write_batch(_to_batch(buffer,dictionaries))
+                total += len(buffer[0])
+
+    if total != expected:
+        os.remove(temp_path)
+        LOG.logger.warning(f'Messages of {video_id} changed while exporting ({expected} counted, {total} read), the export was dropped.')
+        return 0
+    os.replace(temp_path,path)
+
+    LOG.logger.debug(f'Exported {total} message(s) from {video_id} to {path}')
+    return total
+
+def Export_Missing(database:DB.PostgresClass) -> int:
+    """
+    Exports every video whose columnar file is missing or doesn't match the message count in video_chat_summary.
+    Used to backfill exports for a catalogue that was downloaded before exporting was turned on.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    :return: Number of videos exported
+    :rtype: Integer
+    """
+    exported = 0
+    for video_id, messages in DB.StreamEntries(database.database,"video_chat_summary","video_id, messages",as_dict=False):
+        if Exported_Rows(video_id) != messages:
+            Export_Video(database,video_id)
+            exported += 1
+    return exported
+
+def Read_Video(video_id:str) -> pa.Table:
+    """
+    Loads one video's export. The file is memory mapped, so only the columns that get used are actually read
+    (Set COLUMNAR_COMPRESSION to None in Settings.py for fully zero-copy reads).
+
+    :param video_id: Video to load
+    :type video_id: String
+    :return: Messages of the video
+    :rtype: pyarrow Table
+    """
+    with pa.memory_map(Video_Path(video_id),'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+def Open_Catalogue() -> pyarrow.dataset.Dataset:
+    """
+    Opens every exported video as one dataset for scanning the whole catalogue without touching Postgres.
+
+    :return: Dataset of all exported messages
+    :rtype: pyarrow Dataset
+    """
+    files = [f"{EXPORT_PATH}/{name}" for name in sorted(os.listdir(EXPORT_PATH)) if name.endswith(".arrow") and not name.endswith("_TEMP.arrow")]
+    return pyarrow.dataset.dataset(files,schema=MESSAGE_SCHEMA,format="arrow")
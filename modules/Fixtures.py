@@ -0,0 +1,381 @@
+# Native Stuff
+import os,json,time,zlib,sqlite3,threading
+from typing import Any,Callable,Iterable,Iterator
+from urllib.parse import urlsplit,parse_qsl,urlencode
+
+# Installed Stuff
+import xxhash
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+
+"""
+Records everything a run fetches from the network, and plays it back later without network access or a login, so
+whole runs of Main.py can be benchmarked and profiled offline against a local Postgres.
+
+Turned on with the YTDB_FIXTURES environment variable:
+    record  Runs as normal, but every YouTube Data API response (playlistItems, videos, channels...), every chat
+            ChatDownloader downloads (Messages and when they arrived) and every image fetched is also saved to
+            FIXTURE_FILE. Conditional headers are left off image requests so the whole image gets saved.
+    replay  Nothing goes to the network: the API is built without OAuth and answered from the file, chats come back
+            with their recorded gaps scaled by FIXTURE_CHAT_TIME_SCALE and images after FIXTURE_IMAGE_LATENCY_MS.
+
+Recording the same request again in a later run replaces what was recorded before. Within a run, a request made
+more than once (e.g. the live pass and the replay of a stream) is saved once per time it was made, and replayed in
+that order (The last one again after that). Anything that wasn't recorded raises FixtureMissing.
+
+The file is SQLite: API and image bodies are stored once per distinct body (zlib compressed when that helps), chats
+as compressed blocks of messages.
+"""
+
+RECORD = "record"
+REPLAY = "replay"
+
+FIXTURE_FILE = os.environ.get("YTDB_FIXTURE_FILE") or f"{CFG.DATA_PATH}/Fixtures.sqlite3"
+
+# Kinds of recorded requests
+API = "api"
+IMAGE = "image"
+CHAT = "chat"
+
+CHAT_BLOCK = 500 # Messages compressed together
+
+class FixtureMissing(Exception):
+    """A request was made in replay mode that was never recorded."""
+
+def _Pack(data:bytes) -> tuple[int,bytes]:
+    """Compresses data if that saves anything worth it. (Compressed, Data)"""
+    packed = zlib.compress(data,9)
+    return (1, packed) if len(packed) < len(data) * 0.9 else (0, data)
+
+def _Unpack(compressed:int,data:bytes) -> bytes:
+    return zlib.decompress(data) if compressed == 1 else data
+
+def Request_Key(method:str,uri:str) -> str:
+    """
+    What identifies a request: the method and the URL with its query sorted (googleapiclient doesn't promise an order).
+
+    :return: "[METHOD] [URL]"
+    :rtype: String
+    """
+    parts = urlsplit(uri)
+    query = urlencode(sorted(parse_qsl(parts.query,keep_blank_values=True)))
+    return f"{method.upper()} {parts.scheme}://{parts.netloc}{parts.path}{'?' if query != '' else ''}{query}"
+
+class FixtureStore:
+    """
+    The fixture file. Safe to share between threads (Live stream watchers download chats at once).
+
+    :param mode: RECORD or REPLAY
+    :type mode: String
+    :param path: Defaults to FIXTURE_FILE
+    :type path: String
+    """
+    def __init__(self,mode:str,path:str|None=None) -> None:
+        if mode not in (RECORD,REPLAY):
+            raise ValueError(f"YTDB_FIXTURES has to be {RECORD} or {REPLAY}, not {mode}")
+        self.mode = mode
+        self.path = path if path is not None else FIXTURE_FILE
+        if mode == REPLAY and os.path.isfile(self.path) == False:
+            raise FileNotFoundError(f"No fixtures recorded at {self.path}")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path,check_same_thread=False,isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (kind TEXT NOT NULL, key TEXT NOT NULL, seq INTEGER NOT NULL, status INTEGER NOT NULL, headers TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (kind, key, seq));
+            CREATE INDEX IF NOT EXISTS responses_body ON responses (body);
+            CREATE TABLE IF NOT EXISTS bodies (hash TEXT PRIMARY KEY, compressed INTEGER NOT NULL, data BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS chat_blocks (video_id TEXT NOT NULL, seq INTEGER NOT NULL, block INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (video_id, seq, block));
+            CREATE TABLE IF NOT EXISTS chat_ends (video_id TEXT NOT NULL, seq INTEGER NOT NULL, messages INTEGER NOT NULL, seconds REAL NOT NULL, error TEXT, error_message TEXT, PRIMARY KEY (video_id, seq));
+        """)
+        self._seqs:dict[tuple[str,str],int] = {} # Times each request was made this run
+        self.counts:dict[str,int] = {API:0,IMAGE:0,CHAT:0}
+        self.missing = 0
+
+    def _Next(self,kind:str,key:str) -> int:
+        """
+        Which recording of a request this is. The first time a request is recorded in a run, what earlier runs
+        recorded for it is dropped (Bodies nothing uses anymore are swept once, in Close). Call with the lock held.
+        """
+        seq = self._seqs.get((kind,key),0)
+        self._seqs[(kind,key)] = seq + 1
+        if self.mode == RECORD and seq == 0:
+            if kind == CHAT:
+                self._conn.execute("DELETE FROM chat_blocks WHERE video_id = ?",(key,))
+                self._conn.execute("DELETE FROM chat_ends WHERE video_id = ?",(key,))
+            else:
+                self._conn.execute("DELETE FROM responses WHERE kind = ? AND key = ?",(kind,key))
+        return seq
+
+    def _Replay_Seq(self,kind:str,key:str) -> int:
+        """The recording to replay for a request, the last one once they've all been used. Call with the lock held."""
+        seq = self._Next(kind,key)
+        if kind == CHAT:
+            row = self._conn.execute("SELECT max(seq) FROM chat_ends WHERE video_id = ?",(key,)).fetchone()
+        else:
+            row = self._conn.execute("SELECT max(seq) FROM responses WHERE kind = ? AND key = ?",(kind,key)).fetchone()
+        if row[0] is None:
+            self.missing += 1
+            raise FixtureMissing(f"Nothing recorded for {kind} {key} in {self.path}")
+        return min(seq,row[0])
+
+    #----------------------#
+    #-- HTTP (API/IMAGE) --#
+    #----------------------#
+
+    def Save_Response(self,kind:str,key:str,status:int,headers:dict[str,str],body:bytes):
+        """
+        Records a response.
+
+        :param kind: API or IMAGE
+        :type kind: String
+        :param key: See Request_Key
+        :type key: String
+        """
+        body_hash = xxhash.xxh3_128_hexdigest(body)
+        compressed, data = _Pack(body)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                seq = self._Next(kind,key)
+                self._conn.execute("INSERT OR IGNORE INTO bodies (hash, compressed, data) VALUES (?, ?, ?)",(body_hash,compressed,data))
+                self._conn.execute("INSERT OR REPLACE INTO responses (kind, key, seq, status, headers, body) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (kind,key,seq,status,json.dumps(headers),body_hash))
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.counts[kind] += 1
+
+    def Load_Response(self,kind:str,key:str) -> tuple[int,dict[str,str],bytes]:
+        """
+        The recorded response to a request.
+
+        :return: (Status, Headers, Body)
+        :rtype: Tuple
+        """
+        with self._lock:
+            seq = self._Replay_Seq(kind,key)
+            status, headers, compressed, data = self._conn.execute("""SELECT status, headers, compressed, data FROM responses
+                JOIN bodies ON bodies.hash = responses.body WHERE kind = ? AND key = ? AND seq = ?""",(kind,key,seq)).fetchone()
+            self.counts[kind] += 1
+        return status, json.loads(headers), _Unpack(compressed,data)
+
+    #----------#
+    #-- CHAT --#
+    #----------#
+
+    def Record_Chat(self,video_id:str,start:Callable[[],Iterable[dict[str,Any]]]) -> Iterator[dict[str,Any]]:
+        """
+        Passes the messages of a chat download through while recording them.
+
+        :param start: Starts the download, called on the first message wanted so its errors are recorded as well
+        :type start: Function returning an iterable of messages (e.g. ChatDownloader's get_chat)
+        :return: The same messages
+        :rtype: Generator of Dictionaries
+        """
+        with self._lock:
+            seq = self._Next(CHAT,video_id)
+        started = time.monotonic()
+        block:list[tuple[float,dict[str,Any]]] = []
+        blocks = 0
+        messages = 0
+        error:BaseException|None = None
+
+        def Flush():
+            nonlocal block, blocks
+            if len(block) == 0:
+                return
+            data = zlib.compress("\n".join(json.dumps(item,separators=(',',':')) for item in block).encode('utf-8'),9)
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO chat_blocks (video_id, seq, block, data) VALUES (?, ?, ?, ?)",(video_id,seq,blocks,data))
+            blocks += 1
+            block = []
+
+        try:
+            for message in start():
+                block.append((round(time.monotonic() - started,3),message))
+                messages += 1
+                if len(block) >= CHAT_BLOCK:
+                    Flush()
+                yield message
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            Flush()
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO chat_ends (video_id, seq, messages, seconds, error, error_message) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (video_id,seq,messages,time.monotonic() - started,type(error).__name__ if error is not None else None,str(error) if error is not None else None))
+                self.counts[CHAT] += 1
+
+    def Replay_Chat(self,video_id:str,errors:dict[str,type[Exception]]) -> Iterator[dict[str,Any]]:
+        """
+        The recorded messages of a chat, spaced out like they arrived (Gaps scaled by FIXTURE_CHAT_TIME_SCALE).
+
+        :param errors: Exceptions to raise for recorded errors, by the name of the error recorded
+                       (e.g. {"NoChatReplay": Classes.NoChatReplay}). Other errors are raised as RuntimeError
+        :type errors: Dictionary
+        :return: The recorded messages
+        :rtype: Generator of Dictionaries
+        """
+        with self._lock:
+            seq = self._Replay_Seq(CHAT,video_id)
+            error, error_message = self._conn.execute("SELECT error, error_message FROM chat_ends WHERE video_id = ? AND seq = ?",(video_id,seq)).fetchone()
+            blocks = [row[0] for row in self._conn.execute("SELECT block FROM chat_blocks WHERE video_id = ? AND seq = ? ORDER BY block",(video_id,seq))]
+            self.counts[CHAT] += 1
+
+        started = time.monotonic()
+        for number in blocks:
+            with self._lock:
+                data = self._conn.execute("SELECT data FROM chat_blocks WHERE video_id = ? AND seq = ? AND block = ?",(video_id,seq,number)).fetchone()[0]
+            for line in zlib.decompress(data).decode('utf-8').split("\n"):
+                offset, message = json.loads(line)
+                wait = offset * CFG.FIXTURE_CHAT_TIME_SCALE - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+                yield message
+
+        if error is not None:
+            raise errors.get(error,RuntimeError)(error_message)
+
+    def Summary(self) -> dict[str,Any]:
+        """What the file holds: {"api", "image", "chat", "chat_messages", "bytes"}"""
+        with self._lock:
+            summary = {kind:count for kind, count in self._conn.execute("SELECT kind, count(*) FROM responses GROUP BY kind")}
+            summary[CHAT], summary["chat_messages"] = self._conn.execute("SELECT count(*), coalesce(sum(messages),0) FROM chat_ends").fetchone()
+        summary["bytes"] = sum(os.path.getsize(f"{self.path}{suffix}") for suffix in ("","-wal") if os.path.isfile(f"{self.path}{suffix}"))
+        return {API:summary.get(API,0),IMAGE:summary.get(IMAGE,0),CHAT:summary[CHAT],"chat_messages":summary["chat_messages"],"bytes":summary["bytes"]}
+
+    def Report(self) -> str:
+        """What was recorded/replayed this run, for the end of run log."""
+        summary = self.Summary()
+        return (f"Fixtures {'recorded to' if self.mode == RECORD else 'replayed from'} {self.path}: {self.counts[API]} API response(s), "
+                f"{self.counts[CHAT]} chat(s), {self.counts[IMAGE]} image(s) this run"
+                f"{f', {self.missing} never recorded' if self.missing > 0 else ''}. "
+                f"The file holds {summary[API]} API response(s), {summary[CHAT]} chat(s) ({summary['chat_messages']} messages), "
+                f"{summary[IMAGE]} image(s) in {summary['bytes'] / 1048576:.1f}MB")
+
+    def Close(self):
+        """Drops the bodies no recorded response uses anymore (After recording) and closes the file."""
+        with self._lock:
+            if self.mode == RECORD:
+                self._conn.execute("DELETE FROM bodies WHERE hash NOT IN (SELECT body FROM responses)")
+            self._conn.close()
+
+_store:FixtureStore|None = None
+_store_lock = threading.Lock()
+
+def Store() -> FixtureStore:
+    """The fixture file of this run (Opened the first time it's needed, in the mode YTDB_FIXTURES asks for)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FixtureStore(CFG.FIXTURES)
+            LOG.logger.info(f"{'Recording' if _store.mode == RECORD else 'Replaying'} network responses {'to' if _store.mode == RECORD else 'from'} {_store.path}")
+    return _store
+
+#---------#
+#-- API --#
+#---------#
+
+class RecordingHttp:
+    """
+    Stands in for the httplib2.Http googleapiclient sends requests with, passing them on to the real one and
+    recording the responses.
+
+    :param http: What actually sends the requests (google_auth_httplib2.AuthorizedHttp for OAuth)
+    :type http: httplib2.Http-like
+    """
+    def __init__(self,http:Any) -> None:
+        self.http = http
+
+    def request(self,uri:str,method:str="GET",*args,**kwargs) -> tuple[Any,bytes]:
+        response, content = self.http.request(uri,method,*args,**kwargs)
+        Store().Save_Response(API,Request_Key(method,uri),response.status,dict(response),content)
+        return response, content
+
+    def __getattr__(self,name:str) -> Any:
+        return getattr(self.http,name)
+
+class ReplayHttp:
+    """Stands in for httplib2.Http, answering googleapiclient's requests from the fixture file."""
+    def request(self,uri:str,method:str="GET",*args,**kwargs) -> tuple[Any,bytes]:
+        import httplib2
+        if CFG.FIXTURE_API_LATENCY_MS > 0:
+            time.sleep(CFG.FIXTURE_API_LATENCY_MS / 1000)
+        status, headers, content = Store().Load_Response(API,Request_Key(method,uri))
+        headers["status"] = str(status)
+        return httplib2.Response(headers), content
+
+    def close(self):
+        pass
+
+#------------#
+#-- IMAGES --#
+#------------#
+
+class _Headers(dict):
+    """Response headers, looked up without caring about case like requests does."""
+    def __init__(self,headers:dict[str,str]) -> None:
+        super().__init__({key.lower():value for key, value in headers.items()})
+
+    def get(self,key:str,default:Any=None) -> Any:
+        return super().get(key.lower(),default)
+
+class ImageResponse:
+    """The parts of a requests.Response that Images.Fetch_Image uses, for a fetched or recorded image."""
+    def __init__(self,status:int,headers:dict[str,str],body:bytes) -> None:
+        self.status_code = status
+        self.ok = status < 400
+        self.headers = _Headers(headers)
+        self.content = body
+
+    def iter_content(self,chunk_size:int=1) -> Iterator[bytes]:
+        for start in range(0,len(self.content),chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __repr__(self) -> str:
+        return f"<Response [{self.status_code}]>"
+
+_CONDITIONAL = ("if-none-match","if-modified-since")
+
+class ImageSession:
+    """
+    Stands in for the requests.Session images are fetched with. Records every image fetched, or answers from the
+    recordings without any network access (Conditional requests get a 304 if they match the recorded image).
+    """
+    def __init__(self,mode:str) -> None:
+        self.mode = mode
+        self.session:Any = None
+        if mode == RECORD:
+            import requests
+            self.session = requests.Session()
+
+    def get(self,url:str,headers:dict[str,str]|None=None,timeout:float|None=None,**kwargs) -> ImageResponse:
+        headers = {key:value for key, value in (headers or {}).items()}
+        conditional = {key.lower():value for key, value in headers.items() if key.lower() in _CONDITIONAL}
+        key = Request_Key("GET",url)
+
+        if self.mode == RECORD:
+            # The whole image is recorded even when this run already has it, a replay might start without it
+            response = self.session.get(url,headers={key:value for key, value in headers.items() if key.lower() not in _CONDITIONAL},timeout=timeout)
+            Store().Save_Response(IMAGE,key,response.status_code,dict(response.headers),response.content)
+            status, recorded, body = response.status_code, dict(response.headers), response.content
+        else:
+            if CFG.FIXTURE_IMAGE_LATENCY_MS > 0:
+                time.sleep(CFG.FIXTURE_IMAGE_LATENCY_MS / 1000)
+            status, recorded, body = Store().Load_Response(IMAGE,key)
+
+        # Answer conditional requests like the CDN would
+        found = _Headers(recorded)
+        if status == 200 and ((conditional.get("if-none-match") is not None and conditional["if-none-match"] == found.get("etag"))
+                              or (conditional.get("if-modified-since") is not None and conditional["if-modified-since"] == found.get("last-modified"))):
+            return ImageResponse(304,recorded,b"")
+        return ImageResponse(status,recorded,body)
@@ -0,0 +1,337 @@
+# Native Stuff
+import os,re,copy,json,zlib,contextlib
+from datetime import datetime
+from typing import Any,Callable,Iterator
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+
+"""
+Version history of the video and user JSON snapshots, kept as one compressed log per video/user.
+
+[name].json is still the latest version in full (Same as before), every version including the latest is also in
+[name]_History.jsonl.gz:
+    1. Each version is one JSON line, gzipped on its own and appended to the end of the file. Nothing already written
+       is ever rewritten, so a run killed mid-write only loses the version it was writing.
+    2. A version is either a full copy (Base) or a JSON Patch (RFC 6902, add/remove/replace) against the version
+       before it. Most changes are a view count or a title, a few dozen bytes instead of another full file.
+    3. Every HISTORY_BASE_INTERVAL versions a full copy is stored again, so rebuilding any version applies at most
+       that many patches.
+
+History_Compact.py turns the [name]_[N].json copies made before this into logs.
+"""
+
+_LEGACY_NAME = re.compile(r"^([A-Za-z0-9_-]{11}|UC[A-Za-z0-9_-]{22})_(\d+)\.json$") # Video IDs are 11 characters, channel IDs UC + 22
+
+def History_Path(folder:str,name:str) -> str:
+    """Where the history log of a video/user lives."""
+    return f"{folder}/{name}_History.jsonl.gz"
+
+#-------------#
+#-- LOCKING --#
+#-------------#
+
+@contextlib.contextmanager
+def _Locked(folder:str,name:str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on [name]_History.lock while the history of a video/user is being written. The users
+    folder is shared by every channel's run (See UserCache.py), so two of them can save the same user at once.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None # Windows
+    with open(f"{folder}/{name}_History.lock",'a+b') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(),fcntl.LOCK_EX)
+            yield
+            return
+        import msvcrt
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(),msvcrt.LK_LOCK,1) # Gives up after 10 seconds, keep waiting
+                break
+            except OSError:
+                pass
+        try:
+            yield
+        finally:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(),msvcrt.LK_UNLCK,1)
+
+#-------------#
+#-- PATCHES --#
+#-------------#
+
+def _Escape(key:str) -> str:
+    return key.replace("~","~0").replace("/","~1")
+
+def _Unescape(token:str) -> str:
+    return token.replace("~1","/").replace("~0","~")
+
+def Diff(old:dict[str,Any],new:dict[str,Any],path:str="") -> list[dict[str,Any]]:
+    """
+    JSON Patch that turns old into new. Objects are compared key by key, anything else (Lists included) is replaced
+    whole when it changed.
+
+    :param old: Previous version
+    :type old: Dictionary
+    :param new: Next version
+    :type new: Dictionary
+    :return: RFC 6902 operations
+    :rtype: List of Dictionaries
+    """
+    operations = []
+    for key in old:
+        if key not in new:
+            operations.append({"op":"remove","path":f"{path}/{_Escape(key)}"})
+    for key, value in new.items():
+        key_path = f"{path}/{_Escape(key)}"
+        if key not in old:
+            operations.append({"op":"add","path":key_path,"value":value})
+        elif isinstance(value,dict) and isinstance(old[key],dict):
+            operations += Diff(old[key],value,key_path)
+        elif type(value) != type(old[key]) or value != old[key]:
+            operations.append({"op":"replace","path":key_path,"value":value})
+    return operations
+
+def Apply(document:dict[str,Any],patch:list[dict[str,Any]]) -> dict[str,Any]:
+    """Applies a patch made by Diff to the document (In place) and returns it."""
+    for operation in patch:
+        tokens = [_Unescape(token) for token in operation["path"].split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[token]
+        if operation["op"] == "remove":
+            del parent[tokens[-1]]
+        elif operation["op"] in ("add","replace"):
+            parent[tokens[-1]] = operation["value"]
+        else:
+            raise ValueError(f"Unsupported patch operation {operation['op']}")
+    return document
+
+#---------#
+#-- LOG --#
+#---------#
+
+def _Encode(record:dict[str,Any]) -> bytes:
+    """One record as its own gzip member, so the log can be appended to without touching what's already there."""
+    compressor = zlib.compressobj(9,zlib.DEFLATED,31)
+    return compressor.compress(json.dumps(record,separators=(',',':')).encode('utf-8') + b"\n") + compressor.flush()
+
+def _Read_Records(path:str) -> tuple[list[dict[str,Any]],int]:
+    """
+    Every record in a log, and how many bytes of the file they take up. A damaged tail (Cut off mid-write) is
+    left out of both.
+    """
+    with open(path,'rb') as file:
+        data = memoryview(file.read())
+
+    records = []
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(31)
+        try:
+            raw = decompressor.decompress(data[offset:])
+            if decompressor.eof == False:
+                break
+            records.append(json.loads(raw))
+        except (zlib.error,json.JSONDecodeError):
+            break
+        offset = len(data) - len(decompressor.unused_data)
+    return records, offset
+
+def _Rebuild(records:list[dict[str,Any]],version:int|None=None) -> dict[str,Any]|None:
+    """A version (Latest if None) from the records of a log, starting at the closest full copy before it."""
+    end = len(records) if version is None else next((i + 1 for i, record in enumerate(records) if record["version"] == version),0)
+    start = next((i for i in range(end - 1,-1,-1) if "base" in records[i]),None)
+    if start is None:
+        return None
+    document = copy.deepcopy(records[start]["base"])
+    for record in records[start + 1:end]:
+        Apply(document,record["patch"])
+    return document
+
+def _New_Record(previous:dict[str,Any]|None,data:dict[str,Any],version:int,fingerprint:str|None,saved:datetime) -> dict[str,Any]:
+    """A full copy or a patch, whichever the version calls for (And whichever is smaller)."""
+    record:dict[str,Any] = {"version":version,"saved":saved.isoformat(timespec="seconds")}
+    if fingerprint is not None:
+        record["fingerprint"] = fingerprint
+    if previous is not None and (version - 1) % CFG.HISTORY_BASE_INTERVAL != 0:
+        patch = Diff(previous,data)
+        if len(json.dumps(patch)) < len(json.dumps(data)):
+            record["patch"] = patch
+            return record
+    record["base"] = data
+    return record
+
+def Save(folder:str,name:str,data:dict[str,Any],fingerprint:str|None=None) -> int:
+    """
+    Adds a version to the history of a video/user and makes it the current [name].json.
+
+    :param folder: Folder the snapshots are in
+    :type folder: String
+    :param name: Video or user ID
+    :type name: String
+    :param data: API response item
+    :type data: Dictionary
+    :param fingerprint: Fingerprint of data, kept with the version
+    :type fingerprint: String
+    :return: Version number it was saved as
+    :rtype: Integer
+    """
+    path = History_Path(folder,name)
+    current_path = f"{folder}/{name}.json"
+    with _Locked(folder,name):
+        records:list[dict[str,Any]] = []
+
+        if os.path.isfile(path):
+            records, good_size = _Read_Records(path)
+            if good_size < os.path.getsize(path):
+                LOG.logger.warning(f"History of {name} has a damaged tail, dropping it ({os.path.getsize(path) - good_size} bytes).")
+                with open(path,'r+b') as file:
+                    file.truncate(good_size)
+        elif os.path.isfile(current_path):
+            # Snapshot from before histories existed becomes the first version
+            try:
+                with open(current_path,'r') as file:
+                    legacy = json.load(file)
+                records.append(_New_Record(None,legacy,1,None,datetime.fromtimestamp(os.path.getmtime(current_path))))
+                with open(path,'ab') as file:
+                    file.write(_Encode(records[-1]))
+            except json.JSONDecodeError:
+                pass
+
+        previous = _Rebuild(records)
+        if previous != data:
+            version = records[-1]["version"] + 1 if len(records) > 0 else 1
+            with open(path,'ab') as file:
+                file.write(_Encode(_New_Record(previous,data,version,fingerprint,datetime.now())))
+        else:
+            version = records[-1]["version"]
+
+        temp_path = f"{folder}/{name}_TEMP_{os.getpid()}.json" # Other processes may be saving into a shared folder
+        with open(temp_path,'w') as file:
+            file.write(json.dumps(data,indent=4))
+        os.replace(temp_path,current_path)
+    return version
+
+def _Versions(path:str) -> Iterator[tuple[dict[str,Any],dict[str,Any]]]:
+    records, _ = _Read_Records(path)
+    document:dict[str,Any]|None = None
+    for record in records:
+        document = copy.deepcopy(record["base"]) if "base" in record else Apply(document,record["patch"])
+        yield {key:record.get(key) for key in ("version","saved","fingerprint")}, copy.deepcopy(document)
+
+def Versions(folder:str,name:str) -> Iterator[tuple[dict[str,Any],dict[str,Any]]]:
+    """
+    Every version of a video/user, oldest first.
+
+    :return: Generator of ({"version", "saved", "fingerprint"}, [API Response Item])
+    :rtype: Tuple
+    """
+    path = History_Path(folder,name)
+    if os.path.isfile(path) == False:
+        return
+    yield from _Versions(path)
+
+def Load(folder:str,name:str,version:int|None=None) -> dict[str,Any]|None:
+    """
+    One version of a video/user, rebuilt from its history.
+
+    :param version: Version number, latest if None
+    :type version: Integer
+    :return: API response item, None if there's no such version
+    :rtype: Dictionary
+    """
+    path = History_Path(folder,name)
+    if os.path.isfile(path) == False:
+        return None
+    records, _ = _Read_Records(path)
+    return _Rebuild(records,version)
+
+#----------------#
+#-- COMPACTION --#
+#----------------#
+
+def Legacy_Snapshots(folder:str) -> dict[str,list[tuple[int,str]]]:
+    """
+    The [name]_[N].json copies in a folder.
+
+    :return: {[Video/User ID] , [([N], [Path]), ...]} oldest first
+    :rtype: Dictionary
+    """
+    found:dict[str,list[tuple[int,str]]] = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            match = _LEGACY_NAME.match(entry.name)
+            if match is not None and entry.is_file():
+                found.setdefault(match.group(1),[]).append((int(match.group(2)),entry.path))
+    for copies in found.values():
+        copies.sort()
+    return found
+
+def Compact(folder:str,name:str,copies:list[tuple[int,str]],fingerprint:Callable[[dict[str,Any]],str],dry_run:bool=False) -> tuple[int,int]:
+    """
+    Rewrites the history of a video/user with its [name]_[N].json copies in front, checks every version rebuilds to
+    exactly what it was, then deletes the copies. Nothing is deleted if anything doesn't match.
+
+    :param copies: ([N], [Path]) oldest first, from Legacy_Snapshots
+    :type copies: List of Tuples
+    :param fingerprint: Fingerprint function for the versions (Classes.Fingerprint)
+    :type fingerprint: Function
+    :param dry_run: Only work out the sizes
+    :type dry_run: Boolean
+    :return: (Bytes before, Bytes after)
+    :rtype: Tuple of Integers
+    """
+    path = History_Path(folder,name)
+    current_path = f"{folder}/{name}.json"
+    with _Locked(folder,name):
+        versions:list[tuple[dict[str,Any],datetime]] = []
+        used:list[str] = []
+        before = 0
+
+        for _, copy_path in copies:
+            try:
+                with open(copy_path,'r') as file:
+                    versions.append((json.load(file),datetime.fromtimestamp(os.path.getmtime(copy_path))))
+                used.append(copy_path)
+                before += os.path.getsize(copy_path)
+            except json.JSONDecodeError:
+                LOG.logger.warning(f"{copy_path} isn't valid JSON, leaving it alone.")
+
+        if os.path.isfile(path):
+            # Already has a history, the copies came before it
+            before += os.path.getsize(path)
+            versions += [(document,datetime.fromisoformat(meta["saved"])) for meta, document in Versions(folder,name)]
+        elif os.path.isfile(current_path):
+            with open(current_path,'r') as file:
+                versions.append((json.load(file),datetime.fromtimestamp(os.path.getmtime(current_path))))
+
+        # Drop back to back duplicates, the old rotation could leave some behind
+        deduped = [versions[i] for i in range(len(versions)) if i == 0 or versions[i][0] != versions[i - 1][0]]
+
+        encoded = bytearray()
+        previous = None
+        for number, (document, saved) in enumerate(deduped,1):
+            encoded += _Encode(_New_Record(previous,document,number,fingerprint(document),saved))
+            previous = document
+
+        if dry_run == True:
+            return before, len(encoded)
+
+        temp_path = f"{path}.TEMP"
+        with open(temp_path,'wb') as file:
+            file.write(encoded)
+        rebuilt = [document for _, document in _Versions(temp_path)]
+        if rebuilt != [document for document, _ in deduped]:
+            os.remove(temp_path)
+            raise ValueError(f"History of {name} didn't rebuild to the original snapshots, nothing was changed")
+        os.replace(temp_path,path)
+
+    for copy_path in used:
+        os.remove(copy_path)
+    return before, len(encoded)
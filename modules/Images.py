@@ -0,0 +1,204 @@
+# Native Stuff
+import os
+from typing import Any
+from datetime import datetime
+
+# Installed Stuff
+import xxhash
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Fixtures as FX
+
+"""
+Downloads thumbnails and profile pictures only when they've actually changed.
+
+The image_cache table (Or the shared cache for profile pictures, see UserCache.py) remembers, per saved image, the
+URL it came from, the ETag/Last-Modified the server sent and the hash of the file. YouTube image URLs change when the
+picture does, so an image with the same URL as last time is skipped without any request at all (Unless
+IMAGE_REVALIDATE is on, then a conditional request is made and a 304 costs nothing). Only new or changed images get
+downloaded, hashed and rotated into place.
+"""
+
+# Reused for every image so connections to the image CDNs stay open between downloads
+_session:Any = None
+
+# Bytes of image downloaded so far, for the run ledger (See RunLedger.py)
+downloaded_bytes = 0
+
+def _Session() -> Any:
+    """The shared requests session, requests is only imported once the first image is fetched."""
+    global _session
+    if _session is None:
+        if CFG.FIXTURES is not None:
+            _session = FX.ImageSession(CFG.FIXTURES) # Recorded/replayed, see Fixtures.py
+        else:
+            import requests
+            _session = requests.Session()
+    return _session
+
+class ImageResult:
+    """What happened when fetching an image."""
+    SKIPPED = "Skipped" # Same URL as the saved image, no request made
+    NOT_MODIFIED = "Not Modified" # Server answered 304
+    UNCHANGED = "Unchanged" # Downloaded, but identical to an image already saved
+    UPDATED = "Updated" # Downloaded and saved as the current image
+    FAILED = "Failed" # Server returned an error, nothing saved
+
+class ImageRecords:
+    """
+    Where Fetch_Image remembers what it saved: the image_cache table of the channel's database.
+    Artifacts are image paths relative to root.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    """
+    def __init__(self,database:DB.PostgresClass):
+        self.database = database
+        self.root = CFG.DATA_PATH
+
+    def Get(self,artifact:str) -> dict[str,Any]|None:
+        """The saved image's {"url", "etag", "last_modified", "hash"}, None if nothing was saved yet."""
+        cached = DB.GetEntries(self.database.cursor,"image_cache","url,etag,last_modified,hash",{"artifact":artifact})
+        return cached[0] if len(cached) > 0 else None
+
+    def Touch(self,artifact:str):
+        """Notes that the server confirmed the image is unchanged."""
+        DB.UpdateEntry(self.database.cursor,"image_cache","checked",datetime.now(),"artifact",artifact)
+        self.database.database.commit()
+
+    def Save(self,record:dict[str,Any]):
+        """Stores {"artifact", "url", "etag", "last_modified", "hash", "checked"} for the image now on disk."""
+        DB.UpsertEntries(self.database.cursor,"image_cache",[record],"artifact")
+        self.database.database.commit()
+
+def _Rotate_Into_Place(temp_path:str,folder:str,name:str,new_hash:str) -> bool:
+    """
+    Moves a freshly downloaded image into [folder]/[name].jpg, shifting the current one to [name]_[N].jpg.
+    If the new image matches the current or any older version it's thrown away instead.
+
+    :return: True if the image was saved, False if it was a duplicate
+    :rtype: Boolean
+    """
+    current_path = f"{folder}/{name}.jpg"
+
+    if not os.path.isfile(current_path):
+        os.replace(temp_path,current_path)
+        return True
+
+    # Hash the current and older versions for cross referencing
+    image_hashes = set()
+    with open(current_path,"rb") as image:
+        image_hashes.add(xxhash.xxh128_hexdigest(image.read()))
+
+    # Increment until no overlapping name
+    number = 1
+    new_path = f"{folder}/{name}_{number}.jpg"
+    while os.path.isfile(new_path):
+        with open(new_path,"rb") as image:
+            image_hashes.add(xxhash.xxh128_hexdigest(image.read()))
+        number += 1
+        new_path = f"{folder}/{name}_{number}.jpg"
+
+    # Delete it if it already matches another one
+    if new_hash in image_hashes:
+        os.remove(temp_path)
+        return False
+
+    os.rename(current_path,new_path)
+    os.rename(temp_path,current_path)
+    return True
+
+def Fetch_Image(database:DB.PostgresClass|None,url:str,folder:str,name:str,records:ImageRecords|None=None) -> str:
+    """
+    Saves the image at a URL as [folder]/[name].jpg, skipping the download whenever it can tell nothing changed.
+
+    :param database: Initialized Database Object, holds the image_cache table. Not needed when records is given
+    :type database: Database Object
+    :param url: Image URL
+    :type url: String
+    :param folder: Folder the image is saved in
+    :type folder: String
+    :param name: File name of the image, without extension (e.g. [video_id]_Thumbnail)
+    :type name: String
+    :param records: Where to remember the saved images, defaults to the database's image_cache (See UserCache.py for the shared one)
+    :type records: ImageRecords
+    :return: One of the ImageResult values
+    :rtype: String
+    """
+    if records is None:
+        records = ImageRecords(database)
+
+    current_path = f"{folder}/{name}.jpg"
+    artifact = os.path.relpath(current_path,records.root).replace('\\','/')
+
+    record = records.Get(artifact)
+    have_file = os.path.isfile(current_path)
+
+    # Same URL as the image on disk, YouTube would've given us a new URL if it changed
+    if record is not None and have_file and record["url"] == url and CFG.IMAGE_REVALIDATE == False:
+        return ImageResult.SKIPPED
+
+    headers = {}
+    if record is not None and have_file and record["url"] == url:
+        if record["etag"] is not None:
+            headers["If-None-Match"] = record["etag"]
+        if record["last_modified"] is not None:
+            headers["If-Modified-Since"] = record["last_modified"]
+
+    img_response = _Session().get(url,headers=headers,stream=True,timeout=30)
+
+    if img_response.status_code == 304:
+        img_response.close()
+        records.Touch(artifact)
+        return ImageResult.NOT_MODIFIED
+
+    if not img_response.ok:
+        LOG.logger.info(img_response)
+        img_response.close()
+        return ImageResult.FAILED
+
+    # Download a fresh image, hashing it on the way
+    os.makedirs(folder,exist_ok=True)
+    temp_path = f"{folder}/{name}_TEMP_{os.getpid()}.jpg" # Other processes may be fetching into a shared folder
+    hasher = xxhash.xxh128()
+    downloaded = 0
+    with open(temp_path,'wb') as handle:
+        for block in img_response.iter_content(65536):
+            if not block:
+                break
+            hasher.update(block)
+            handle.write(block)
+            downloaded += len(block)
+    new_hash = hasher.hexdigest()
+    global downloaded_bytes
+    downloaded_bytes += downloaded
+
+    # Only fall back on hashing the saved versions when it isn't the image we already have
+    if record is not None and have_file and record["hash"] == new_hash:
+        os.remove(temp_path)
+        result = ImageResult.UNCHANGED
+    else:
+        result = ImageResult.UPDATED if _Rotate_Into_Place(temp_path,folder,name,new_hash) else ImageResult.UNCHANGED
+
+    # Remember the hash of whatever is saved as the current image
+    if result == ImageResult.UPDATED:
+        saved_hash = new_hash
+    elif record is not None and record["hash"] is not None:
+        saved_hash = record["hash"]
+    else:
+        with open(current_path,"rb") as image:
+            saved_hash = xxhash.xxh128_hexdigest(image.read())
+
+    records.Save({
+        "artifact":artifact,
+        "url":url,
+        "etag":img_response.headers.get("ETag"),
+        "last_modified":img_response.headers.get("Last-Modified"),
+        "hash":saved_hash,
+        "checked":datetime.now()
+    })
+
+    return result
@@ -0,0 +1,148 @@
+# Native Stuff
+import os
+from datetime import datetime,timezone
+from typing import Any
+
+# Installed Stuff
+import psycopg2
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Sketches as SK
+
+"""
+Top chatters, words and emotes of a video, a time range or the whole channel.
+
+Approximate: Merges the sketches saved while the messages were written (See Sketches.ChatSketches), no database
+needed and quick however much chat there is. A time range picks the videos whose chat overlaps it, the whole
+channel is every video.
+Exact: The same leaderboards as GROUP BYs over the messages table, for checking or when the sketches are missing.
+"""
+
+class Leader:
+    """
+    One place on a leaderboard.
+
+    :param item: User ID, word or emote
+    :type item: String
+    :param label: Display name of a chatter, otherwise the item again
+    :type label: String
+    :param count: Times seen. Approximate counts can be up to error too high
+    :type count: Integer
+    :param error: Most the count can be off by (Always 0 for exact leaderboards)
+    :type error: Integer
+    """
+    def __init__(self,item:str,label:str,count:int,error:int=0):
+        self.item = item
+        self.label = label
+        self.count = count
+        self.error = error
+
+def _Seconds(when:datetime|None) -> float|None:
+    """Datetime (UTC if it has no timezone) as a timestamp in seconds, like the sketches keep."""
+    if when is None:
+        return None
+    return (when if when.tzinfo is not None else when.replace(tzinfo=timezone.utc)).timestamp()
+
+def Approximate(kind:str,top:int=20,video_id:str|None=None,start:datetime|None=None,end:datetime|None=None) -> tuple[list[Leader],int]:
+    """
+    Leaderboard from the saved sketches.
+
+    :param kind: chatters, words or emotes
+    :type kind: String
+    :param top: Places to return
+    :type top: Integer
+    :param video_id: Only this video. Defaults to the whole channel
+    :type video_id: String
+    :param start: Only videos with chat after this (UTC)
+    :type start: Datetime
+    :param end: Only videos with chat before this (UTC)
+    :type end: Datetime
+    :return: (Leaders, Videos merged)
+    :rtype: Tuple
+    """
+    if video_id is not None:
+        merged = SK.Load_Chat_Sketches(video_id)
+        videos = 1 if merged is not None else 0
+    else:
+        merged = None
+        videos = 0
+        since, until = _Seconds(start), _Seconds(end)
+        for name in SK.Saved_Videos():
+            sketches = SK.Load_Chat_Sketches(name)
+            if sketches is None:
+                continue
+            if since is not None or until is not None:
+                if sketches.first is None:
+                    continue
+                if (since is not None and sketches.last < since) or (until is not None and sketches.first > until):
+                    continue
+            if merged is None:
+                merged = sketches
+            else:
+                merged.merge(sketches)
+            videos += 1
+
+    if merged is None:
+        return [], 0
+    names = merged.names if kind == "chatters" else {}
+    return [Leader(item,names.get(item,item),count,error) for item, count, error in getattr(merged,kind).top(top)], videos
+
+# GROUP BY per leaderboard, filters go where {where} is
+_EXACT_QUERIES = {
+    "chatters":"""SELECT user_id, max(user_name), count(*) FROM messages
+        WHERE user_id IS NOT NULL{where} GROUP BY user_id ORDER BY count(*) DESC, user_id LIMIT %(top)s""",
+    "words":r"""SELECT word, word, count(*) FROM messages,
+            regexp_split_to_table(lower(regexp_replace(message,':[^\s:]+:',' ','g')),'[^[:alnum:]_]+') AS word
+        WHERE length(word) >= %(min_length)s{where} GROUP BY word ORDER BY count(*) DESC, word LIMIT %(top)s""",
+    "emotes":r"""SELECT emote[1], emote[1], count(*) FROM messages,
+            regexp_matches(message,'(:[^\s:]+:)','g') AS emote
+        WHERE true{where} GROUP BY emote[1] ORDER BY count(*) DESC, emote[1] LIMIT %(top)s"""
+}
+
+def Exact(cursor:psycopg2.extensions.cursor,kind:str,top:int=20,video_id:str|None=None,start:datetime|None=None,end:datetime|None=None) -> list[Leader]:
+    """
+    Leaderboard counted from the messages table. Same parameters as Approximate, but start/end filter messages
+    instead of videos. Emotes are found in the message text here, so emoji without a :name: don't show up.
+
+    :return: Leaders
+    :rtype: List of Leader
+    """
+    where = ""
+    values:dict[str,Any] = {"top":top,"min_length":CFG.SKETCH_MIN_WORD_LENGTH}
+    if video_id is not None:
+        where += " AND video_id = %(video_id)s"
+        values["video_id"] = video_id
+    if start is not None:
+        where += " AND datetime >= %(start)s"
+        values["start"] = start
+    if end is not None:
+        where += " AND datetime < %(end)s"
+        values["end"] = end
+    cursor.execute(_EXACT_QUERIES[kind].format(where=where),values)
+    return [Leader(item,label if label is not None else item,count) for item, label, count in cursor.fetchall()]
+
+def Rebuild(database:DB.PostgresClass,video_ids:list[str]|None=None) -> int:
+    """
+    Builds the sketches of videos from their stored messages, for videos written before sketches existed.
+    Emotes come from the message text, like the exact leaderboard.
+
+    :param video_ids: Videos to build. Defaults to every summarized video without sketches
+    :type video_ids: List of Strings
+    :return: Videos built
+    :rtype: Integer
+    """
+    if video_ids is None:
+        video_ids = [entry["video_id"] for entry in DB.GetEntries(database.cursor,"video_chat_summary","video_id")
+                     if os.path.isfile(SK.Sketch_Path(entry["video_id"])) == False]
+    database.database.commit()
+
+    for video_id in video_ids:
+        sketches = SK.ChatSketches()
+        for entry in DB.StreamEntries(database.database,"messages","user_id,user_name,message,timestamp",{"video_id":video_id}):
+            sketches.add(entry,[{"name":emote} for emote in SK.Text_Emotes(entry["message"])])
+        SK.Write_Chat_Sketches(video_id,sketches)
+        LOG.logger.info(f"Built the sketches of {video_id} ({sketches.chatters.total} messages).")
+    return len(video_ids)
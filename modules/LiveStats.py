@@ -0,0 +1,246 @@
+# Native Stuff
+import json,time,threading
+from collections import Counter,deque
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from typing import Any
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+
+"""
+Rolling numbers for live chats, served as JSON on a local port for overlays and dashboards (No database involved).
+
+Get_Messages hands every live message to LiveStats.Add as it's parsed. Messages go into one bucket per second, and
+each window (LIVE_STATS_WINDOWS, e.g. the last minute) keeps running totals: buckets are added when they arrive and
+taken away again when they fall out of the window. Reading the numbers never has to go through the messages.
+
+    GET /            Every video watched this run
+    GET /[video_id]  One video
+
+Each window has messages (And per minute), unique chatters, super chats and stickers per currency, new members and
+the top emotes. "totals" has the same since the chat started being watched.
+"""
+
+PAID_MESSAGE = "paid_message"
+PAID_STICKER = "paid_sticker"
+MEMBERSHIP = "membership_item"
+
+class _Bucket:
+    """Everything that happened in one second of chat."""
+    __slots__ = ("second","messages","chatters","superchats","stickers","members","emotes")
+
+    def __init__(self,second:int) -> None:
+        self.second = second
+        self.messages = 0
+        self.chatters:Counter[str] = Counter()
+        self.superchats:dict[str,list[float]] = {} # {[Currency] , [Count, Amount]}
+        self.stickers:dict[str,list[float]] = {}
+        self.members = 0
+        self.emotes:Counter[str] = Counter()
+
+def _Add_Paid(totals:dict[str,list[float]],other:dict[str,list[float]],sign:int=1):
+    for currency, (count, amount) in other.items():
+        total = totals.setdefault(currency,[0,0.0])
+        total[0] += count * sign
+        total[1] += amount * sign
+        if total[0] <= 0:
+            del totals[currency]
+
+class _Window(_Bucket):
+    """Running totals of the buckets in the last [length] seconds."""
+    __slots__ = ("length","buckets")
+
+    def __init__(self,length:int|None) -> None:
+        super().__init__(0)
+        self.length = length # None for since the start
+        self.buckets:deque[_Bucket] = deque()
+
+    def Add(self,bucket:_Bucket,sign:int=1):
+        self.messages += bucket.messages * sign
+        self.members += bucket.members * sign
+        if sign > 0:
+            self.chatters.update(bucket.chatters)
+            self.emotes.update(bucket.emotes)
+        else:
+            self.chatters.subtract(bucket.chatters)
+            self.emotes.subtract(bucket.emotes)
+            # Counter.subtract leaves zeroes behind, only keep who's still in the window
+            for user in bucket.chatters:
+                if self.chatters[user] <= 0:
+                    del self.chatters[user]
+            for emote in bucket.emotes:
+                if self.emotes[emote] <= 0:
+                    del self.emotes[emote]
+        _Add_Paid(self.superchats,bucket.superchats,sign)
+        _Add_Paid(self.stickers,bucket.stickers,sign)
+
+    def Expire(self,now:int):
+        """Takes away the buckets that are older than the window."""
+        if self.length is None:
+            return
+        while len(self.buckets) > 0 and self.buckets[0].second <= now - self.length:
+            self.Add(self.buckets.popleft(),-1)
+
+    def Report(self,now:int,started:float) -> dict[str,Any]:
+        # A window longer than the chat has been watched is only as long as the chat so far
+        seconds = min(self.length,max(now - int(started),1)) if self.length is not None else max(now - int(started),1)
+        return {
+            "messages":self.messages,
+            "messages_per_min":round(self.messages / seconds * 60,1),
+            "chatters":len(self.chatters),
+            "superchats":{currency:{"count":int(count),"amount":round(amount,2)} for currency, (count, amount) in sorted(self.superchats.items())},
+            "stickers":{currency:{"count":int(count),"amount":round(amount,2)} for currency, (count, amount) in sorted(self.stickers.items())},
+            "new_members":self.members,
+            "top_emotes":self.emotes.most_common(CFG.LIVE_STATS_TOP_EMOTES)
+        }
+
+class _VideoStats:
+    """The windows of one video."""
+    def __init__(self,video_id:str) -> None:
+        self.video_id = video_id
+        self.started = time.time()
+        self.last_message:float|None = None
+        self.finished = False
+        self.current:_Bucket|None = None
+        self.windows = [_Window(length) for length in CFG.LIVE_STATS_WINDOWS]
+        self.totals = _Window(None)
+
+    def Bucket(self,now:float) -> _Bucket:
+        """The bucket for this second, a new one if the second just started."""
+        second = int(now)
+        if self.current is None or self.current.second != second:
+            self.current = _Bucket(second)
+            for window in self.windows:
+                window.buckets.append(self.current)
+        return self.current
+
+    def Count(self,bucket:_Bucket):
+        """Adds to every window right away, so what's read is never behind the chat."""
+        for window in self.windows:
+            window.Add(bucket)
+        self.totals.Add(bucket)
+
+class LiveStats:
+    """Rolling chat numbers per video. Safe to share between threads (Live stream watchers feed it at once)."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._videos:dict[str,_VideoStats] = {}
+
+    def Add(self,video_id:str,parsed:dict[str,Any]):
+        """
+        Counts a message as it arrives.
+
+        :param video_id: Video the message is from
+        :type video_id: String
+        :param parsed: The parsed half of what Get_Messages spools ({"entry", "emotes"})
+        :type parsed: Dictionary
+        """
+        entry = parsed["entry"]
+        # One message's worth, added to the windows right away
+        single = _Bucket(0)
+        single.messages = 1
+        if entry["user_id"] is not None:
+            single.chatters[entry["user_id"]] = 1
+        if entry["type"] in (PAID_MESSAGE,PAID_STICKER) and entry["amount"] is not None:
+            (single.superchats if entry["type"] == PAID_MESSAGE else single.stickers)[entry["currency"] or "?"] = [1,entry["amount"]]
+        elif entry["type"] == MEMBERSHIP:
+            single.members = 1
+        for emote in parsed["emotes"]:
+            if emote["name"] is not None:
+                single.emotes[emote["name"]] += 1
+
+        now = time.time()
+        with self._lock:
+            video = self._videos.get(video_id)
+            if video is None or video.finished == True:
+                video = self._videos[video_id] = _VideoStats(video_id)
+            bucket = video.Bucket(now)
+            for window in video.windows:
+                window.Expire(int(now))
+            # The second's bucket remembers the message so it can be taken out of each window later
+            bucket.messages += single.messages
+            bucket.members += single.members
+            bucket.chatters.update(single.chatters)
+            bucket.emotes.update(single.emotes)
+            _Add_Paid(bucket.superchats,single.superchats)
+            _Add_Paid(bucket.stickers,single.stickers)
+            video.Count(single)
+            video.last_message = now
+
+    def Finish(self,video_id:str):
+        """Marks a video's live chat as over, its numbers stay readable until it goes live again."""
+        with self._lock:
+            if video_id in self._videos:
+                self._videos[video_id].finished = True
+
+    def Report(self,video_id:str|None=None) -> dict[str,Any]|None:
+        """
+        The numbers of one video, or of every video if None.
+
+        :return: {"video_id", "started", "last_message", "finished", "windows": {[Seconds]: {...}}, "totals": {...}}.
+                 None if the video isn't known.
+        :rtype: Dictionary
+        """
+        now = time.time()
+        with self._lock:
+            if video_id is None:
+                return {"videos":{video.video_id:self._Report(video,now) for video in self._videos.values()}}
+            video = self._videos.get(video_id)
+            return self._Report(video,now) if video is not None else None
+
+    def _Report(self,video:_VideoStats,now:float) -> dict[str,Any]:
+        for window in video.windows:
+            window.Expire(int(now))
+        return {
+            "video_id":video.video_id,
+            "started":video.started,
+            "last_message":video.last_message,
+            "finished":video.finished,
+            "windows":{str(window.length):window.Report(int(now),video.started) for window in video.windows},
+            "totals":video.totals.Report(int(now),video.started)
+        }
+
+#------------#
+#-- SERVER --#
+#------------#
+
+class _Handler(BaseHTTPRequestHandler):
+    stats:LiveStats # Set on the subclass Serve makes
+
+    def do_GET(self):
+        video_id = self.path.split("?",1)[0].strip("/")
+        report = self.stats.Report(video_id if video_id != "" else None)
+        body = json.dumps(report if report is not None else {"error":f"No live chat for {video_id}"}).encode('utf-8')
+        self.send_response(200 if report is not None else 404)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(body)))
+        self.send_header("Cache-Control","no-store")
+        self.send_header("Access-Control-Allow-Origin","*") # Browser sources in OBS etc. load overlays from elsewhere
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        LOG.logger.debug(f"Live stats request: {format % args}")
+
+def Serve(stats:LiveStats,host:str|None=None,port:int|None=None) -> ThreadingHTTPServer|None:
+    """
+    Starts serving the numbers on a background thread. Call shutdown() on what it returns to stop.
+
+    :param host: Interface to listen on. Defaults to LIVE_STATS_HOST in Settings.py
+    :type host: String
+    :param port: Port to listen on. Defaults to LIVE_STATS_PORT in Settings.py (0 picks a free one)
+    :type port: Integer
+    :return: The server, None if it couldn't listen on the port
+    :rtype: ThreadingHTTPServer
+    """
+    handler = type("LiveStatsHandler",(_Handler,),{"stats":stats})
+    try:
+        server = ThreadingHTTPServer((host if host is not None else CFG.LIVE_STATS_HOST,port if port is not None else CFG.LIVE_STATS_PORT),handler)
+    except OSError as e:
+        LOG.logger.warning(f"Couldn't serve live chat stats: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever,name="Live Stats Server",daemon=True).start()
+    LOG.logger.info(f"Live chat stats at http://{server.server_address[0]}:{server.server_address[1]}/")
+    return server
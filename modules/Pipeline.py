@@ -0,0 +1,194 @@
+# Native Stuff
+import time,queue,threading
+from typing import Any,Callable,Iterable,Iterator
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.Profiler as PF
+
+"""
+Small thread pipeline used to overlap the stages of chat ingest.
+
+A source iterator (e.g. ChatDownloader's get_chat) is read on its own thread and every item flows through the given
+stages, each on its own thread, joined by bounded queues. The caller consumes the output of the last stage:
+
+    source ──[queue]──> stage 1 ──[queue]──> stage 2 ──[queue]──> caller
+
+    with Pipeline(chat,[("Parse",parse_function)]) as pipe:
+        for item in pipe.Results(timeout=1):
+            ...
+
+Bounded queues give backpressure: if the caller falls behind, the stages stop pulling from the source instead of
+piling items up in memory. The first exception in any stage stops every stage and is re-raised (Same exception
+type) from Results(), and leaving the with-block early shuts everything down too.
+"""
+
+# Marks the end of the items flowing through a queue
+_END = object()
+
+class StageStats:
+    """Counters for one stage and the queue feeding its output."""
+    def __init__(self,name:str) -> None:
+        self.name = name
+        self.items:int = 0
+        self.busy:float = 0.0 # Seconds spent producing items (Fetching or working on them)
+        self.max_depth:int = 0 # Most items ever waiting in the output queue
+        self._depth_total:int = 0
+
+    def record_depth(self,depth:int):
+        self.max_depth = max(self.max_depth,depth)
+        self._depth_total += depth
+
+    @property
+    def avg_depth(self) -> float:
+        return self._depth_total / self.items if self.items > 0 else 0.0
+
+class Pipeline:
+    """
+    Runs a source iterator through a chain of functions, each on its own thread.
+
+    :param source: Items to feed in. Iterated on a separate thread
+    :type source: Iterable
+    :param stages: (Name, Function) pairs, each function turns one item into the item handed to the next stage
+    :type stages: List of Tuples
+    :param queue_size: Most items held between any two stages. Defaults to PIPELINE_QUEUE_SIZE in Settings.py
+    :type queue_size: Integer
+    :param source_name: Name of the source stage in the stats
+    :type source_name: String
+    """
+    def __init__(self,source:Iterable,stages:list[tuple[str,Callable[[Any],Any]]],queue_size:int|None=None,source_name:str="Fetch"):
+        queue_size = queue_size if queue_size is not None else CFG.PIPELINE_QUEUE_SIZE
+
+        self._stop = threading.Event()
+        self._error:BaseException|None = None
+        self._error_lock = threading.Lock()
+
+        self.stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in self.stats]
+
+        # The stage threads carry on the profiler tags (Video being downloaded etc.) of whoever made the pipeline
+        self._tags = PF.Tags()
+
+        self._threads = [threading.Thread(target=self._Run_Source,args=(iter(source),),name=f"Pipeline {source_name}",daemon=True)]
+        for i, (name, function) in enumerate(stages):
+            self._threads.append(threading.Thread(target=self._Run_Stage,args=(i + 1,function),name=f"Pipeline {name}",daemon=True))
+
+    def __enter__(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def __exit__(self,exc_type,exc,tb):
+        self.Stop()
+        return False
+
+    def _Fail(self,error:BaseException):
+        """Remembers the first error and tells every stage to stop."""
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _Put(self,index:int,item:Any) -> bool:
+        """Hands an item to the next stage, waiting while its queue is full. False if the pipeline is stopping."""
+        out = self._queues[index]
+        while not self._stop.is_set():
+            try:
+                out.put(item,timeout=0.1)
+            except queue.Full:
+                continue
+            if item is not _END:
+                self.stats[index].record_depth(out.qsize())
+            return True
+        return False
+
+    def _Get(self,index:int) -> Any:
+        """Takes the next item from the previous stage. Returns _END if the pipeline is stopping."""
+        inbox = self._queues[index]
+        while not self._stop.is_set():
+            try:
+                return inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _Run_Source(self,source:Iterator):
+        stats = self.stats[0]
+        PF.Tag(**self._tags)
+        try:
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+                stats.busy += time.perf_counter() - started
+                stats.items += 1
+                if self._Put(0,item) == False:
+                    return
+            self._Put(0,_END)
+        except BaseException as e:
+            self._Fail(e)
+        finally:
+            PF.Untag()
+
+    def _Run_Stage(self,index:int,function:Callable[[Any],Any]):
+        stats = self.stats[index]
+        PF.Tag(**self._tags)
+        try:
+            while True:
+                item = self._Get(index - 1)
+                if item is _END:
+                    self._Put(index,_END)
+                    return
+                started = time.perf_counter()
+                result = function(item)
+                stats.busy += time.perf_counter() - started
+                stats.items += 1
+                if self._Put(index,result) == False:
+                    return
+        except BaseException as e:
+            self._Fail(e)
+        finally:
+            PF.Untag()
+
+    def Results(self,timeout:float|None=None) -> Iterator[Any]:
+        """
+        Yields the output of the last stage until the source runs out. Re-raises the first error of any stage.
+
+        :param timeout: If set, yields None whenever nothing arrived for this many seconds (Handy for time based flushing)
+        :type timeout: Float
+        :return: Generator of the last stage's results
+        :rtype: Any
+        """
+        final = self._queues[-1]
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                item = final.get(timeout=timeout if timeout is not None else 0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    if self._error is not None:
+                        raise self._error
+                    return
+                if timeout is not None:
+                    yield None
+                continue
+            if item is _END:
+                return
+            yield item
+
+    def Depths(self) -> str:
+        """Current queue depths between the stages, for progress bars."""
+        return " | ".join(f"{stats.name}: {q.qsize()}" for stats, q in zip(self.stats,self._queues))
+
+    def Report(self) -> str:
+        """Per-stage summary: items, busy time, and how full the stage's output queue got."""
+        return "\n".join(f"{stats.name}: {stats.items} item(s), {stats.busy:.1f}s busy, queue avg {stats.avg_depth:.1f} / max {stats.max_depth}" for stats in self.stats)
+
+    def Stop(self):
+        """Stops every stage. Threads stuck waiting on the network are left to finish on their own (They're daemons)."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
@@ -0,0 +1,239 @@
+# Native Stuff
+import os,sys,json,time,atexit,signal,threading
+from collections import Counter
+from datetime import datetime
+from types import CodeType,FrameType
+from typing import Any
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+
+"""
+Sampling profiler that's safe to leave running on a real run: a background thread looks at the stack of every thread
+PROFILE_HZ times a second (sys._current_frames, nothing is traced), so the cost is the same however busy ingest is.
+
+Off unless asked for, any of these turn it on:
+    PROFILE = True in Settings.py, YTDB_PROFILE=yes, or python Main.py --profile   Profile the whole run
+    kill -USR1 [pid]   Start profiling a running process, send it again to stop and write the files (Not on Windows)
+
+Every sample is tagged with its thread, the stage it's in and the video being worked on (See Tag), so stages and
+single streams can be told apart in the flame graph. With PROFILE_CPU on, each sample counts the CPU time its thread
+used since the previous sample, so threads waiting on the network or a queue don't show up and the graph is where
+the CPU went. Written to [DATA_PATH]/Profiles when profiling stops (Or at exit) as:
+    .collapsed          One "frame;frame;frame microseconds" line per stack, for flamegraph.pl/inferno/speedscope
+    .speedscope.json    Open in https://www.speedscope.app, one profile per thread
+"""
+
+PROFILE_FOLDER = f"{CFG.DATA_PATH}/Profiles"
+
+#----------#
+#-- TAGS --#
+#----------#
+
+# {[Thread ID] , {[Tag] , [Value]}}, read by the sampler. Plain dict operations, so tagging costs nothing worth measuring
+_tags:dict[int,dict[str,str]] = {}
+
+def Tag(**tags:str|None):
+    """
+    Tags the samples of the calling thread from now on, e.g. Tag(stage="videos") or Tag(video=video_id). None removes
+    a tag. Cheap enough to call whether profiling or not.
+    """
+    current = dict(_tags.get(threading.get_ident(),{}))
+    for name, value in tags.items():
+        if value is None:
+            current.pop(name,None)
+        else:
+            current[name] = value
+    _tags[threading.get_ident()] = current
+
+def Tags() -> dict[str,str]:
+    """The calling thread's tags, for handing on to threads it starts (See Pipeline.py)."""
+    return dict(_tags.get(threading.get_ident(),{}))
+
+def Untag():
+    """Drops the calling thread's tags, for threads that are about to end."""
+    _tags.pop(threading.get_ident(),None)
+
+#-------------#
+#-- SAMPLER --#
+#-------------#
+
+def _Thread_Clock(ident:int) -> int|None:
+    """CPU clock of a thread, None where there's no such thing (Windows/macOS) or the thread just ended."""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError,OSError):
+        return None
+
+class Sampler(threading.Thread):
+    """
+    The profiler itself. start() to begin sampling, Stop() to end it and write the files.
+
+    :param hz: Samples per second. Defaults to PROFILE_HZ in Settings.py
+    :type hz: Integer
+    :param cpu: Weight samples by CPU time instead of wall time. Defaults to PROFILE_CPU in Settings.py
+    :type cpu: Boolean
+    """
+    def __init__(self,hz:int|None=None,cpu:bool|None=None) -> None:
+        super().__init__(name="Profiler",daemon=True)
+        self.interval = 1 / (hz if hz is not None else CFG.PROFILE_HZ)
+        self.cpu = (cpu if cpu is not None else CFG.PROFILE_CPU) and _Thread_Clock(threading.get_ident()) is not None
+        self._stop_requested = threading.Event()
+        self._labels:dict[CodeType,str] = {} # Frame names, worked out once per function
+        self._clocks:dict[int,tuple[int|None,int|None]] = {} # {[Thread ID] , ([CPU Clock], [Nanoseconds at the last sample])}
+        self.stacks:Counter[tuple[str,...]] = Counter() # {[Thread, Tags..., Frames...] , [Microseconds]}
+        self.samples = 0
+        self.busy = 0.0 # Seconds spent sampling, for the overhead
+        self.started = time.time()
+        self.stopped:float|None = None
+
+    def _Label(self,code:CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{getattr(code,'co_qualname',code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _Weight(self,ident:int) -> int:
+        """Microseconds a sample of a thread stands for: CPU time since its last sample, or the interval."""
+        if self.cpu == False:
+            return round(self.interval * 1000000)
+        clock_id, last = self._clocks[ident] if ident in self._clocks else (_Thread_Clock(ident),None)
+        if clock_id is None:
+            return 0
+        try:
+            now = time.clock_gettime_ns(clock_id)
+        except OSError: # Ended since the frames were taken
+            return 0
+        self._clocks[ident] = (clock_id,now)
+        if last is None:
+            return 0 # Nothing to compare with yet
+        return (now - last) // 1000
+
+    def Sample(self):
+        """Takes one sample of every thread but this one."""
+        started = time.perf_counter()
+        names = {thread.ident:thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        for ident, frame in frames.items():
+            if ident == self.ident:
+                continue
+            weight = self._Weight(ident)
+            if weight <= 0:
+                continue
+            stack:list[str] = []
+            current:FrameType|None = frame
+            while current is not None:
+                stack.append(self._Label(current.f_code))
+                current = current.f_back
+            tags = _tags.get(ident,{})
+            key = (names.get(ident,f"Thread {ident}"),*(f"[{name} {value}]" for name, value in sorted(tags.items())),*reversed(stack))
+            self.stacks[key] += weight
+        # Threads that ended don't need their clocks any more
+        for ident in [ident for ident in self._clocks if ident not in frames]:
+            del self._clocks[ident]
+        self.samples += 1
+        self.busy += time.perf_counter() - started
+
+    def run(self):
+        next_sample = time.perf_counter()
+        while not self._stop_requested.is_set():
+            self.Sample()
+            next_sample += self.interval
+            # Fell behind (e.g. the machine was suspended), carry on from now instead of catching up
+            if next_sample < time.perf_counter():
+                next_sample = time.perf_counter() + self.interval
+            self._stop_requested.wait(max(next_sample - time.perf_counter(),0))
+
+    def Stop(self) -> list[str]:
+        """
+        Stops sampling and writes the profile in PROFILE_FORMATS.
+
+        :return: Paths of the files written
+        :rtype: List of Strings
+        """
+        self._stop_requested.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.stopped = time.time()
+        seconds = self.stopped - self.started
+        LOG.logger.info(f"Profiled for {seconds:.0f}s: {self.samples} samples ({'CPU' if self.cpu else 'wall'} time), "
+                        f"{self.busy / seconds * 100 if seconds > 0 else 0:.1f}% of a core spent sampling.")
+        if len(self.stacks) == 0:
+            return []
+
+        os.makedirs(PROFILE_FOLDER,exist_ok=True)
+        base = f"{PROFILE_FOLDER}/Profile_{datetime.fromtimestamp(self.started):%Y%m%d_%H%M%S}_{os.getpid()}"
+        written = []
+        if "collapsed" in CFG.PROFILE_FORMATS:
+            with open(f"{base}.collapsed",'w',encoding='utf-8') as file:
+                for stack, weight in sorted(self.stacks.items()):
+                    # Collapsed stacks split on ";" and the count after the last space
+                    file.write(f"{';'.join(frame.replace(';',':') for frame in stack)} {weight}\n")
+            written.append(f"{base}.collapsed")
+        if "speedscope" in CFG.PROFILE_FORMATS:
+            with open(f"{base}.speedscope.json",'w',encoding='utf-8') as file:
+                json.dump(self.Speedscope(),file,separators=(',',':'))
+            written.append(f"{base}.speedscope.json")
+        for path in written:
+            LOG.logger.info(f"Profile written to {path}")
+        return written
+
+    def Speedscope(self) -> dict[str,Any]:
+        """The samples in speedscope's file format, one sampled profile per thread (Weights in microseconds)."""
+        frames:dict[str,int] = {}
+        profiles:dict[str,dict[str,Any]] = {}
+        for stack, weight in self.stacks.items():
+            thread, rest = stack[0], stack[1:]
+            profile = profiles.setdefault(thread,{"type":"sampled","name":thread,"unit":"microseconds","startValue":0,"endValue":0,"samples":[],"weights":[]})
+            profile["samples"].append([frames.setdefault(frame,len(frames)) for frame in rest])
+            profile["weights"].append(weight)
+            profile["endValue"] += weight
+        return {
+            "$schema":"https://www.speedscope.app/file-format-schema.json",
+            "name":f"{CFG.DB_NAME} {datetime.fromtimestamp(self.started):%Y-%m-%d %H:%M:%S}",
+            "exporter":"YTDB Profiler.py",
+            "activeProfileIndex":0,
+            "shared":{"frames":[{"name":frame} for frame in frames]},
+            "profiles":sorted(profiles.values(),key=lambda profile: profile["endValue"],reverse=True)
+        }
+
+#-------------#
+#-- CONTROL --#
+#-------------#
+
+_sampler:Sampler|None = None
+_control_lock = threading.Lock()
+
+def Start() -> bool:
+    """Starts profiling unless it already is. True if it was started."""
+    global _sampler
+    with _control_lock:
+        if _sampler is not None:
+            return False
+        _sampler = Sampler()
+        _sampler.start()
+    LOG.logger.info(f"Profiling every thread {round(1 / _sampler.interval)} times a second.")
+    return True
+
+def Stop() -> list[str]:
+    """Stops profiling and writes the files, see Sampler.Stop."""
+    global _sampler
+    with _control_lock:
+        sampler, _sampler = _sampler, None
+    return sampler.Stop() if sampler is not None else []
+
+def _Toggle(signum:int,frame:Any):
+    # Signal handlers interrupt the main thread wherever it is (Maybe holding a lock), the rest is left to a thread
+    threading.Thread(target=Start if _sampler is None else Stop,name="Profiler Toggle").start()
+
+def Install():
+    """
+    Starts profiling if PROFILE, YTDB_PROFILE or --profile asks for it, lets SIGUSR1 turn it on and off, and writes
+    the profile at exit. Call once at startup.
+    """
+    if hasattr(signal,"SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1,_Toggle)
+    atexit.register(Stop)
+    if CFG.PROFILE == True or os.environ.get("YTDB_PROFILE","").strip().lower() in ("1","y","yes","true") or "--profile" in sys.argv:
+        Start()
@@ -0,0 +1,379 @@
+# Native Stuff
+import os,re,json,types,hashlib,sqlite3,tempfile
+from concurrent.futures import ThreadPoolExecutor,as_completed
+from typing import Any,Iterator
+
+# Installed Stuff
+from tqdm import tqdm
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Classes as C
+import modules.Spool as SP
+
+"""
+Checks the messages table against the [video_id]_Messages.json archives, and repairs either side from the other.
+
+    1. Digests: Every video gets a (Count, Digest) on both sides, the digest being the sum of a 64 bit hash of each
+       message ID. The sum doesn't depend on order, so Postgres works it out itself (One GROUP BY per messages
+       partition, in parallel) without sending a single ID over, and the archives are only scanned for their
+       "message_id" lines. Archive digests are kept in the spool file until the archive changes.
+    2. Merge-join: Only videos whose digests differ get their sorted message IDs streamed from both sides and walked
+       together, which gives the exact missing and extra messages.
+    3. Repair: Messages only in an archive are parsed and written to the database the same way new chat is
+       (Spool.Write_Messages). Messages only in the database are rebuilt from their row and appended to the archive.
+       Rows don't keep everything the raw message had (e.g. emotes, every badge), those are marked "restored_from".
+
+Videos with chat still in the spool are skipped, they're in the middle of being written to both.
+"""
+
+ARCHIVE_SUFFIX = "_Messages.json"
+
+# The message_id of each message in an archive written like json.dumps(indent=4) (See Classes.MessageArchive)
+_ID_LINE = re.compile(rb'^        "message_id": "((?:[^"\\]|\\.)*)"',re.MULTILINE)
+
+# Same hash as Message_Hash, in SQL
+_SQL_HASH = "('x' || substr(md5(message_id),1,16))::bit(64)::bigint"
+
+class VideoCheck:
+    """How a video's messages compare between the database and its archive."""
+    MATCH = "Match"
+    DIFFERENT = "Different"
+    DATABASE_ONLY = "Database Only" # No archive
+    ARCHIVE_ONLY = "Archive Only" # No messages in the database
+
+    def __init__(self,video_id:str,database:tuple[int,int]|None,archive:tuple[int,int]|None) -> None:
+        self.video_id = video_id
+        self.database = database # (Count, Digest)
+        self.archive = archive # (Count, Digest)
+        if database == archive:
+            self.status = VideoCheck.MATCH
+        elif archive is None:
+            self.status = VideoCheck.DATABASE_ONLY
+        elif database is None:
+            self.status = VideoCheck.ARCHIVE_ONLY
+        else:
+            self.status = VideoCheck.DIFFERENT
+        self.missing_in_database:list[str] = []
+        self.missing_in_archive:list[str] = []
+        self.duplicates:int = 0 # Messages in the archive more than once
+
+def Message_Hash(message_id:str) -> int:
+    """First 64 bits of the MD5 of a message ID as a signed integer, same as _SQL_HASH so both sides can be summed."""
+    return int.from_bytes(hashlib.md5(message_id.encode('utf-8')).digest()[:8],'big',signed=True)
+
+#-------------#
+#-- ARCHIVE --#
+#-------------#
+
+def Archived_Videos() -> list[str]:
+    """Every video with an archive in the data folder."""
+    with os.scandir(CFG.DATA_PATH) as entries:
+        return sorted(entry.name[:-len(ARCHIVE_SUFFIX)] for entry in entries if entry.name.endswith(ARCHIVE_SUFFIX) and entry.is_file())
+
+def _Archive_Complete(path:str) -> bool:
+    """Whether the archive ends where MessageArchive would've closed it (Anything else goes through the JSON parser)."""
+    with open(path,'rb') as file:
+        end = file.seek(0,os.SEEK_END)
+        file.seek(max(end - 64,0))
+        stripped = file.read().rstrip()
+    if stripped.endswith(b"]") == False:
+        return False
+    body = stripped[:-1].rstrip()
+    return body.endswith(C.MessageArchive._ITEM_END) or (end <= 64 and body.lstrip() == b"[")
+
+def Archive_Ids(video_id:str,chunk_size:int=1 << 22) -> Iterator[str]:
+    """
+    Message IDs in a video's archive, in file order. Archives written by this project are scanned for their message_id
+    lines instead of being parsed, anything else is read with Read_Message_Archive.
+
+    :param video_id: Video the archive is for
+    :type video_id: String
+    :param chunk_size: Bytes read at a time
+    :type chunk_size: Integer
+    :return: Generator of message IDs
+    :rtype: String
+    """
+    path = C.Message_Archive_Path(video_id)
+    if _Archive_Complete(path) == False:
+        for message in C.Read_Message_Archive(video_id):
+            yield message["message_id"]
+        return
+
+    rest = b""
+    with open(path,'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            # Only scan whole lines, the cut-off line goes in front of the next chunk
+            cut = chunk.rfind(b"\n")
+            if cut == -1:
+                rest += chunk
+                continue
+            text, rest = rest + chunk[:cut + 1], chunk[cut + 1:]
+            for match in _ID_LINE.finditer(text):
+                raw = match.group(1)
+                yield json.loads(b'"' + raw + b'"') if b"\\" in raw else raw.decode('utf-8')
+    for match in _ID_LINE.finditer(rest):
+        raw = match.group(1)
+        yield json.loads(b'"' + raw + b'"') if b"\\" in raw else raw.decode('utf-8')
+
+def Archive_Digest(video_id:str,spool:SP.Spool|None=None) -> tuple[int,int]:
+    """
+    (Count, Digest) of a video's archive. With a spool, the result is stored and reused until the archive changes.
+    """
+    path = C.Message_Archive_Path(video_id)
+    info = os.stat(path)
+    if spool is not None:
+        known = spool.Archive_Digest(video_id,info.st_size,info.st_mtime_ns)
+        if known is not None:
+            return known
+
+    count = 0
+    total = 0
+    for message_id in Archive_Ids(video_id):
+        count += 1
+        total += Message_Hash(message_id)
+
+    if spool is not None:
+        spool.Save_Archive_Digest(video_id,info.st_size,info.st_mtime_ns,count,total)
+    return count, total
+
+#--------------#
+#-- DATABASE --#
+#--------------#
+
+def _Partitions(cursor) -> list[str]:
+    """Partitions of the messages table, or just messages if it isn't partitioned."""
+    cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'public.messages'::regclass ORDER BY c.relname")
+    partitions = [row[0] for row in cursor.fetchall()]
+    return partitions if len(partitions) > 0 else ["messages"]
+
+def _Partition_Digests(table:str,video_ids:list[str]|None) -> dict[str,tuple[int,int]]:
+    """(Count, Digest) of every video in one table, on its own connection."""
+    db = DB.PostgresClass()
+    try:
+        # Partition names come from pg_class, not from anyone typing them in
+        query = f'SELECT video_id, count(*), sum({_SQL_HASH}) FROM "{table}"'
+        values = []
+        if video_ids is not None:
+            query += " WHERE video_id = ANY(%s)"
+            values.append(video_ids)
+        db.cursor.execute(query + " GROUP BY video_id",values)
+        return {video_id:(count,int(total)) for video_id, count, total in db.cursor.fetchall()}
+    finally:
+        db.Close()
+
+def Database_Digests(database:DB.PostgresClass,video_ids:list[str]|None=None,workers:int|None=None) -> dict[str,tuple[int,int]]:
+    """
+    (Count, Digest) of every video with messages in the database, a partition per connection.
+
+    :param video_ids: Only these videos. Defaults to all of them
+    :type video_ids: List of Strings
+    :return: {[Video ID] , ([Count], [Digest])}
+    :rtype: Dictionary
+    """
+    workers = workers if workers is not None else CFG.RECONCILE_WORKERS
+    digests:dict[str,tuple[int,int]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(lambda table: _Partition_Digests(table,video_ids),_Partitions(database.cursor)):
+            digests.update(result)
+    return digests
+
+#----------------#
+#-- MERGE-JOIN --#
+#----------------#
+
+def _Sorted_Archive_Ids(video_id:str,folder:str) -> tuple[Iterator[str],int]:
+    """
+    The distinct message IDs of an archive in byte order (Same as COLLATE "C"), sorted on disk by SQLite so a long
+    chat doesn't have to fit in memory. Also returns how many IDs were in the archive more than once.
+    """
+    conn = sqlite3.connect(f"{folder}/{video_id}.sqlite3",isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE ids (message_id TEXT PRIMARY KEY) WITHOUT ROWID")
+    total = 0
+    batch:list[tuple[str]] = []
+    conn.execute("BEGIN")
+    for message_id in Archive_Ids(video_id):
+        total += 1
+        batch.append((message_id,))
+        if len(batch) >= CFG.SPOOL_BATCH:
+            conn.executemany("INSERT OR IGNORE INTO ids VALUES (?)",batch)
+            batch = []
+    conn.executemany("INSERT OR IGNORE INTO ids VALUES (?)",batch)
+    conn.execute("COMMIT")
+    distinct = conn.execute("SELECT count(*) FROM ids").fetchone()[0]
+
+    def Ids() -> Iterator[str]:
+        try:
+            for row in conn.execute("SELECT message_id FROM ids ORDER BY message_id"):
+                yield row[0]
+        finally:
+            conn.close()
+    return Ids(), total - distinct
+
+def Compare_Video(check:VideoCheck):
+    """Fills in the missing messages of a video whose digests differ, by walking both sorted ID lists together."""
+    db = DB.PostgresClass()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            archive_ids:Iterator[str] = iter(())
+            if check.archive is not None:
+                archive_ids, check.duplicates = _Sorted_Archive_Ids(check.video_id,folder)
+            stream = DB.StreamEntries(db.database,"messages","message_id",{"video_id":check.video_id},as_dict=False,order_by='message_id COLLATE "C"')
+            database_ids = (row[0] for row in stream)
+
+            archive_id = next(archive_ids,None)
+            database_id = next(database_ids,None)
+            while archive_id is not None or database_id is not None:
+                if database_id is None or (archive_id is not None and archive_id < database_id):
+                    check.missing_in_database.append(archive_id)
+                    archive_id = next(archive_ids,None)
+                elif archive_id is None or database_id < archive_id:
+                    check.missing_in_archive.append(database_id)
+                    database_id = next(database_ids,None)
+                else:
+                    archive_id = next(archive_ids,None)
+                    database_id = next(database_ids,None)
+            stream.close()
+    finally:
+        db.Close()
+
+def Check(database:DB.PostgresClass,spool:SP.Spool,video_ids:list[str]|None=None,workers:int|None=None) -> list[VideoCheck]:
+    """
+    Compares every video (Or the ones given) between the database and the archives.
+
+    :param database: Initialized Database Object (Each worker opens its own connection)
+    :type database: Database Object
+    :param spool: The spool, for the archive digests and to skip videos still on their way to the database
+    :type spool: Spool.Spool Object
+    :param video_ids: Only check these videos. Defaults to all of them
+    :type video_ids: List of Strings
+    :param workers: Parallel connections/readers. Defaults to RECONCILE_WORKERS in Settings.py
+    :type workers: Integer
+    :return: The videos, with the missing messages filled in for the ones that differ
+    :rtype: List of VideoCheck
+    """
+    workers = workers if workers is not None else CFG.RECONCILE_WORKERS
+    # Only messages still pending make a video unfinished, rejected ones (FAILED) never leave the spool
+    in_spool = {video_id for video_id in spool.Videos() if spool.Pending(video_id) > 0}
+    failed = spool.Failed()
+    archived = [video_id for video_id in Archived_Videos() if video_ids is None or video_id in video_ids]
+
+    LOG.logger.info("Working out the database digests...")
+    database_digests = Database_Digests(database,video_ids,workers)
+
+    archive_digests:dict[str,tuple[int,int]] = {}
+    with LOG.TQDM_Logging():
+        with tqdm(desc='Archives Read',total=len(archived),bar_format='{desc}: {n_fmt}/{total_fmt}',ncols=80,position=0,leave=False) as bar:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(Archive_Digest,video_id,spool):video_id for video_id in archived}
+                for future in as_completed(futures):
+                    archive_digests[futures[future]] = future.result()
+                    bar.update(1)
+
+    skipped = (set(database_digests) | set(archive_digests)) & in_spool
+    if len(skipped) > 0:
+        LOG.logger.warning(f"Skipping {len(skipped)} video(s) with chat still waiting for the database, run this again once it's written.")
+    if len(failed) > 0:
+        LOG.logger.warning(f"{sum(failed.values())} message(s) of {len(failed)} video(s) were rejected by Postgres and are kept in the spool, "
+                           f"they show up as missing from the database: {', '.join(sorted(failed))}")
+    checks = [VideoCheck(video_id,database_digests.get(video_id),archive_digests.get(video_id))
+              for video_id in sorted((set(database_digests) | set(archive_digests)) - in_spool)]
+
+    different = [check for check in checks if check.status != VideoCheck.MATCH]
+    with LOG.TQDM_Logging():
+        with tqdm(desc='Videos Compared',total=len(different),bar_format='{desc}: {n_fmt}/{total_fmt}',ncols=80,position=0,leave=False) as bar:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in as_completed([pool.submit(Compare_Video,check) for check in different]):
+                    future.result()
+                    bar.update(1)
+    return checks
+
+#------------#
+#-- REPAIR --#
+#------------#
+
+def Repair_Database(database:DB.PostgresClass,check:VideoCheck) -> int:
+    """
+    Writes the messages only the archive has to the database, SPOOL_BATCH per transaction.
+
+    :return: Messages written, 0 if the video itself isn't in the videos table
+    :rtype: Integer
+    """
+    if len(check.missing_in_database) == 0:
+        return 0
+    if DB.CountEntries(database.cursor,"videos",{"id":check.video_id}) == 0:
+        LOG.logger.warning(f"Video {check.video_id} isn't in the videos table, can't add its {len(check.missing_in_database)} archived message(s).")
+        return 0
+
+    missing = set(check.missing_in_database)
+    video = types.SimpleNamespace(id=check.video_id)
+    written = 0
+    rows:list[tuple[int,str,dict[str,Any]]] = []
+    for message in C.Read_Message_Archive(check.video_id):
+        if message.get("message_id") not in missing:
+            continue
+        missing.discard(message["message_id"])
+        _, parsed = C._Parse_Message(message,video)
+        rows.append((0,check.video_id,parsed))
+        if len(rows) >= CFG.SPOOL_BATCH:
+            written += sum(stats.new_messages for stats in SP.Write_Messages(database,rows).values())
+            database.database.commit()
+            rows = []
+    if len(rows) > 0:
+        written += sum(stats.new_messages for stats in SP.Write_Messages(database,rows).values())
+    DB.Refresh_Video_Summary(database.cursor,check.video_id)
+    database.database.commit()
+    return written
+
+def _Raw_Message(row:dict[str,Any]) -> dict[str,Any]:
+    """A messages row shaped like the chat_downloader message it came from, close enough to parse back into the same row."""
+    badges = []
+    if row["user_member_status"] is not None and row["user_member_status"] >= 0:
+        months = row["user_member_status"]
+        badges.append({"title":"New member" if months == 0 else f"Member ({months} month{'s' if months != 1 else ''})"})
+    for flag, title in (("isverified","Verified"),("ismoderator","Moderator"),("isowner","Owner")):
+        if row[flag] == True:
+            badges.append({"title":title})
+
+    message:dict[str,Any] = {
+        "message_id":row["message_id"],
+        "message":row["message"],
+        "timestamp":row["timestamp"] * 1000000 if row["timestamp"] is not None else None,
+        "time_in_seconds":row["time_in_seconds"],
+        "message_type":row["type"],
+        "author":{"id":row["user_id"],"name":row["user_name"],"badges":badges},
+        "restored_from":"database"
+    }
+    if row["amount"] is not None:
+        message["money"] = {"amount":row["amount"],"currency":row["currency"],"currency_symbol":row["symbol"]}
+    if row["color"] is not None:
+        message["header_background_colour"] = row["color"]
+    return message
+
+def Repair_Archive(database:DB.PostgresClass,spool:SP.Spool,check:VideoCheck) -> int:
+    """
+    Appends the messages only the database has to the video's archive (Creating it if there isn't one).
+
+    :return: Messages appended
+    :rtype: Integer
+    """
+    if len(check.missing_in_archive) == 0:
+        return 0
+
+    appended = 0
+    columns = "message_id,message,timestamp,time_in_seconds,type,user_id,user_name,user_member_status,ismoderator,isverified,isowner,amount,currency,symbol,color"
+    with C.MessageArchive(check.video_id) as archive:
+        for start in range(0,len(check.missing_in_archive),CFG.SPOOL_BATCH):
+            batch = check.missing_in_archive[start:start + CFG.SPOOL_BATCH]
+            rows = DB.GetEntries(database.cursor,"messages",columns,{"video_id":check.video_id,"message_id":batch})
+            archive.Append(_Raw_Message(row) for row in sorted(rows,key=lambda row: (row["timestamp"] or 0,row["message_id"])))
+            appended += len(rows)
+    spool.Forget_Archive(check.video_id)
+    return appended
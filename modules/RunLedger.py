@@ -0,0 +1,243 @@
+# Native Stuff
+import sys,time,statistics
+from typing import Any
+
+# Installed Stuff
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import Json
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Profiler as PF
+import modules.WorkQueue as WQ
+
+"""
+Keeps the numbers of every Main.py run in the runs table, so it shows when runs get slower as the tables grow
+instead of each summary only being printed once.
+
+A run's row is added when it starts (status "running", so a crashed run still shows up) and filled in at the end:
+videos, messages and users processed, bytes downloaded, API quota used, seconds spent in each stage, peak memory and
+roughly how many messages the table held by then.
+
+Runs.py lists them with their throughput (Messages per second, not counting time spent waiting on live streams)
+next to the median of the RUN_MEDIAN_WINDOW runs before, and flags runs/stages more than RUN_SLOW_FACTOR slower.
+"""
+
+RUNNING = "running"
+FINISHED = "finished"
+
+# Stages whose time grows with the work done, compared per unit of that work instead of in seconds
+STAGE_WORK = {"videos":"new_messages","drain":"new_messages","users":"new_users"}
+LIVE_WAIT = "live_wait" # Waiting on streams to end, left out of the throughput
+MIN_MESSAGES = 1000 # Runs with fewer new messages are too small to compare throughput
+MIN_STAGE_SECONDS = 5 # Stages quicker than this aren't flagged, however much slower than usual
+
+def Peak_Memory_MB() -> float|None:
+    """Peak resident memory of this process so far, None where it can't be told."""
+    try:
+        import resource
+    except ImportError:
+        return _Windows_Peak_Memory_MB()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+
+def _Windows_Peak_Memory_MB() -> float|None:
+    """Peak working set from GetProcessMemoryInfo, Windows has no resource module."""
+    try:
+        import ctypes,ctypes.wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb",ctypes.wintypes.DWORD),("PageFaultCount",ctypes.wintypes.DWORD)] + [(name,ctypes.c_size_t) for name in
+                ("PeakWorkingSetSize","WorkingSetSize","QuotaPeakPagedPoolUsage","QuotaPagedPoolUsage","QuotaPeakNonPagedPoolUsage",
+                 "QuotaNonPagedPoolUsage","PagefileUsage","PeakPagefileUsage")]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),ctypes.byref(counters),counters.cb) == 0: # type: ignore[attr-defined]
+            return None
+        return counters.PeakWorkingSetSize / 1048576
+    except (ImportError,AttributeError,OSError):
+        return None
+
+class Run:
+    """
+    This run's row in the runs table. Call Stage() as the run moves from one part to the next, Finish() at the end.
+    Nothing is recorded with RUN_LEDGER off or if the database has no runs table yet (See scripts/Migrate_Run_Ledger.sql),
+    the stages are still timed for the end of run log.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    """
+    def __init__(self,database:DB.PostgresClass) -> None:
+        self.database = database
+        self.run_id:int|None = None
+        self.stages:dict[str,float] = {} # {[Stage] , [Seconds]}
+        self._stage:str|None = None
+        self._started = time.perf_counter()
+        self._stage_started = self._started
+        if CFG.RUN_LEDGER == False:
+            return
+        try:
+            database.cursor.execute("INSERT INTO runs (worker, channel_id, members) VALUES (%s, %s, %s) RETURNING run_id",(WQ.WORKER_ID,CFG.YT_CHANNEL_ID,CFG.MEMBERS))
+            self.run_id = database.cursor.fetchone()[0]
+            database.database.commit()
+        except psycopg2.errors.UndefinedTable:
+            database.database.rollback()
+            LOG.logger.warning("The database has no runs table, this run isn't recorded (Add it with scripts/Migrate_Run_Ledger.sql).")
+
+    def Stage(self,name:str|None):
+        """
+        Ends the current stage and starts the next. Stages entered more than once add up. Also tags the calling
+        thread's profiler samples with the stage (See Profiler.py).
+
+        :param name: Stage starting now, None to only end the current one
+        :type name: String
+        """
+        now = time.perf_counter()
+        if self._stage is not None:
+            self.stages[self._stage] = self.stages.get(self._stage,0) + now - self._stage_started
+        self._stage = name
+        self._stage_started = now
+        PF.Tag(stage=name)
+
+    def Finish(self,vid_stats:Any,chat_stats:Any,api_units:int,downloaded_bytes:int):
+        """
+        Fills in the run's numbers and commits.
+
+        :param vid_stats: The run's Classes.VideoStats
+        :type vid_stats: VideoStats
+        :param chat_stats: The run's Classes.ChatStats (All videos appended)
+        :type chat_stats: ChatStats
+        :param api_units: YouTube Data API quota used
+        :type api_units: Integer
+        :param downloaded_bytes: API responses, chat and images downloaded
+        :type downloaded_bytes: Integer
+        """
+        self.Stage(None)
+        if self.run_id is None:
+            return
+        cursor = self.database.cursor
+        peak_memory_mb = Peak_Memory_MB()
+        peak_memory_mb = round(peak_memory_mb,1) if peak_memory_mb is not None else None
+        # Planner estimate, counting the partitions would take longer than some runs
+        cursor.execute("""SELECT sum(greatest(reltuples,0))::int8 FROM pg_class
+            WHERE oid = 'messages'::regclass OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'messages'::regclass)""")
+        messages_in_table = cursor.fetchone()[0]
+        cursor.execute("""UPDATE runs SET status = %s, finished = now(), seconds = %s, videos = %s, videos_skipped = %s, videos_failed = %s,
+                messages = %s, new_messages = %s, users = %s, new_users = %s, messages_in_table = %s, downloaded_bytes = %s,
+                api_units = %s, peak_memory_mb = %s, stages = %s
+            WHERE run_id = %s""",
+            (FINISHED,round(time.perf_counter() - self._started,3),vid_stats.success_videos + vid_stats.no_chat_videos,vid_stats.skipped_videos,
+             vid_stats.error_videos + vid_stats.unavailable_videos,chat_stats.total_messages,chat_stats.new_messages,len(chat_stats.unique_user_ids),
+             chat_stats.new_user_ids,messages_in_table,downloaded_bytes,api_units,peak_memory_mb,
+             Json({stage:round(seconds,3) for stage, seconds in self.stages.items()}),self.run_id))
+        self.database.database.commit()
+
+    def Report(self) -> str:
+        """Seconds per stage, for the end of run log."""
+        total = sum(self.stages.values())
+        lines = "\n".join(f"{stage + ':':<16}{seconds:.1f}s ({seconds / total * 100 if total > 0 else 0:.0f}%)" for stage, seconds in self.stages.items())
+        peak_memory_mb = Peak_Memory_MB()
+        return (f"\n---RUN {self.run_id if self.run_id is not None else '(Not Recorded)'} STAGES---\n\n{lines}\n"
+                f"Peak Memory:    {f'{peak_memory_mb:.0f}MB' if peak_memory_mb is not None else 'Unknown'}\n")
+
+#------------#
+#-- REPORT --#
+#------------#
+
+def Recent_Runs(cursor:psycopg2.extensions.cursor,limit:int,channel_id:str|None=None,members:bool|None=None) -> list[dict[str,Any]]:
+    """
+    The latest runs of a channel, oldest first.
+
+    :param limit: Runs to return
+    :type limit: Integer
+    :param channel_id: Defaults to YT_CHANNEL_ID in Settings.py
+    :type channel_id: String
+    :param members: Defaults to MEMBERS in Settings.py
+    :type members: Boolean
+    :return: Rows of the runs table
+    :rtype: List of Dictionaries
+    """
+    cursor.execute("""SELECT * FROM (SELECT * FROM runs WHERE channel_id = %s AND members = %s ORDER BY started DESC LIMIT %s) AS latest ORDER BY started""",
+                   (channel_id if channel_id is not None else CFG.YT_CHANNEL_ID,members if members is not None else CFG.MEMBERS,limit))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns,row)) for row in cursor.fetchall()]
+
+def Throughput(run:dict[str,Any]) -> float|None:
+    """New messages per second of the run, leaving out time spent waiting on live streams. None if there's too little to tell."""
+    if run["status"] != FINISHED or (run["new_messages"] or 0) < MIN_MESSAGES:
+        return None
+    busy = float(run["seconds"]) - (run["stages"] or {}).get(LIVE_WAIT,0)
+    return run["new_messages"] / busy if busy > 0 else None
+
+def _Stage_Cost(run:dict[str,Any],stage:str) -> float|None:
+    """Seconds of a stage, per unit of work for the stages in STAGE_WORK."""
+    seconds = (run["stages"] or {}).get(stage)
+    if seconds is None or seconds < MIN_STAGE_SECONDS:
+        return None
+    if stage in STAGE_WORK:
+        work = run[STAGE_WORK[stage]] or 0
+        return seconds / work if work > 0 else None
+    return seconds
+
+class RunTrend:
+    """
+    A run compared to the runs before it.
+
+    :param run: Row of the runs table
+    :type run: Dictionary
+    :param throughput: See Throughput
+    :type throughput: Float
+    :param median: Median throughput of the window before the run
+    :type median: Float
+    :param flags: Why the run was flagged, empty if it wasn't
+    :type flags: List of Strings
+    """
+    def __init__(self,run:dict[str,Any],throughput:float|None,median:float|None,flags:list[str]):
+        self.run = run
+        self.throughput = throughput
+        self.median = median
+        self.flags = flags
+
+def Analyze(runs:list[dict[str,Any]],window:int|None=None,factor:float|None=None) -> list[RunTrend]:
+    """
+    Compares every run to the median of the finished runs before it.
+
+    :param runs: Oldest first (See Recent_Runs). The first runs have fewer (or no) runs to compare with
+    :type runs: List of Dictionaries
+    :param window: Runs in the rolling median. Defaults to RUN_MEDIAN_WINDOW in Settings.py
+    :type window: Integer
+    :param factor: How many times slower than the median gets flagged. Defaults to RUN_SLOW_FACTOR in Settings.py
+    :type factor: Float
+    :return: One per run, in the same order
+    :rtype: List of RunTrend
+    """
+    window = window if window is not None else CFG.RUN_MEDIAN_WINDOW
+    factor = factor if factor is not None else CFG.RUN_SLOW_FACTOR
+    trends = []
+    finished = []
+    for run in runs:
+        throughput = Throughput(run)
+        before = finished[-window:]
+        flags = []
+
+        earlier = [value for value in (Throughput(other) for other in before) if value is not None]
+        median = statistics.median(earlier) if len(earlier) > 0 else None
+        if throughput is not None and median is not None and throughput * factor < median:
+            flags.append(f"{median / throughput:.1f}x slower than the median")
+
+        for stage in (run["stages"] or {}):
+            cost = _Stage_Cost(run,stage)
+            usual = [value for value in (_Stage_Cost(other,stage) for other in before) if value is not None]
+            if cost is not None and len(usual) > 0 and cost > factor * statistics.median(usual):
+                per = {"new_messages":" per message","new_users":" per user"}.get(STAGE_WORK.get(stage,""),"")
+                flags.append(f"{stage} {cost / statistics.median(usual):.1f}x slower{per}")
+
+        if run["status"] != FINISHED:
+            flags.append("not finished (Still running, or it crashed)")
+        trends.append(RunTrend(run,throughput,median,flags))
+        if run["status"] == FINISHED:
+            finished.append(run)
+    return trends
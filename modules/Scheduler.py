@@ -0,0 +1,199 @@
+# Native Stuff
+import heapq,queue,threading
+from datetime import datetime,timedelta,timezone
+from typing import Any
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Classes as C
+
+"""
+Watches upcoming and live streams on their own threads, so they never hold up the backfill of everything else.
+
+    1. Main.py hands over every video that's upcoming or live (From the API, or from the videos table at startup).
+       Only streams this worker claimed from the work queue are handed over, and they stay leased until they're wrapped
+       up, so with several workers every stream is still watched once. Streams scheduled more than LIVE_HORIZON_HOURS
+       out (Or overdue by that much) are left for a later run instead of being polled now.
+    2. The scheduler sleeps until LIVE_LEAD_MINUTES before each scheduled start (Live ones start right away), then
+       gives the stream a watcher thread that downloads its chat into the spool until the stream ends.
+    3. LIVE_CATCHUP_MINUTES after the end the watcher downloads the chat replay once more to pick up anything the live
+       chat missed. Messages already spooled or stored are skipped, so the overlap costs nothing.
+    4. Finished streams are handed back through Finished() for Main.py to wrap up on its own database connection.
+
+Watchers only use ChatDownloader and the spool, both fine to use from several threads. Everything that needs the
+YouTube API or the main database connection stays on Main.py's thread.
+"""
+
+class LiveStream:
+    """
+    The bits of a video the scheduler needs. Get_Messages accepts it in place of a VideoClass.
+
+    :param id: Video ID
+    :type id: String
+    :param scheduled_start: When the stream is supposed to start (UTC)
+    :type scheduled_start: Datetime
+    :param islive: Whether it's live right now
+    :type islive: Boolean
+    """
+    def __init__(self,id:str,scheduled_start:datetime|None,islive:bool):
+        self.id = id
+        self.scheduled_start = scheduled_start
+        self.islive = islive
+
+    @classmethod
+    def From_Video(cls,video) -> 'LiveStream':
+        """From a VideoClass."""
+        return cls(video.id,video.scheduled_start,video.islive)
+
+def _Now() -> datetime:
+    """Current UTC time without a timezone, like the timestamps stored from the API."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def Unfinished_Streams(cursor) -> list[LiveStream]:
+    """
+    Streams the database last saw as upcoming or live that haven't ended, so they can be scheduled before the backfill
+    gets around to them. Claim them from the work queue before scheduling them (See Main.py).
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :return: Streams without an end time, live ones first
+    :rtype: List of LiveStream
+    """
+    cursor.execute("""SELECT id, scheduled_start, islive FROM videos
+        WHERE livestream = true AND processed IS NOT TRUE AND end_time IS NULL
+        ORDER BY islive DESC, scheduled_start""")
+    return [LiveStream(video_id,scheduled_start,bool(islive)) for video_id, scheduled_start, islive in cursor.fetchall()]
+
+class LiveScheduler(threading.Thread):
+    """
+    Starts a watcher thread per stream shortly before it goes live. Start it before the backfill, call Stop() at the end.
+
+    :param yt: API object, only its Get_Messages is used (From the watcher threads)
+    :type yt: YT_API Object
+    :param spool: Where the watchers put the chat
+    :type spool: Spool.Spool Object
+    """
+    def __init__(self,yt:Any,spool:Any):
+        super().__init__(name="Live Scheduler",daemon=True)
+        self.yt = yt
+        self.spool = spool
+
+        self._changed = threading.Condition()
+        self._stop_requested = False
+        self._schedule:list[tuple[datetime,str]] = [] # Heap of (Wake Up Time, Video ID)
+        self._streams:dict[str,tuple[datetime,LiveStream]] = {} # Scheduled, not being watched yet: {[Video ID] , ([Wake Up Time], [Stream])}
+        self._watchers:dict[str,threading.Thread] = {}
+        self._finished:queue.Queue[str] = queue.Queue()
+
+    def Add(self,stream:LiveStream) -> bool:
+        """
+        Schedules a stream, or moves it if its start time changed. Streams already being watched are left alone.
+
+        :return: False if its scheduled start is more than LIVE_HORIZON_HOURS away (Either way), it isn't watched this run
+        :rtype: Boolean
+        """
+        now = _Now()
+        horizon = timedelta(hours=CFG.LIVE_HORIZON_HOURS)
+        if stream.islive == True or stream.scheduled_start is None:
+            wake = now
+        elif abs(stream.scheduled_start - now) > horizon:
+            # Far off (e.g. free chat rooms), or long overdue and probably never happening
+            return False
+        else:
+            wake = stream.scheduled_start - timedelta(minutes=CFG.LIVE_LEAD_MINUTES)
+
+        with self._changed:
+            if stream.id in self._watchers:
+                return True
+            self._streams[stream.id] = (wake,stream)
+            heapq.heappush(self._schedule,(wake,stream.id))
+            self._changed.notify_all()
+        if wake > now:
+            LOG.logger.info(f"Stream {stream.id} starts at {stream.scheduled_start} UTC, chat will be watched from {wake:%H:%M} UTC.")
+        return True
+
+    def Has(self,video_id:str) -> bool:
+        """Whether a stream is scheduled or being watched."""
+        with self._changed:
+            return video_id in self._streams or video_id in self._watchers
+
+    def Active(self) -> int:
+        """Streams scheduled or being watched."""
+        with self._changed:
+            return len(self._streams) + len(self._watchers)
+
+    def Finished(self) -> list[str]:
+        """Streams whose watcher is done since the last call (Their chat may still be on its way to the database)."""
+        done = []
+        while True:
+            try:
+                done.append(self._finished.get_nowait())
+            except queue.Empty:
+                return done
+
+    def Wait(self,timeout:float):
+        """Sleeps until a watcher finishes (Or the timeout runs out)."""
+        try:
+            self._finished.put(self._finished.get(timeout=timeout))
+        except queue.Empty:
+            pass
+
+    def Stop(self):
+        """Stops scheduling. Watchers still downloading are left to finish on their own (They're daemons)."""
+        with self._changed:
+            self._stop_requested = True
+            self._changed.notify_all()
+        self.join()
+
+    def run(self):
+        with self._changed:
+            while self._stop_requested == False:
+                # Skip entries that were rescheduled or already started
+                while len(self._schedule) > 0 and self._streams.get(self._schedule[0][1],(None,))[0] != self._schedule[0][0]:
+                    heapq.heappop(self._schedule)
+
+                if len(self._schedule) == 0:
+                    self._changed.wait()
+                    continue
+
+                wake, video_id = self._schedule[0]
+                wait = (wake - _Now()).total_seconds()
+                if wait > 0:
+                    self._changed.wait(wait)
+                    continue
+
+                heapq.heappop(self._schedule)
+                _, stream = self._streams.pop(video_id)
+                watcher = threading.Thread(target=self._Watch,args=(stream,),name=f"Live Watcher {video_id}",daemon=True)
+                self._watchers[video_id] = watcher
+                watcher.start()
+
+    def _Download(self,stream:LiveStream,what:str,live:bool) -> int:
+        """One Get_Messages pass without a timeout. Returns the number of messages, 0 if there's no chat."""
+        try:
+            return self.yt.Get_Messages(stream,self.spool,timeout=False,show_progress=False,live=live)
+        except C.NoChatReplay:
+            LOG.logger.info(f"Stream {stream.id} has no {what}.")
+        except C.VideoUnplayable:
+            LOG.logger.warning(f"Stream {stream.id} became inaccessible while getting its {what}.")
+        except Exception as e:
+            LOG.logger.error(f"Unknown error getting the {what} of stream {stream.id}: {e}")
+        return 0
+
+    def _Watch(self,stream:LiveStream):
+        try:
+            LOG.logger.info(f"Watching the chat of stream {stream.id}.")
+            live = self._Download(stream,"live chat",True)
+
+            # The replay shows up a little after the stream ends and can have messages the live chat didn't
+            with self._changed:
+                self._changed.wait_for(lambda: self._stop_requested,timeout=CFG.LIVE_CATCHUP_MINUTES * 60)
+                stopping = self._stop_requested
+            replay = self._Download(stream,"chat replay",False) if stopping == False else 0
+
+            LOG.logger.info(f"Stream {stream.id} finished: {live} live message(s), {replay} in the replay (Duplicates are skipped).")
+        finally:
+            with self._changed:
+                self._watchers.pop(stream.id,None)
+            self._finished.put(stream.id)
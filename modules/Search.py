@@ -0,0 +1,136 @@
+# Native Stuff
+import base64,json,re
+from typing import Any
+from datetime import datetime
+
+# Installed Stuff
+import psycopg2
+
+# Other Project Files
+import modules.logconfig as LOG
+import modules.Database as DB
+
+# Columns handed back for every hit
+SEARCH_COLUMNS = ["message_id","video_id","time_in_seconds","datetime","user_id","user_name","type","message"]
+
+# Hits are sorted on this and message_id, served by idx_messages_search_order. Messages without a datetime sort last
+# instead of breaking the (datetime, message_id) paging comparison, which is never true for NULL
+SORT_KEY = "coalesce(datetime, '-infinity'::timestamp)"
+
+class SearchPage:
+    """
+    One page of search results.
+
+    :param hits: Messages that matched, newest first
+    :type hits: List of Dictionaries
+    :param next_page: Token to pass back into Search_Messages for the next page. None if this is the last page.
+    :type next_page: String
+    """
+    def __init__(self,hits:list[dict[str,Any]],next_page:str|None):
+        self.hits = hits
+        self.next_page = next_page
+
+def _encode_page(row:dict[str,Any]):
+    """Builds a paging token from the last hit of a page. Paging is keyset based so deep pages cost the same as the first."""
+    key = [row["datetime"].isoformat() if row["datetime"] is not None else None, row["message_id"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def _decode_page(token:str):
+    """Reverses _encode_page."""
+    when, message_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    return (datetime.fromisoformat(when) if when is not None else None), message_id
+
+def Video_Link(video_id:str,time_in_seconds:float|None):
+    """
+    Link that opens the video at the moment the message was sent.
+
+    :return: YouTube URL
+    :rtype: String
+    """
+    if time_in_seconds is None or time_in_seconds < 0:
+        return f"https://youtu.be/{video_id}"
+    return f"https://youtu.be/{video_id}?t={int(time_in_seconds)}"
+
+def Search_Messages(cursor:psycopg2.extensions.cursor,text:str|None=None,user_id:str|None=None,user_name:str|None=None,video_id:str|None=None,
+                    start:datetime|None=None,end:datetime|None=None,whole_words:bool=False,limit:int=50,page:str|None=None) -> SearchPage:
+    """
+    Searches chat messages. Every filter is optional but at least one should be given, otherwise it's just the newest messages.
+
+    Text is matched case-insensitively as a substring (Or as whole words with whole_words) and is served by the
+    idx_messages_message_trgm trigram index. Giving a video_id limits the search to that video's partition.
+
+    :param cursor: Database cursor object to execute commands.
+    :type cursor: Cursor
+    :param text: Text to look for in the message
+    :type text: String
+    :param user_id: Only messages from this channel ID
+    :type user_id: String
+    :param user_name: Only messages sent under this display name (Case-insensitive)
+    :type user_name: String
+    :param video_id: Only messages from this video
+    :type video_id: String
+    :param start: Only messages sent at or after this time
+    :type start: Datetime
+    :param end: Only messages sent before this time
+    :type end: Datetime
+    :param whole_words: Match the text on word boundaries instead of anywhere
+    :type whole_words: Boolean
+    :param limit: Number of hits per page
+    :type limit: Integer
+    :param page: Token from a previous SearchPage to continue from
+    :type page: String
+    :return: Page of hits, newest first
+    :rtype: SearchPage
+    """
+    conditions:list[str] = []
+    values:list[Any] = []
+
+    if text:
+        if whole_words:
+            conditions.append("message ~* %s")
+            values.append(r'\m' + re.escape(text) + r'\M')
+        else:
+            conditions.append("message ILIKE %s")
+            values.append(f"%{DB.Escape_Like(text)}%")
+    if user_id:
+        conditions.append("user_id = %s")
+        values.append(user_id)
+    if user_name:
+        conditions.append("lower(user_name) = lower(%s)")
+        values.append(user_name)
+    if video_id:
+        conditions.append("video_id = %s")
+        values.append(video_id)
+    if start:
+        conditions.append("datetime >= %s")
+        values.append(start)
+    if end:
+        conditions.append("datetime < %s")
+        values.append(end)
+    if page:
+        last_time, last_id = _decode_page(page)
+        conditions.append(f"({SORT_KEY}, message_id) < (%s::timestamp, %s)")
+        values.extend([last_time if last_time is not None else "-infinity", last_id])
+
+    where = f" WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+
+    # Ask for one extra row so we know if there's another page without a COUNT(*)
+    query: str = f"SELECT {', '.join(SEARCH_COLUMNS)} FROM messages{where} ORDER BY {SORT_KEY} DESC, message_id DESC LIMIT %s"
+    values.append(limit + 1)
+
+    try:
+        cursor.execute(query,values)
+    except Exception as e:
+        LOG.logger.error(f'Query: {query}\nValues: {values}\n')
+        raise e
+
+    hits = [dict(zip(SEARCH_COLUMNS,row)) for row in cursor.fetchall()]
+    for hit in hits:
+        hit["link"] = Video_Link(hit["video_id"],hit["time_in_seconds"])
+
+    next_page = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_page = _encode_page(hits[-1])
+
+    return SearchPage(hits,next_page)
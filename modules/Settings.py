@@ -1,5 +1,5 @@
 # Native Stuff
-import json
+import os,json
 from sys import exit
 from tkinter import filedialog,messagebox
 
@@ -43,24 +43,116 @@ MEMBER_DIRECTORY = {
 MEMBER_SELECTOR = MEMBER_DIRECTORY["Kiara"]
 
 # Database Configuration settngs
-DB_VERBOSE = False
+DB_TRACE = True # Time every query and print the statements that took the most time at the end of the run
+DB_SLOW_QUERY_MS = 250 # Statements slower than this are logged as warnings
+DB_TRACE_SAMPLES = 3 # Slow statements logged with their parameters per statement shape, the rest are only counted
+DB_TRACE_TOP = 15 # Rows in the end of run report
+DB_FETCH_SIZE = 5000 # Rows pulled per round trip when streaming results with a server-side cursor (See Database.py: StreamEntries)
+
+# Image Download Configuration
+IMAGE_REVALIDATE = False # Thumbnails/PFPs with the same URL as last time are skipped outright. Set to True to send a conditional request for them instead
+
+# Reconciliation Configuration (See Reconcile.py)
+RECONCILE_WORKERS = 4 # Parallel database connections / archive readers when checking the database against the archives
+
+# Snapshot History Configuration (See History.py)
+HISTORY_BASE_INTERVAL = 20 # Store a full copy of a video/user every this many versions, the rest are patches. Rebuilding a version applies at most this many
+
+# Record/Replay Configuration (See Fixtures.py, turned on with YTDB_FIXTURES)
+FIXTURE_API_LATENCY_MS = 150 # Wait before each replayed API response, about what the real API takes
+FIXTURE_IMAGE_LATENCY_MS = 40 # Wait before each replayed image
+FIXTURE_CHAT_TIME_SCALE = 0 # Replayed chats keep their recorded gaps between messages times this. 1 for the real pace, 0 for no waiting
+
+# Run Ledger Configuration (See RunLedger.py, Runs.py)
+RUN_LEDGER = True # Record every run's numbers (Throughput, API quota, time per stage, peak memory...) in the runs table
+RUN_MEDIAN_WINDOW = 10 # Runs.py compares each run to the median of this many runs before it
+RUN_SLOW_FACTOR = 1.5 # Runs.py flags runs/stages this many times slower than that median
+
+# Sampling Profiler Configuration (See Profiler.py)
+PROFILE = False # Profile the whole run. Also turned on by YTDB_PROFILE=yes or Main.py --profile, or toggled while running with kill -USR1 [pid]
+PROFILE_HZ = 97 # Stack samples per second. Odd so it doesn't fall in step with anything that runs every so many milliseconds
+PROFILE_CPU = True # Count the CPU time each thread used, so waiting threads don't show up. False counts wall clock time (Always on Windows/macOS)
+PROFILE_FORMATS = ["collapsed","speedscope"] # Files written to [DATA_PATH]/Profiles: flamegraph.pl/inferno input and https://www.speedscope.app
+
+# Shared User Cache Configuration (See UserCache.py)
+USER_CACHE = True # Share user lookups, snapshots and PFPs between every channel database using the same data directory
+USER_CACHE_HOURS = 24 # Users looked up by any channel more recently than this aren't asked for again
+
+# Nickname Backfill Configuration (See Nickname_Backfill.py)
+NICKNAME_BACKFILL_WORKERS = 4 # Parallel database connections
+NICKNAME_BACKFILL_CHUNKS = 64 # message_id ranges the work is split into. More chunks means less work lost if it gets interrupted
+
+# Columnar Export Configuration
+COLUMNAR_EXPORT = True # Write each video's messages to an Arrow file in [DATA_PATH]/columnar once its chat is processed
+COLUMNAR_COMPRESSION = "zstd" # "zstd", "lz4", or None. None makes the files bigger but lets readers memory map them without decompressing
+
+# Write-Ahead Spool Configuration (See Spool.py)
+SPOOL_MAX_MB = 1024 # Downloading pauses once this much chat is waiting to be written to the database
+SPOOL_BATCH = 1000 # Messages written to the database per transaction
+SPOOL_FLUSH_MESSAGES = 500 # Downloaded messages are made crash-safe at least every this many messages...
+SPOOL_FLUSH_SECONDS = 1.0 # ...or this many seconds, whichever comes first
+SPOOL_RETRY_SECONDS = 10 # Wait between reconnect attempts while the database is unavailable
+SPOOL_LAG_REPORT_SECONDS = 60 # How often the database lag gets logged (Debug level)
+
+# Chat Statistics Configuration
+DISTINCT_EXACT_LIMIT = 100000 # Unique chatters are counted exactly up to this many, then estimated (~1% off) in a fixed 16KB instead of a growing set
+SKETCHES = True # Keep approximate top chatters/words/emotes per video while writing messages (See Sketches.py, Leaderboard.py)
+SKETCH_TOP_K = 1000 # Entries each leaderboard sketch tracks. Counts of the top few percent of that are reliable
+SKETCH_MIN_WORD_LENGTH = 3 # Shorter words aren't counted for the word leaderboard
+
+# Chat Pipeline Configuration (See Pipeline.py)
+PIPELINE_QUEUE_SIZE = 2000 # Most messages waiting between two stages (Download, parse, spool) before the earlier stage pauses
+
+# Live Stream Scheduler Configuration (See Scheduler.py)
+LIVE_SCHEDULER = True # Watch upcoming/live streams on their own threads instead of blocking the other videos on them
+LIVE_HORIZON_HOURS = 2 # Streams scheduled further out than this are left for a later run
+LIVE_LEAD_MINUTES = 10 # Start watching this long before the scheduled start, to get the waiting room chat
+LIVE_CATCHUP_MINUTES = 10 # Wait after a stream ends before downloading the chat replay for anything the live chat missed
+
+# Live Chat Stats Configuration (See LiveStats.py)
+LIVE_STATS = True # Keep rolling numbers of live chats and serve them as JSON for overlays/dashboards
+LIVE_STATS_HOST = "127.0.0.1" # Interface to serve them on. Only this machine by default
+LIVE_STATS_PORT = 8765 # Port to serve them on
+LIVE_STATS_WINDOWS = [60,300,900] # Sliding windows in seconds
+LIVE_STATS_TOP_EMOTES = 10 # Emotes listed per window
+
+# Work Queue Configuration (See WorkQueue.py)
+WORK_LEASE_SECONDS = 300 # A claimed video/user batch goes back in the queue if its worker stops renewing the claim for this long
+WORK_HEARTBEAT_SECONDS = 60 # How often a worker renews its claims. Keep it well under WORK_LEASE_SECONDS
+WORK_MAX_ATTEMPTS = 3 # Tries per video/user batch before it's marked failed (Failed items are queued again next run)
 
 # Logging Configuration
 DEBUG_LOG_FILE='Chat_Process_Log' # Used when CONTINUOUS_LOG is set to True
 LOG_VERBOSE = False # Any debug messages will appear
 LOG_NAME = "LOG" # Log file prefix
 CONTINUOUS_LOG = True # Create one continuous log file and not separate ones per-run
+PROGRESS_INTERVAL = 0.5 # Seconds between progress bar redraws in per-message loops
+PROGRESS_COUNT = 1000 # ...or redraw after this many items, whichever comes first
 
 #####################################
 ### OTHER SETTINGS (DO NOT TOUCH) ###
 #####################################
 
+# Extra workers on machines without a screen can answer the prompts below with environment variables instead:
+# YTDB_LOG, YTDB_MEMBERS, YTDB_TIMEOUT (yes/no), YTDB_DATA_DIRECTORY and YTDB_SECRETS_DIRECTORY (Paths)
+def _Ask_Yes_No(env:str,title:str,question:str) -> bool:
+    value = os.environ.get(env)
+    if value is not None:
+        return value.strip().lower() in ("1","y","yes","true")
+    return messagebox.askyesno(title,question)
+
+def _Ask_Directory(env:str,title:str) -> str:
+    value = os.environ.get(env)
+    if value is not None:
+        return value
+    return filedialog.askdirectory(title=title)
+
 # Will ask if a log file will be created at all
-LOG = messagebox.askyesno("Logging","Do you want to write the console log to file?") # Create a log file (In script location)
+LOG = _Ask_Yes_No("YTDB_LOG","Logging","Do you want to write the console log to file?") # Create a log file (In script location)
 
 # Sets the working directories at launch. I don't recommend keeping secret stuff in the same spot as the data.
-DATA_DIRECTORY = filedialog.askdirectory(title="Specify directory for data to be downloaded to")
-SECRETS_DIRECTORY = filedialog.askdirectory(title="Specify directory where Secrets and/or Cookies are")
+DATA_DIRECTORY = _Ask_Directory("YTDB_DATA_DIRECTORY","Specify directory for data to be downloaded to")
+SECRETS_DIRECTORY = _Ask_Directory("YTDB_SECRETS_DIRECTORY","Specify directory where Secrets and/or Cookies are")
 
 # Will exit if either folder dialog boxes were closed
 if DATA_DIRECTORY == "" or SECRETS_DIRECTORY == "":
@@ -71,11 +163,15 @@ CLIENT_SECRETS_FILE = f'{SECRETS_DIRECTORY}/client_secret.json'  # Download this
 TOKEN_PICKLE_FILE = f'{SECRETS_DIRECTORY}/token.pickle'# Will be created on first launch
 
 # Set this if you want to write to a member's only database.
-MEMBERS = messagebox.askyesno("Members-Only","Do you want to download Members-Only video data? (BE SURE COOKIES ARE UP-TO-DATE)")
+MEMBERS = _Ask_Yes_No("YTDB_MEMBERS","Members-Only","Do you want to download Members-Only video data? (BE SURE COOKIES ARE UP-TO-DATE)")
 
 # The chat scraper can timeout if there is a livestream going and no new messages arrive.
 # Good for if there's a livestream (either live or waiting), but getting all other videos are desired.
-TIMEOUT = messagebox.askyesno("Chat-Timeout","Do you want the chat scraper to timeout?\n(Pick no if you want it to keep watching a livestream.)")
+TIMEOUT = _Ask_Yes_No("YTDB_TIMEOUT","Chat-Timeout","Do you want the chat scraper to timeout?\n(Pick no if you want it to keep watching a livestream.)")
+
+# Record everything fetched from the network ("record") or play a recording back offline ("replay"), see Fixtures.py.
+# Only set from the environment (YTDB_FIXTURES, and YTDB_FIXTURE_FILE for a file other than [DATA_PATH]/Fixtures.sqlite3).
+FIXTURES = os.environ.get("YTDB_FIXTURES") or None
 
 # Needed to access chat messages from member's only videos. Use browser addins to generate, make sure name matches.
 # NOTE: Once you've exported the cookies, CLOSE that browser (or user agent) and do not open/use until this program finishes.
@@ -0,0 +1,345 @@
+# Native Stuff
+import os,re,json,math,heapq
+from typing import Any,Iterable
+
+# Installed Stuff
+import xxhash
+
+# Other Project Files
+import modules.Settings as CFG
+
+"""
+Fixed-size summaries of streams that are too big to keep around, e.g. every chatter of a 24 hour subathon.
+
+    HyperLogLog: Estimates how many distinct items were seen in 2^precision bytes, about 1.04/sqrt(2^precision) off
+    DistinctCounter: Exact set while it's small, turns itself into a HyperLogLog past DISTINCT_EXACT_LIMIT items
+    SpaceSaving: The most frequent items (Heavy hitters) and their counts, tracking at most k items
+    ChatSketches: Top chatters, words and emotes of a chat, saved per video for Leaderboard.py
+
+Sketches of the same size merge in place (Register-wise max), so per-video counts add up into a run total without
+building new sets. SpaceSaving summaries merge too, so a leaderboard over any set of videos is a merge of their saved
+sketches instead of a GROUP BY over every message.
+"""
+
+_MASK_64 = (1 << 64) - 1
+
+def _Hash(item:str) -> int:
+    return xxhash.xxh64_intdigest(item.encode())
+
+class HyperLogLog:
+    """
+    Distinct count estimate in a fixed amount of memory.
+
+    :param precision: Registers = 2^precision bytes. 14 is 16KB and ~0.8% standard error
+    :type precision: Integer
+    """
+    def __init__(self,precision:int=14) -> None:
+        self.precision = precision
+        self._m = 1 << precision
+        self._registers = bytearray(self._m)
+        self._max_rank = 64 - precision + 1
+
+    def add(self,item:str):
+        hashed = _Hash(item)
+        index = hashed >> (64 - self.precision)
+        rest = (hashed << self.precision) & _MASK_64
+        rank = min(64 - rest.bit_length() + 1,self._max_rank)
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def update(self,items:Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def merge(self,other:'HyperLogLog'):
+        """Adds everything other has seen to this sketch (In place)."""
+        if other.precision != self.precision:
+            raise ValueError(f"Can't merge a HyperLogLog of precision {other.precision} into one of precision {self.precision}")
+        self._registers = bytearray(map(max,self._registers,other._registers))
+
+    def estimate(self) -> float:
+        m = self._m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -register for register in self._registers)
+        zeros = self._registers.count(0)
+        # Small counts are far more accurate from the share of empty registers (Linear counting)
+        if raw <= 2.5 * m and zeros > 0:
+            return m * math.log(m / zeros)
+        return raw
+
+    def __len__(self) -> int:
+        return round(self.estimate())
+
+class DistinctCounter:
+    """
+    Counts distinct items. Exact until it has seen more than limit of them, then a HyperLogLog from there on.
+    len() gives the count either way.
+
+    :param limit: Most items kept in the exact set. Defaults to DISTINCT_EXACT_LIMIT in Settings.py
+    :type limit: Integer
+    """
+    def __init__(self,limit:int|None=None) -> None:
+        self.limit = limit if limit is not None else CFG.DISTINCT_EXACT_LIMIT
+        self._exact:set[str]|None = set()
+        self._sketch:HyperLogLog|None = None
+
+    @property
+    def exact(self) -> bool:
+        """False once the count is an estimate."""
+        return self._exact is not None
+
+    def _To_Sketch(self):
+        self._sketch = HyperLogLog()
+        self._sketch.update(self._exact)
+        self._exact = None
+
+    def add(self,item:str):
+        if self._exact is not None:
+            self._exact.add(item)
+            if len(self._exact) > self.limit:
+                self._To_Sketch()
+        else:
+            self._sketch.add(item)
+
+    def update(self,items:Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def merge(self,other:'DistinctCounter'):
+        """Adds everything other has counted to this counter (In place, other is left alone)."""
+        if other._exact is not None:
+            self.update(other._exact)
+            return
+        if self._exact is not None:
+            self._To_Sketch()
+        self._sketch.merge(other._sketch)
+
+    def __len__(self) -> int:
+        return len(self._exact) if self._exact is not None else len(self._sketch)
+
+class SpaceSaving:
+    """
+    Heavy hitters in a fixed amount of memory (Metwally et al.). Tracks at most k items; an untracked item replaces the
+    one with the lowest count and takes over that count as its possible overcount (error). Any item seen more than
+    total/k times is guaranteed to be tracked, and its true count is between count - error and count.
+
+    :param k: Most items tracked. Defaults to SKETCH_TOP_K in Settings.py
+    :type k: Integer
+    """
+    def __init__(self,k:int|None=None) -> None:
+        self.k = k if k is not None else CFG.SKETCH_TOP_K
+        self.total = 0
+        self._counts:dict[str,int] = {}
+        self._errors:dict[str,int] = {}
+        self._heap:list[tuple[int,str]] = [] # (Count, Item), counts can be out of date (Only ever too low)
+
+    def __contains__(self,item:str) -> bool:
+        return item in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _Minimum(self) -> tuple[int,str]:
+        """The tracked item with the lowest count, bringing out of date heap entries up to date on the way."""
+        while True:
+            count, item = self._heap[0]
+            current = self._counts[item]
+            if current == count:
+                return count, item
+            heapq.heapreplace(self._heap,(current,item))
+
+    def _Floor(self) -> int:
+        """Most an untracked item could've been seen (0 until k items are tracked)."""
+        return self._Minimum()[0] if len(self._counts) >= self.k else 0
+
+    def add(self,item:str,count:int=1):
+        self.total += count
+        current = self._counts.get(item)
+        if current is not None:
+            self._counts[item] = current + count
+        elif len(self._counts) < self.k:
+            self._counts[item] = count
+            self._errors[item] = 0
+            heapq.heappush(self._heap,(count,item))
+        else:
+            floor, evicted = self._Minimum()
+            del self._counts[evicted]
+            del self._errors[evicted]
+            self._counts[item] = floor + count
+            self._errors[item] = floor
+            heapq.heapreplace(self._heap,(floor + count,item))
+
+    def update(self,items:Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def merge(self,other:'SpaceSaving'):
+        """
+        Adds everything other has counted to this summary (In place). Items one side doesn't track count as that
+        side's lowest count, like they would have if they'd been added to it (Agarwal et al., Mergeable Summaries).
+        """
+        own_floor = self._Floor() if len(self._counts) > 0 else 0
+        other_floor = other._Floor() if len(other._counts) > 0 else 0
+        combined = [(self._counts.get(item,own_floor) + other._counts.get(item,other_floor),
+                     self._errors.get(item,own_floor) + other._errors.get(item,other_floor),item)
+                    for item in self._counts.keys() | other._counts.keys()]
+        kept = heapq.nlargest(self.k,combined)
+        self.total += other.total
+        self._counts = {item:count for count, _, item in kept}
+        self._errors = {item:error for _, error, item in kept}
+        self._heap = [(count,item) for count, _, item in kept]
+        heapq.heapify(self._heap)
+
+    def top(self,n:int|None=None) -> list[tuple[str,int,int]]:
+        """
+        The n most frequent items.
+
+        :return: (Item, Count, Error) highest count first. The true count is between count - error and count
+        :rtype: List of Tuples
+        """
+        ranked = sorted(self._counts.items(),key=lambda pair: (-pair[1],pair[0]))
+        return [(item,count,self._errors[item]) for item, count in (ranked if n is None else ranked[:n])]
+
+    def to_dict(self) -> dict[str,Any]:
+        return {"k":self.k,"total":self.total,"items":self.top()}
+
+    @classmethod
+    def from_dict(cls,data:dict[str,Any]) -> 'SpaceSaving':
+        sketch = cls(data["k"])
+        sketch.total = data["total"]
+        for item, count, error in data["items"]:
+            sketch._counts[item] = count
+            sketch._errors[item] = error
+            sketch._heap.append((count,item))
+        heapq.heapify(sketch._heap)
+        return sketch
+
+#-----------------------#
+#-- CHAT LEADERBOARDS --#
+#-----------------------#
+
+_EMOTE_TEXT = re.compile(r":[^\s:]+:") # :emote: shortcuts in the message text aren't words
+_WORD = re.compile(r"\w+")
+
+SKETCH_FOLDER = f"{CFG.DATA_PATH}/Sketches"
+CHANNEL = "_Channel" # Channel sketch older versions kept, not a video (Video IDs never start with an underscore)
+
+def Words(message:str|None) -> list[str]:
+    """The words of a message counted for the word leaderboard (Lowercase, emotes left out)."""
+    if message is None:
+        return []
+    return [word for word in _WORD.findall(_EMOTE_TEXT.sub(" ",message.lower())) if len(word) >= CFG.SKETCH_MIN_WORD_LENGTH]
+
+def Text_Emotes(message:str|None) -> list[str]:
+    """The :emote: shortcuts in a message's text, for messages stored without their emote list."""
+    return _EMOTE_TEXT.findall(message) if message is not None else []
+
+class ChatSketches:
+    """
+    Top chatters, words and emotes of a chat, plus what's needed to pick sketches by time range.
+
+    :param k: Items tracked per leaderboard. Defaults to SKETCH_TOP_K in Settings.py
+    :type k: Integer
+    """
+    KINDS = ("chatters","words","emotes")
+
+    def __init__(self,k:int|None=None) -> None:
+        self.chatters = SpaceSaving(k)
+        self.words = SpaceSaving(k)
+        self.emotes = SpaceSaving(k)
+        self.names:dict[str,str] = {} # Latest name of the tracked chatters
+        self.first:float|None = None # Timestamp (Seconds) of the first and last message counted
+        self.last:float|None = None
+
+    def add(self,entry:dict[str,Any],emotes:list[dict[str,Any]]):
+        """
+        Counts a message.
+
+        :param entry: MessageClass.entry
+        :type entry: Dictionary
+        :param emotes: MessageClass.e_emote_entries
+        :type emotes: List of Dictionaries
+        """
+        user_id = entry["user_id"]
+        if user_id is not None:
+            self.chatters.add(user_id)
+            if entry["user_name"] is not None:
+                self.names[user_id] = entry["user_name"]
+                # Names of chatters that dropped out of the sketch aren't needed anymore
+                if len(self.names) > 2 * self.chatters.k:
+                    self._Prune_Names()
+        self.words.update(Words(entry["message"]))
+        for emote in emotes:
+            if emote["name"] is not None:
+                self.emotes.add(emote["name"])
+        timestamp = entry["timestamp"]
+        if timestamp is not None:
+            self.first = timestamp if self.first is None else min(self.first,timestamp)
+            self.last = timestamp if self.last is None else max(self.last,timestamp)
+
+    def _Prune_Names(self):
+        self.names = {user_id:name for user_id, name in self.names.items() if user_id in self.chatters}
+
+    def merge(self,other:'ChatSketches'):
+        """Adds everything other has counted (In place)."""
+        for kind in ChatSketches.KINDS:
+            getattr(self,kind).merge(getattr(other,kind))
+        self.names.update(other.names)
+        self._Prune_Names()
+        for timestamp in (other.first,other.last):
+            if timestamp is not None:
+                self.first = timestamp if self.first is None else min(self.first,timestamp)
+                self.last = timestamp if self.last is None else max(self.last,timestamp)
+
+    def to_dict(self) -> dict[str,Any]:
+        self._Prune_Names()
+        return {"first":self.first,"last":self.last,"names":self.names,**{kind:getattr(self,kind).to_dict() for kind in ChatSketches.KINDS}}
+
+    @classmethod
+    def from_dict(cls,data:dict[str,Any]) -> 'ChatSketches':
+        sketches = cls()
+        for kind in ChatSketches.KINDS:
+            setattr(sketches,kind,SpaceSaving.from_dict(data[kind]))
+        sketches.names = data["names"]
+        sketches.first = data["first"]
+        sketches.last = data["last"]
+        return sketches
+
+def Sketch_Path(name:str) -> str:
+    """Where the sketches of a video are saved."""
+    return f"{SKETCH_FOLDER}/{name}.json"
+
+def Saved_Videos() -> list[str]:
+    """Every video with saved sketches."""
+    if os.path.isdir(SKETCH_FOLDER) == False:
+        return []
+    return sorted(name[:-5] for name in os.listdir(SKETCH_FOLDER) if name.endswith(".json") and name[:-5] != CHANNEL)
+
+def Load_Chat_Sketches(name:str) -> ChatSketches|None:
+    """The saved sketches of a video, None if there aren't any."""
+    if os.path.isfile(Sketch_Path(name)) == False:
+        return None
+    with open(Sketch_Path(name),'r') as file:
+        return ChatSketches.from_dict(json.load(file))
+
+def Write_Chat_Sketches(name:str,sketches:ChatSketches):
+    """Saves the sketches of a video, replacing what was saved."""
+    os.makedirs(SKETCH_FOLDER,exist_ok=True)
+    temp_path = f"{Sketch_Path(name)}.TEMP"
+    with open(temp_path,'w') as file:
+        json.dump(sketches.to_dict(),file,separators=(',',':'))
+    os.replace(temp_path,Sketch_Path(name))
+
+def Save_Chat_Sketches(video_id:str,sketches:ChatSketches):
+    """
+    Adds newly counted messages to the saved sketches of a video.
+    Only pass messages that weren't counted before (New ones, see Spool.Write_Messages), or they count twice.
+
+    Only one worker has a video at a time (See WorkQueue.py), so nothing else writes its file meanwhile. There's no
+    channel file for workers to share, the channel's leaderboards merge every video's sketches instead.
+    """
+    saved = Load_Chat_Sketches(video_id)
+    if saved is None:
+        saved = ChatSketches()
+    saved.merge(sketches)
+    Write_Chat_Sketches(video_id,saved)
@@ -0,0 +1,477 @@
+# Native Stuff
+import os,json,time,sqlite3,threading
+from typing import Any
+
+# Installed Stuff
+import psycopg2
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Classes as C
+
+"""
+Local write-ahead spool that sits between the chat downloader and Postgres.
+
+Every downloaded message is written to a SQLite file (WAL mode, fsync on every commit) before anything else happens
+to it, so a killed process or a database outage never loses chat that was already downloaded:
+    1. Get_Messages parses each message and appends it to the spool in small batches (See SPOOL_FLUSH_* in Settings.py).
+    2. The Committer thread drains the spool into Postgres in order, SPOOL_BATCH messages per transaction. When the
+       database is unreachable it keeps retrying while downloading carries on into the spool.
+    3. Once a video is fully drained, Release() appends its raw messages to [video_id]_Messages.json and clears them.
+       The spool also keeps the IDs of every archived message, so appending never has to read the archive back in.
+
+Anything left in the spool after a crash is replayed by the next run's Committer. Writes to Postgres skip messages
+that already exist, so replaying a batch that was committed right before the crash is harmless.
+
+If more than SPOOL_MAX_MB is waiting for the database, appending blocks until the Committer catches up.
+"""
+
+SPOOL_PATH = f"{CFG.DATA_PATH}/Spool_{CFG.DB_NAME}.sqlite3"
+
+# Row states
+PENDING = 0 # Waiting to be written to Postgres
+COMMITTED = 1 # In Postgres, waiting for Release() to archive it
+FAILED = 2 # Postgres rejected it, kept (and archived) so it can be looked at
+
+class Spool:
+    """
+    SQLite backed queue of downloaded messages. Safe to share between threads.
+
+    :param path: SQLite file to use. Defaults to SPOOL_PATH
+    :type path: String
+    """
+    def __init__(self,path:str|None=None):
+        self.path = path if path is not None else SPOOL_PATH
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+        self._conn = sqlite3.connect(self.path,check_same_thread=False,isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS spool (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id TEXT NOT NULL,
+            message_id TEXT,
+            raw TEXT NOT NULL,
+            parsed TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            spooled REAL NOT NULL,
+            state INTEGER NOT NULL DEFAULT 0
+        )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_state ON spool (state, seq)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_video ON spool (video_id, state)")
+
+        # IDs of the messages in each [video_id]_Messages.json, so appending to an archive doesn't mean reading it all in
+        self._conn.execute("CREATE TABLE IF NOT EXISTS archived (video_id TEXT NOT NULL, message_id TEXT NOT NULL, PRIMARY KEY (video_id, message_id)) WITHOUT ROWID")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS archive_indexed (video_id TEXT PRIMARY KEY)")
+        # Message digests of each archive as of its size/modification time, so Reconcile.py only re-reads changed ones
+        self._conn.execute("CREATE TABLE IF NOT EXISTS archive_digests (video_id TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, count INTEGER NOT NULL, total TEXT NOT NULL)")
+
+        # Kept in memory so the progress bars and the size cap don't need a query
+        self.pending_rows, self.pending_bytes = self._conn.execute("SELECT count(*), coalesce(sum(size),0) FROM spool WHERE state = ?",(PENDING,)).fetchone()
+        self.downloaded_bytes = 0 # Raw chat appended since the spool was opened (As JSON), for the run ledger
+
+    def Close(self):
+        """Closes the SQLite file."""
+        with self._lock:
+            self._conn.close()
+
+    def Append(self,video_id:str,messages:list[tuple[dict[str,Any],dict[str,Any]]]):
+        """
+        Durably stores downloaded messages. Blocks while the spool is over SPOOL_MAX_MB.
+
+        :param video_id: Video the messages are from
+        :type video_id: String
+        :param messages: (Raw chat_downloader message, {"entry": MessageClass.entry, "emotes": MessageClass.e_emote_entries})
+        :type messages: List of Tuples
+        """
+        if len(messages) == 0:
+            return
+
+        now = time.time()
+        rows = []
+        for raw, parsed in messages:
+            raw_text = json.dumps(raw)
+            parsed_text = json.dumps(parsed)
+            rows.append((video_id,raw.get("message_id"),raw_text,parsed_text,len(raw_text) + len(parsed_text),now))
+        size = sum(row[4] for row in rows)
+
+        with self._changed:
+            # Backpressure, the downloader waits here if the database has fallen too far behind
+            if self.pending_bytes >= CFG.SPOOL_MAX_MB * 1024 * 1024:
+                LOG.logger.warning(f"Spool is full ({self.pending_rows} messages waiting for the database), pausing download.")
+                while self.pending_bytes >= CFG.SPOOL_MAX_MB * 1024 * 1024:
+                    self._changed.wait(1)
+
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT INTO spool (video_id, message_id, raw, parsed, size, spooled) VALUES (?,?,?,?,?,?)",rows)
+            self._conn.execute("COMMIT")
+
+            self.pending_rows += len(rows)
+            self.pending_bytes += size
+            self.downloaded_bytes += sum(len(row[2]) for row in rows)
+            self._changed.notify_all()
+
+    def Next_Batch(self,limit:int) -> list[tuple[int,str,dict[str,Any]]]:
+        """
+        Oldest messages still waiting for the database.
+
+        :return: (Sequence Number, Video ID, Parsed Message)
+        :rtype: List of Tuples
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, video_id, parsed FROM spool WHERE state = ? ORDER BY seq LIMIT ?",(PENDING,limit)).fetchall()
+        return [(seq,video_id,json.loads(parsed)) for seq, video_id, parsed in rows]
+
+    def Mark(self,seqs:list[int],state:int):
+        """Moves messages out of PENDING once the Committer is done with them."""
+        with self._changed:
+            self._conn.execute("BEGIN")
+            rows, size = 0, 0
+            for seq in seqs:
+                row = self._conn.execute("SELECT size FROM spool WHERE seq = ? AND state = ?",(seq,PENDING)).fetchone()
+                if row is None:
+                    continue
+                self._conn.execute("UPDATE spool SET state = ? WHERE seq = ?",(state,seq))
+                rows += 1
+                size += row[0]
+            self._conn.execute("COMMIT")
+
+            self.pending_rows -= rows
+            self.pending_bytes -= size
+            self._changed.notify_all()
+
+    def Pending(self,video_id:str|None=None) -> int:
+        """Number of messages (Of a video, or in total) not written to the database yet."""
+        if video_id is None:
+            return self.pending_rows
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM spool WHERE video_id = ? AND state = ?",(video_id,PENDING)).fetchone()[0]
+
+    def Wait_For_Messages(self,timeout:float):
+        """Sleeps until something is appended (Or the timeout runs out)."""
+        with self._changed:
+            if self.pending_rows == 0:
+                self._changed.wait(timeout)
+
+    def Wait_Drained(self,video_id:str|None=None):
+        """Blocks until every message (Of a video, or in total) has been written to the database."""
+        while self.Pending(video_id) > 0:
+            with self._changed:
+                self._changed.wait(1)
+
+    def Lag(self) -> tuple[int,int,float]:
+        """
+        How far the database is behind the downloader.
+
+        :return: (Messages Waiting, Bytes Waiting, Seconds Since The Oldest Was Spooled)
+        :rtype: Tuple
+        """
+        with self._lock:
+            oldest = self._conn.execute("SELECT min(spooled) FROM spool WHERE state = ?",(PENDING,)).fetchone()[0]
+            return self.pending_rows, self.pending_bytes, (time.time() - oldest) if oldest is not None else 0.0
+
+    def Videos(self) -> list[str]:
+        """Every video with messages in the spool."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT video_id FROM spool")]
+
+    def Failed(self) -> dict[str,int]:
+        """Messages Postgres rejected, which stay in the spool for good: {[Video ID] , [Messages]}"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT video_id, count(*) FROM spool WHERE state = ? GROUP BY video_id",(FAILED,)).fetchall())
+
+    def Release(self,video_id:str):
+        """
+        Archives a drained video's messages to [video_id]_Messages.json and removes the committed ones from the spool.
+        Failed messages are archived too but stay in the spool. Works through SPOOL_BATCH messages at a time and only
+        appends to the archive, so memory stays the same no matter how long the chat was.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM spool WHERE video_id = ? AND state != ? LIMIT 1",(video_id,PENDING)).fetchone() is None:
+                return
+
+        last_seq = 0
+        with C.MessageArchive(video_id) as archive:
+            if archive.created == True or archive.repaired == True:
+                # The index has to match the file, e.g. if the archive was deleted or its damaged end dropped
+                with self._lock:
+                    self._conn.execute("DELETE FROM archive_indexed WHERE video_id = ?",(video_id,))
+            self._Index_Archive(video_id)
+
+            while True:
+                with self._lock:
+                    rows = self._conn.execute("SELECT seq, message_id, raw FROM spool WHERE video_id = ? AND state != ? AND seq > ? ORDER BY seq LIMIT ?",
+                                              (video_id,PENDING,last_seq,CFG.SPOOL_BATCH)).fetchall()
+                if len(rows) == 0:
+                    break
+                last_seq = rows[-1][0]
+
+                # Messages already in the archive (From an earlier run, or spooled twice) aren't written again
+                ids = list({message_id for _, message_id, _ in rows})
+                with self._lock:
+                    archived = {row[0] for row in self._conn.execute(f"SELECT message_id FROM archived WHERE video_id = ? AND message_id IN ({','.join('?' * len(ids))})",[video_id] + ids)}
+                new_messages = []
+                for _, message_id, raw in rows:
+                    if message_id in archived:
+                        continue
+                    archived.add(message_id)
+                    new_messages.append((message_id,json.loads(raw)))
+
+                archive.Append(message for _, message in new_messages)
+                self._Add_Archived(video_id,[message_id for message_id, _ in new_messages])
+
+        with self._lock:
+            self._conn.execute("DELETE FROM spool WHERE video_id = ? AND state = ?",(video_id,COMMITTED))
+
+    def _Index_Archive(self,video_id:str):
+        """
+        Fills the archived table from a video's archive file the first time it's needed (e.g. archives from before the
+        index, or after the file was repaired). Called with the archive open, so the file always exists.
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM archive_indexed WHERE video_id = ?",(video_id,)).fetchone() is not None:
+                return
+            self._conn.execute("DELETE FROM archived WHERE video_id = ?",(video_id,))
+
+        batch = []
+        for message in C.Read_Message_Archive(video_id):
+            batch.append(message["message_id"])
+            if len(batch) >= CFG.SPOOL_BATCH:
+                self._Add_Archived(video_id,batch)
+                batch = []
+        self._Add_Archived(video_id,batch,finished=True)
+
+    def Forget_Archive(self,video_id:str):
+        """Drops what's known about a video's archive (Call after changing the file outside of Release), it's re-read when next needed."""
+        with self._lock:
+            self._conn.execute("DELETE FROM archive_indexed WHERE video_id = ?",(video_id,))
+            self._conn.execute("DELETE FROM archive_digests WHERE video_id = ?",(video_id,))
+
+    def Archive_Digest(self,video_id:str,size:int,mtime_ns:int) -> tuple[int,int]|None:
+        """(Count, Digest) stored for a video's archive, None if there isn't one for this version of the file."""
+        with self._lock:
+            row = self._conn.execute("SELECT count, total FROM archive_digests WHERE video_id = ? AND size = ? AND mtime_ns = ?",(video_id,size,mtime_ns)).fetchone()
+        return (row[0],int(row[1])) if row is not None else None
+
+    def Save_Archive_Digest(self,video_id:str,size:int,mtime_ns:int,count:int,total:int):
+        """Remembers the (Count, Digest) of a video's archive for this version of the file."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO archive_digests (video_id, size, mtime_ns, count, total) VALUES (?,?,?,?,?)",(video_id,size,mtime_ns,count,str(total)))
+
+    def _Add_Archived(self,video_id:str,message_ids:list[str],finished:bool=False):
+        """Records message IDs as archived, and with finished set that the video's archive is fully indexed."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO archived (video_id, message_id) VALUES (?,?)",[(video_id,message_id) for message_id in message_ids])
+            if finished == True:
+                self._conn.execute("INSERT INTO archive_indexed (video_id) VALUES (?)",(video_id,))
+            self._conn.execute("COMMIT")
+
+def Write_Messages(database:DB.PostgresClass,rows:list[tuple[int,str,dict[str,Any]]]) -> dict[str,C.ChatStats]:
+    """
+    Writes a batch of spooled messages to Postgres (Users, emotes, messages and nickname matches). Doesn't commit.
+    Every table gets one multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING, what comes back is what was new.
+    Messages already in the database are skipped, so a batch can safely be written twice (Or by two workers at once).
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    :param rows: Batch from Spool.Next_Batch
+    :type rows: List of Tuples
+    :return: Stats of the batch per video
+    :rtype: Dictionary of {[Video ID] , [ChatStats]}
+    """
+    cursor = database.cursor
+
+    #----------------------#
+    #-- USER ID DATABASE --#
+    #----------------------#
+
+    # Add Unique UserIDs if they don't already exist in DB (User's names may change over time, but not the UniqueID)
+    user_ids = sorted({parsed["entry"]["user_id"] for _, _, parsed in rows})
+    new_users = {entry["id"] for entry in DB.InsertEntries(cursor,"user_ids",[{"id":user_id} for user_id in user_ids],"id",returning="id")}
+
+    #--------------------#
+    #-- EMOTE DATABASE --#
+    #--------------------#
+
+    emotes = {emote["id"]:emote for _, _, parsed in rows for emote in parsed["emotes"]}
+    DB.InsertEntries(cursor,"emotes",list(emotes.values()),"id",returning="id")
+
+    #----------------------#
+    #-- MESSAGE DATABASE --#
+    #----------------------#
+
+    # The same message can be spooled twice when a download is retried, only send it once
+    entries:dict[tuple[str,str],dict[str,Any]] = {}
+    for _, video_id, parsed in rows:
+        entries.setdefault((video_id,parsed["entry"]["message_id"]),parsed["entry"])
+
+    inserted = DB.InsertEntries(cursor,"messages",list(entries.values()),"message_id, video_id",returning="video_id, message_id")
+    new_messages = {(entry["video_id"],entry["message_id"]) for entry in inserted}
+
+    #-------------------------------#
+    #-- NICKNAME MATCHES DATABASE --#
+    #-------------------------------#
+
+    # Only look for nicknames in messages that are new, and only if there are any to look for in the database
+    sorted_nicknames = C.Load_Nicknames(cursor)
+    if len(sorted_nicknames) > 0:
+        matches = [{
+            "video_id":video_id,
+            "message_id":message_id,
+            "matched_nickname":nick,
+            "index_start":start,
+            "index_end":end
+        } for video_id, message_id in new_messages for nick, start, end in C.Match_Nicknames(entries[(video_id,message_id)]["message"],sorted_nicknames)]
+        DB.InsertEntries(cursor,"nickname_matches",matches,"message_id,index_start,index_end",returning="message_id")
+
+    return Batch_Stats(rows,new_users,new_messages)
+
+def Batch_Stats(rows:list[tuple[int,str,dict[str,Any]]],new_users:set[str],new_messages:set[tuple[str,str]]) -> dict[str,C.ChatStats]:
+    """
+    Counts a batch of spooled messages, see Write_Messages.
+
+    :param rows: Batch from Spool.Next_Batch
+    :type rows: List of Tuples
+    :param new_users: User IDs the batch added to the database
+    :type new_users: Set of Strings
+    :param new_messages: (Video ID, Message ID) of the messages the batch added to the database
+    :type new_messages: Set of Tuples
+    :return: Stats of the batch per video
+    :rtype: Dictionary of {[Video ID] , [ChatStats]}
+    """
+    stats:dict[str,C.ChatStats] = {}
+    counted_users = set()
+    counted_messages = set()
+    for _, video_id, parsed in rows:
+        entry = parsed["entry"]
+        video_stats = stats.setdefault(video_id,C.ChatStats())
+        video_stats.total_messages += 1
+
+        user_id = entry["user_id"]
+        video_stats.unique_user_ids.add(user_id)
+        if user_id in new_users and user_id not in counted_users:
+            video_stats.new_user_ids += 1
+            counted_users.add(user_id)
+
+        key = (video_id,entry["message_id"])
+        if key in new_messages and key not in counted_messages:
+            video_stats.new_messages += 1
+            counted_messages.add(key)
+            # Only new messages, so a replayed batch doesn't count twice in the saved sketches
+            if CFG.SKETCHES == True:
+                video_stats.sketches.add(entry,parsed["emotes"])
+        else:
+            video_stats.existing_messages += 1
+
+    return stats
+
+class Committer(threading.Thread):
+    """
+    Background thread that drains the spool into Postgres on its own database connection.
+    Start it before downloading, call Stop() when done.
+
+    :param spool: Spool to drain
+    :type spool: Spool
+    """
+    def __init__(self,spool:Spool):
+        super().__init__(name="Spool Committer",daemon=True)
+        self.spool = spool
+        self._db:DB.PostgresClass|None = None
+        self._stop_requested = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats:dict[str,C.ChatStats] = {}
+        self._last_report = time.monotonic()
+
+    def Take_Stats(self,video_id:str) -> C.ChatStats:
+        """Stats of everything written for a video so far. Clears them, so call it once the video is drained."""
+        with self._stats_lock:
+            return self._stats.pop(video_id,C.ChatStats())
+
+    def Stop(self):
+        """Finishes draining whatever is left in the spool, then stops the thread."""
+        self._stop_requested.set()
+        self.join()
+
+    def run(self):
+        while True:
+            rows = self.spool.Next_Batch(CFG.SPOOL_BATCH)
+            if len(rows) == 0:
+                if self._stop_requested.is_set():
+                    break
+                self.spool.Wait_For_Messages(1)
+                continue
+            self._Commit(rows)
+            self._Report_Lag()
+
+        self._Disconnect()
+
+    def _Report_Lag(self,force:bool=False):
+        """Logs how far behind the database is every SPOOL_LAG_REPORT_SECONDS."""
+        if force == False and time.monotonic() - self._last_report < CFG.SPOOL_LAG_REPORT_SECONDS:
+            return
+        self._last_report = time.monotonic()
+        rows, size, seconds = self.spool.Lag()
+        if rows > 0:
+            LOG.logger.debug(f"Spool lag: {rows} message(s), {size / 1048576:.1f} MB, oldest from {seconds:.0f}s ago.")
+
+    def _Commit(self,rows:list[tuple[int,str,dict[str,Any]]]):
+        """Writes a batch, retrying through outages. A batch Postgres rejects is retried one message at a time."""
+        outage = False
+        while True:
+            try:
+                if self._db is None:
+                    self._db = DB.PostgresClass()
+                stats = Write_Messages(self._db,rows)
+                self._db.database.commit()
+                break
+            except (psycopg2.OperationalError,psycopg2.InterfaceError) as e:
+                # Lost the database, drop the connection and keep trying. Downloads keep going into the spool meanwhile.
+                if outage == False:
+                    LOG.logger.warning(f"Database unavailable, messages will stay in the spool until it's back: {e}")
+                    outage = True
+                self._Disconnect()
+                time.sleep(CFG.SPOOL_RETRY_SECONDS)
+                self._Report_Lag(force=True)
+            except Exception as e:
+                # The connection may not have been made, or may have gone down with the error
+                if self._db is not None:
+                    try:
+                        self._db.database.rollback()
+                    except (psycopg2.OperationalError,psycopg2.InterfaceError):
+                        self._Disconnect()
+                        continue
+                if len(rows) > 1:
+                    for row in rows:
+                        self._Commit([row])
+                    return
+                LOG.logger.error(f"Spooled message {rows[0][0]} ({rows[0][1]}) could not be written, leaving it in the spool: {e}")
+                self.spool.Mark([rows[0][0]],FAILED)
+                return
+
+        if outage == True:
+            LOG.logger.info("Database is back, draining the spool.")
+
+        # Stats go in before the batch stops being pending, Main.py takes them as soon as nothing is pending
+        with self._stats_lock:
+            for video_id, video_stats in stats.items():
+                if video_id in self._stats:
+                    video_stats.append_all(self._stats[video_id])
+                else:
+                    self._stats[video_id] = video_stats
+
+        self.spool.Mark([row[0] for row in rows],COMMITTED)
+
+    def _Disconnect(self):
+        """Closes the connection (If any) and only then forgets it, so it's made again on the next commit."""
+        if self._db is not None:
+            try:
+                self._db.Close()
+            except Exception:
+                pass
+            self._db = None
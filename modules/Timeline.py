@@ -0,0 +1,316 @@
+# Native Stuff
+import os
+from typing import Any
+from datetime import datetime,timezone
+from concurrent.futures import ThreadPoolExecutor
+
+# Installed Stuff
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+import modules.Export as EX
+
+"""
+Binned chat timelines for clipping and highlight detection.
+
+Every series is built with NumPy straight from the per-message arrays (No GROUP BY per video). Columnar exports
+(See Export.py) are used as the source when they exist, otherwise the messages are streamed out of the database.
+Results are cached as .npz files in [DATA_PATH]/timelines and rebuilt only when the source changes.
+
+    tl = Timeline.Load_Timeline("dQw4w9WgXcQ",resolution=60)  # Per-minute series
+    tl.Top_Peaks(k=10,min_gap=5)                               # 10 busiest minutes, at least 5 minutes apart
+"""
+
+TIMELINE_PATH = f"{CFG.DATA_PATH}/timelines"
+
+# Message types that carry money
+PAID_TYPES = ("paid_message","paid_sticker")
+
+# Columns needed to build a timeline
+SOURCE_COLUMNS = ["time_in_seconds","timestamp","user_id","type","amount","user_member_status"]
+
+class Timeline:
+    """
+    Per-bin chat series for one video. Bin i covers [origin + i*resolution, origin + (i+1)*resolution) seconds of video time.
+
+    :param video_id: Video the timeline belongs to
+    :type video_id: String
+    :param resolution: Seconds per bin
+    :type resolution: Integer
+    :param origin: Video time (Seconds) of the start of the first bin. Negative when there's pre-stream chat.
+    :type origin: Integer
+    """
+    def __init__(self,video_id:str,resolution:int,origin:int,messages:np.ndarray,superchat_amount:np.ndarray,unique_chatters:np.ndarray,member_messages:np.ndarray):
+        self.video_id = video_id
+        self.resolution = resolution
+        self.origin = origin
+        self.messages = messages # Messages per bin
+        self.superchat_amount = superchat_amount # Sum of Superchat/Super Sticker amounts per bin (Mixed currencies, as sent)
+        self.unique_chatters = unique_chatters # Distinct users per bin
+        self.member_messages = member_messages # Messages per bin from users with a membership badge
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """Video time (Seconds) at the start of every bin."""
+        return self.origin + np.arange(len(self.messages),dtype=np.int64) * self.resolution
+
+    @property
+    def rate(self) -> np.ndarray:
+        """Messages per minute for every bin."""
+        return self.messages * (60.0 / self.resolution)
+
+    @property
+    def member_share(self) -> np.ndarray:
+        """Fraction of each bin's messages that came from members (0 for empty bins)."""
+        return np.divide(self.member_messages,self.messages,out=np.zeros(len(self.messages)),where=self.messages > 0)
+
+    def Top_Peaks(self,k:int=10,min_gap:int=1,series:str="messages",baseline:int|None=None) -> list[dict[str,Any]]:
+        """
+        Finds the k highest bins of a series, keeping picked peaks at least min_gap bins apart.
+
+        :param k: Number of peaks to return
+        :type k: Integer
+        :param min_gap: Minimum distance between two peaks, in bins
+        :type min_gap: Integer
+        :param series: Which series to rank by: messages, superchat_amount, unique_chatters or member_messages
+        :type series: String
+        :param baseline: If given, rank by how far a bin sits above the moving average over this many bins instead
+                         of the raw value. Stops long busy streams from drowning out short spikes.
+        :type baseline: Integer
+        :return: Peaks, highest first, as {"video_id","offset","value","score","link"}
+        :rtype: List of Dictionaries
+        """
+        values = getattr(self,series).astype(np.float64)
+        if len(values) == 0:
+            return []
+
+        if baseline is not None and baseline > 1:
+            # Pad with the edge values so the first and last bins aren't compared against a half-empty window
+            padded = np.pad(values,(baseline // 2,baseline - 1 - baseline // 2),mode="edge")
+            score = values - np.convolve(padded,np.ones(baseline) / baseline,mode="valid")
+        else:
+            score = values
+
+        peaks = _Pick_Peaks(score,k,min_gap)
+        offsets = self.offsets
+
+        return [{
+            "video_id":self.video_id,
+            "offset":int(offsets[i]),
+            "value":float(values[i]),
+            "score":float(score[i]),
+            "link":f"https://youtu.be/{self.video_id}?t={max(int(offsets[i]),0)}"
+        } for i in peaks]
+
+def _Pick_Peaks(score:np.ndarray,k:int,min_gap:int) -> list[int]:
+    """Greedy non-maximum suppression over a 1D score array. Returns bin indexes, highest score first."""
+    # Only the best k*(2*min_gap+1) bins can ever be picked, so don't sort the whole array
+    pool = min(len(score),k * (2 * max(min_gap,1) + 1))
+    candidates = np.argpartition(-score,pool - 1)[:pool]
+    candidates = candidates[np.argsort(-score[candidates],kind="stable")]
+
+    picked:list[int] = []
+    for index in candidates:
+        if len(picked) >= k:
+            break
+        if all(abs(int(index) - p) >= min_gap for p in picked):
+            picked.append(int(index))
+    return picked
+
+def Build_Timeline(video_id:str,times:np.ndarray,user_codes:np.ndarray,amounts:np.ndarray,paid:np.ndarray,member:np.ndarray,resolution:int) -> Timeline:
+    """
+    Bins one video's message arrays into a Timeline. All arrays are per message and the same length.
+
+    :param times: Video time of every message, in seconds
+    :type times: Float array
+    :param user_codes: Integer code per distinct user (Dictionary indices or np.unique inverse)
+    :type user_codes: Integer array
+    :param amounts: Money amount per message (NaN when there isn't one)
+    :type amounts: Float array
+    :param paid: True for Superchats and Super Stickers
+    :type paid: Boolean array
+    :param member: True when the sender had a membership badge
+    :type member: Boolean array
+    :param resolution: Seconds per bin
+    :type resolution: Integer
+    """
+    if len(times) == 0:
+        empty = np.zeros(0,dtype=np.int64)
+        return Timeline(video_id,resolution,0,empty,np.zeros(0),empty,empty)
+
+    slots = np.floor_divide(times,resolution).astype(np.int64)
+    first = int(slots.min())
+    bins = slots - first
+    length = int(bins.max()) + 1
+
+    messages = np.bincount(bins,minlength=length)
+    superchat_amount = np.bincount(bins,weights=np.where(paid,np.nan_to_num(amounts),0.0),minlength=length)
+    member_messages = np.bincount(bins,weights=member,minlength=length).astype(np.int64)
+
+    # Distinct (bin, user) pairs, then count the pairs in each bin
+    user_codes = user_codes.astype(np.int64)
+    width = int(user_codes.max()) + 1 if len(user_codes) > 0 else 1
+    pairs = np.unique(bins * width + user_codes)
+    unique_chatters = np.bincount(pairs // width,minlength=length)
+
+    return Timeline(video_id,resolution,first * resolution,messages,superchat_amount,unique_chatters,member_messages)
+
+def _Arrays_From_Table(table:pa.Table,start_time:datetime|None=None) -> tuple[np.ndarray,...]:
+    """
+    Pulls the timeline arrays out of an Arrow table with SOURCE_COLUMNS.
+
+    :param start_time: When the video/stream started (UTC). Messages without a time_in_seconds are placed by their
+                       timestamp relative to it, without it they're left out.
+    :type start_time: Datetime
+    """
+    table = table.unify_dictionaries()
+    times = table.column("time_in_seconds").to_numpy(zero_copy_only=False).astype(np.float64)
+    missing = np.isnan(times)
+    if missing.any() and start_time is not None:
+        stamps = table.column("timestamp").to_numpy(zero_copy_only=False).astype(np.float64)
+        # Timestamps are microseconds, or seconds on older messages (Same rule as the datetime column)
+        stamps = np.where(stamps > 1e15,stamps / 1000000,stamps)
+        origin = (start_time if start_time.tzinfo is not None else start_time.replace(tzinfo=timezone.utc)).timestamp()
+        times[missing] = stamps[missing] - origin
+    keep = ~np.isnan(times)
+
+    users = table.column("user_id")
+    if pa.types.is_dictionary(users.type):
+        # Exports already share one dictionary per column, so the indices are the user codes
+        user_codes = np.concatenate([chunk.indices.fill_null(0).to_numpy(zero_copy_only=False) for chunk in users.chunks]) if users.num_chunks > 0 else np.zeros(0,dtype=np.int64)
+    else:
+        user_codes = np.unique(users.fill_null("").to_numpy(zero_copy_only=False).astype(str),return_inverse=True)[1]
+
+    amounts = table.column("amount").to_numpy(zero_copy_only=False).astype(np.float64)
+    paid = pc.is_in(table.column("type").cast(pa.string()),value_set=pa.array(PAID_TYPES)).to_numpy(zero_copy_only=False).astype(bool)
+    member = (table.column("user_member_status").fill_null(-1).to_numpy(zero_copy_only=False) >= 0)
+
+    return times[keep],user_codes[keep],amounts[keep],paid[keep],member[keep]
+
+def _Video_Details(database:DB.PostgresClass,video_ids:list[str]) -> dict[str,dict[str,Any]]:
+    """
+    Start time and message count of videos, in one query however many there are.
+
+    :return: {video_id: {"start_time", "messages"}}, videos the database doesn't have are left out
+    :rtype: Dictionary
+    """
+    database.cursor.execute("""SELECT v.id, v.start_time, s.messages FROM videos AS v
+        LEFT JOIN video_chat_summary AS s ON s.video_id = v.id WHERE v.id = ANY(%s)""",(list(video_ids),))
+    return {video_id:{"start_time":start_time,"messages":messages} for video_id, start_time, messages in database.cursor.fetchall()}
+
+def _Source_Stamp(video_id:str,details:dict[str,Any]|None) -> str|None:
+    """Something that changes whenever a video's messages do. Cached timelines are reused while it stays the same."""
+    export = EX.Video_Path(video_id)
+    if os.path.isfile(export):
+        return f"export:{os.stat(export).st_mtime_ns}"
+    if details is not None:
+        return f"db:{details['messages'] or 0}"
+    return None
+
+def _Source_Table(video_id:str,database:DB.PostgresClass|None) -> pa.Table:
+    """Loads the timeline source columns for a video, from its columnar export if there is one."""
+    if os.path.isfile(EX.Video_Path(video_id)):
+        return EX.Read_Video(video_id).select(SOURCE_COLUMNS)
+
+    if database is None:
+        raise FileNotFoundError(f"No columnar export for {video_id} and no database to read from.")
+
+    columns = [[] for _ in SOURCE_COLUMNS]
+    for row in DB.StreamEntries(database.database,"messages",", ".join(f'"{c}"' for c in SOURCE_COLUMNS),{"video_id":video_id},as_dict=False):
+        for column, value in zip(columns,row):
+            column.append(value)
+    types = [pa.float32(),pa.int64(),pa.string(),pa.string(),pa.float32(),pa.int64()]
+    return pa.table([pa.array(c,type=t) for c, t in zip(columns,types)],names=SOURCE_COLUMNS)
+
+def _Cache_Path(video_id:str,resolution:int):
+    return f"{TIMELINE_PATH}/{video_id}_{resolution}s.npz"
+
+def Load_Timeline(video_id:str,resolution:int=60,database:DB.PostgresClass|None=None,details:dict[str,Any]|None=None) -> Timeline:
+    """
+    Gets a video's timeline, from the cache when the source hasn't changed since it was built.
+
+    :param video_id: Video to load
+    :type video_id: String
+    :param resolution: Seconds per bin (1 for per-second, 60 for per-minute, etc.)
+    :type resolution: Integer
+    :param database: Used when the video has no columnar export, and for the video's start time
+    :type database: Database Object
+    :param details: The video's entry from _Video_Details, when it was already looked up (See Build_All)
+    :type details: Dictionary
+    :return: Timeline of the video
+    :rtype: Timeline
+    """
+    if details is None and database is not None:
+        details = _Video_Details(database,[video_id]).get(video_id,{"start_time":None,"messages":0})
+    cache = _Cache_Path(video_id,resolution)
+    stamp = _Source_Stamp(video_id,details)
+
+    if os.path.isfile(cache):
+        with np.load(cache) as data:
+            # With no way to check the source (No export, no database) the cache is the best we've got
+            if stamp is None or str(data["stamp"]) == stamp:
+                return Timeline(video_id,resolution,int(data["origin"]),data["messages"],data["superchat_amount"],data["unique_chatters"],data["member_messages"])
+
+    start_time = details["start_time"] if details is not None else None
+    timeline = Build_Timeline(video_id,*_Arrays_From_Table(_Source_Table(video_id,database),start_time),resolution=resolution)
+
+    os.makedirs(TIMELINE_PATH,exist_ok=True)
+    temp_cache = f"{TIMELINE_PATH}/{video_id}_{resolution}s_TEMP.npz"
+    with open(temp_cache,'wb') as file:
+        np.savez(file,stamp=np.array(stamp or ""),origin=np.array(timeline.origin),messages=timeline.messages,superchat_amount=timeline.superchat_amount,
+                 unique_chatters=timeline.unique_chatters,member_messages=timeline.member_messages)
+    os.replace(temp_cache,cache)
+
+    return timeline
+
+def Build_All(resolutions:tuple[int,...]=(1,60),video_ids:list[str]|None=None,workers:int|None=None,
+              database:DB.PostgresClass|None=None) -> dict[str,dict[int,Timeline]]:
+    """
+    Builds (Or loads from cache) timelines for a whole catalogue of exported videos. Arrow and NumPy release the GIL
+    for the heavy parts, so videos are spread over a thread pool.
+
+    :param resolutions: Bin sizes to build for every video
+    :type resolutions: Tuple of Integers
+    :param video_ids: Videos to build. Defaults to every video with a columnar export.
+    :type video_ids: List of Strings
+    :param workers: Thread count. Defaults to the CPU count.
+    :type workers: Integer
+    :param database: Looks up every video's start time and message count in one query. The messages still come from
+                     the exports, the threads don't share the connection.
+    :type database: Database Object
+    :return: {video_id: {resolution: Timeline}}
+    :rtype: Dictionary
+    """
+    if video_ids is None:
+        video_ids = [name[:-len(".arrow")] for name in os.listdir(EX.EXPORT_PATH) if name.endswith(".arrow") and not name.endswith("_TEMP.arrow")] if os.path.isdir(EX.EXPORT_PATH) else []
+
+    details = _Video_Details(database,video_ids) if database is not None and len(video_ids) > 0 else {}
+    if database is not None:
+        database.database.commit()
+
+    def _build(video_id:str):
+        return video_id, {res:Load_Timeline(video_id,res,details=details.get(video_id)) for res in resolutions}
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = dict(pool.map(_build,video_ids))
+
+    LOG.logger.debug(f'Built timelines for {len(results)} video(s).')
+    return results
+
+def Top_Peaks_Catalogue(timelines:list[Timeline],k:int=25,min_gap:int=1,series:str="messages",baseline:int|None=None) -> list[dict[str,Any]]:
+    """
+    Top k peak moments over many videos. Each video contributes its own top k, then the best k overall are kept.
+
+    :return: Peaks, highest score first (Same format as Timeline.Top_Peaks)
+    :rtype: List of Dictionaries
+    """
+    peaks:list[dict[str,Any]] = []
+    for timeline in timelines:
+        peaks.extend(timeline.Top_Peaks(k,min_gap,series,baseline))
+    peaks.sort(key=lambda p: p["score"],reverse=True)
+    return peaks[:k]
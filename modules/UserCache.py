@@ -0,0 +1,130 @@
+# Native Stuff
+import os,json,time,sqlite3,threading
+from typing import Any
+from datetime import datetime
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.Images as IMG
+
+"""
+User metadata cache shared by every channel database (Public and Members) run from the same data directory.
+
+The same fan chatting in five channels used to cost five channels().list lookups, five JSON snapshots and five PFP
+downloads. Now every channel run checks [DATA_DIRECTORY]/Shared/User_Cache.sqlite3 first:
+    1. Users looked up less than USER_CACHE_HOURS ago are answered from the cache, no API call.
+       That includes accounts the API said don't exist anymore.
+    2. Only the rest are asked for, and what comes back is stored for the next channel.
+    3. User snapshots and profile pictures are kept once in [DATA_DIRECTORY]/Shared/users, PFP downloads are tracked in
+       the same SQLite file (Same rules as Images.py) instead of each channel's image_cache table.
+
+Several channel runs can use the cache at once (SQLite WAL mode, writers wait on each other).
+"""
+
+SHARED_PATH = f"{CFG.DATA_DIRECTORY}/Shared"
+USER_CACHE_PATH = f"{SHARED_PATH}/User_Cache.sqlite3"
+USERS_PATH = f"{SHARED_PATH}/users" # User snapshots and PFPs
+
+class UserCache:
+    """
+    SQLite backed cache of channels().list results. Safe to share between threads.
+
+    :param path: SQLite file to use. Defaults to USER_CACHE_PATH
+    :type path: String
+    """
+    def __init__(self,path:str|None=None):
+        self.path = path if path is not None else USER_CACHE_PATH
+        os.makedirs(os.path.dirname(self.path),exist_ok=True)
+        os.makedirs(USERS_PATH,exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path,check_same_thread=False,isolation_level=None,timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            payload TEXT,
+            fingerprint TEXT,
+            fetched REAL NOT NULL
+        )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS images (
+            artifact TEXT PRIMARY KEY,
+            url TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            hash TEXT,
+            checked TEXT
+        )""")
+
+        self.images = SharedImageRecords(self)
+        self.hits:int = 0
+        self.misses:int = 0
+
+    def Close(self):
+        """Closes the SQLite file."""
+        with self._lock:
+            self._conn.close()
+
+    def Lookup(self,user_ids:list[str]) -> dict[str,tuple[dict[str,Any]|None,str|None]]:
+        """
+        Users fetched recently enough to skip the API.
+
+        :param user_ids: Users to look for
+        :type user_ids: List of Strings
+        :return: {[User ID] , ([API Response Item], [Fingerprint])}, the item is None for users that don't exist anymore
+        :rtype: Dictionary
+        """
+        if len(user_ids) == 0:
+            return {}
+        cutoff = time.time() - CFG.USER_CACHE_HOURS * 3600
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, payload, fingerprint FROM users WHERE fetched >= ? AND id IN ({','.join('?' * len(user_ids))})",
+                                      [cutoff] + list(user_ids)).fetchall()
+        found = {user_id:(json.loads(payload) if payload is not None else None,fingerprint) for user_id, payload, fingerprint in rows}
+        self.hits += len(found)
+        self.misses += len(user_ids) - len(found)
+        return found
+
+    def Store(self,users:list[tuple[dict[str,Any],str]],missing:list[str]):
+        """
+        Remembers what the API returned.
+
+        :param users: (API Response Item, Fingerprint) of each user returned
+        :type users: List of Tuples
+        :param missing: Users the API didn't return (Banned or deleted)
+        :type missing: List of Strings
+        """
+        now = time.time()
+        rows = [(user["id"],json.dumps(user),fingerprint,now) for user, fingerprint in users]
+        rows += [(user_id,None,None,now) for user_id in missing]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("INSERT OR REPLACE INTO users (id, payload, fingerprint, fetched) VALUES (?,?,?,?)",rows)
+            self._conn.execute("COMMIT")
+
+    def Report(self) -> str:
+        """Cache hits and misses of this run, for the end of run summary."""
+        looked_up = self.hits + self.misses
+        rate = self.hits / looked_up * 100 if looked_up > 0 else 0.0
+        return f"User cache: {self.hits} of {looked_up} user(s) answered from the shared cache ({rate:.0f}%)"
+
+class SharedImageRecords(IMG.ImageRecords):
+    """Image records for the shared PFP folder, kept in the user cache's SQLite file instead of a channel database."""
+    def __init__(self,cache:UserCache):
+        self.cache = cache
+        self.root = SHARED_PATH
+
+    def Get(self,artifact:str) -> dict[str,Any]|None:
+        with self.cache._lock:
+            row = self.cache._conn.execute("SELECT url, etag, last_modified, hash FROM images WHERE artifact = ?",(artifact,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url","etag","last_modified","hash"),row))
+
+    def Touch(self,artifact:str):
+        with self.cache._lock:
+            self.cache._conn.execute("UPDATE images SET checked = ? WHERE artifact = ?",(datetime.now().isoformat(),artifact))
+
+    def Save(self,record:dict[str,Any]):
+        with self.cache._lock:
+            self.cache._conn.execute("INSERT OR REPLACE INTO images (artifact, url, etag, last_modified, hash, checked) VALUES (?,?,?,?,?,?)",
+                                     (record["artifact"],record["url"],record["etag"],record["last_modified"],record["hash"],record["checked"].isoformat()))
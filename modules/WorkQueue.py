@@ -0,0 +1,225 @@
+# Native Stuff
+import os,json,socket,threading
+from typing import Any,Iterator
+
+# Installed Stuff
+import psycopg2
+import xxhash
+from psycopg2.extras import execute_values
+
+# Other Project Files
+import modules.Settings as CFG
+import modules.logconfig as LOG
+import modules.Database as DB
+
+"""
+Work queue stored in the work_queue table, so any number of Main.py workers (On any number of machines) can share
+one channel's backlog without downloading the same video twice.
+
+    1. Every worker enqueues the videos it found that aren't processed yet. Items already queued are left alone.
+    2. Workers claim items with SELECT ... FOR UPDATE SKIP LOCKED, so two workers never get the same item.
+       A claim is a lease: the Heartbeat thread renews it every WORK_HEARTBEAT_SECONDS while the worker is alive.
+       If a worker dies its leases run out after WORK_LEASE_SECONDS and the items get claimed by someone else.
+    3. Finished items are marked done. Failed items go back to pending until WORK_MAX_ATTEMPTS, then they're failed.
+    4. Done/failed items are reset when a later run enqueues them again (e.g. livestreams, or videos that errored).
+
+Unprocessed users are queued the same way in batches of 50 once a worker is done with videos.
+"""
+
+# Identifies this worker in leased_by
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+VIDEO = "video"
+USERS = "users"
+
+def Enqueue(database:DB.PostgresClass,kind:str,items:list[tuple[str,Any]],since,commit:bool=True) -> int:
+    """
+    Adds items to the queue and commits. Items already queued stay as they are, unless they were finished before since.
+
+    :param database: Initialized Database Object
+    :type database: Database Object
+    :param kind: VIDEO or USERS
+    :type kind: String
+    :param items: (Item Key, Payload) pairs, the payload is stored as JSON
+    :type items: List of Tuples
+    :param since: When this run started. Done/failed items finished earlier than this are queued again
+    :type since: Datetime
+    :param commit: Set to False to leave the transaction open, e.g. to add more items under the same lock
+    :type commit: Boolean
+    :return: Number of items added or reset
+    :rtype: Integer
+    """
+    if len(items) == 0:
+        if commit == True:
+            database.database.commit()
+        return 0
+
+    cursor = database.cursor
+    # execute_values only takes the one placeholder, so the cut-off is inlined
+    cutoff = cursor.mogrify("%s",(since,)).decode()
+    query = f"""INSERT INTO work_queue (kind, item, payload) VALUES %s
+        ON CONFLICT (kind, item) DO UPDATE SET state = 'pending', attempts = 0, last_error = NULL, finished = NULL, payload = EXCLUDED.payload
+        WHERE work_queue.state IN ('done','failed') AND work_queue.finished < {cutoff}
+        RETURNING item"""
+    rows = [(kind,item,json.dumps(payload) if payload is not None else None) for item, payload in items]
+    added = len(execute_values(cursor,query,rows,fetch=True))
+    if commit == True:
+        database.database.commit()
+    return added
+
+def Enqueue_User_Batches(database:DB.PostgresClass,since,batch_size:int=50,flush_batches:int=100) -> int:
+    """
+    Queues every unprocessed user that isn't already in a pending or leased batch, batch_size users per item.
+    Only one worker at a time does this (Advisory lock), so batches never overlap.
+
+    Users are streamed from the server and queued flush_batches batches at a time, so memory stays flat however
+    many users there are. Everything is committed once at the end, which releases the advisory lock.
+
+    :return: Number of batches added
+    :rtype: Integer
+    """
+    cursor = database.cursor
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('work_queue_users'))")
+
+    # Users already in a pending/leased batch are left out by the server
+    stream = database.database.cursor(name='stream_user_batches')
+    stream.itersize = CFG.DB_FETCH_SIZE
+    stream.execute("""SELECT u.id FROM user_ids AS u
+        WHERE u.processed = false AND NOT EXISTS (
+            SELECT 1 FROM work_queue AS w, jsonb_array_elements_text(w.payload) AS queued(id)
+            WHERE w.kind = %s AND w.state IN ('pending','leased') AND queued.id = u.id)
+        ORDER BY u.id""",(USERS,))
+
+    added = 0
+    batches:list[tuple[str,Any]] = []
+    batch:list[str] = []
+    try:
+        for (user_id,) in stream:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                batches.append((xxhash.xxh128_hexdigest("\n".join(batch).encode()),batch))
+                batch = []
+            if len(batches) >= flush_batches:
+                added += Enqueue(database,USERS,batches,since,commit=False)
+                batches = []
+    finally:
+        stream.close()
+    if len(batch) > 0:
+        batches.append((xxhash.xxh128_hexdigest("\n".join(batch).encode()),batch))
+
+    added += Enqueue(database,USERS,batches,since) # Commits, which releases the advisory lock
+    return added
+
+def Claim(database:DB.PostgresClass,kind:str,limit:int=1,items:list[str]|None=None) -> list[dict[str,Any]]:
+    """
+    Leases the next items nobody else is working on. Also takes over items whose worker stopped renewing its lease.
+
+    :param items: Only claim from these items (e.g. the streams a worker wants to watch), as many as are free
+    :type items: List of Strings
+    :return: Claimed items {"item", "payload", "attempts"}
+    :rtype: List of Dictionaries
+    """
+    cursor = database.cursor
+    if items is not None:
+        if len(items) == 0:
+            return []
+        limit = len(items)
+
+    # Items whose last try died with the worker and have no tries left
+    cursor.execute("""UPDATE work_queue SET state = 'failed', leased_by = NULL, finished = now(), last_error = coalesce(last_error,'Lease expired')
+        WHERE kind = %s AND state = 'leased' AND lease_expires < now() AND attempts >= %s""",(kind,CFG.WORK_MAX_ATTEMPTS))
+
+    cursor.execute("""UPDATE work_queue w SET state = 'leased', leased_by = %s, attempts = w.attempts + 1,
+            heartbeat = now(), lease_expires = now() + make_interval(secs => %s)
+        FROM (
+            SELECT kind, item FROM work_queue
+            WHERE kind = %s AND (state = 'pending' OR (state = 'leased' AND lease_expires < now())) AND attempts < %s
+                AND (%s::text[] IS NULL OR item = ANY(%s::text[]))
+            ORDER BY created, item
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ) AS next
+        WHERE w.kind = next.kind AND w.item = next.item
+        RETURNING w.item, w.payload, w.attempts""",(WORKER_ID,CFG.WORK_LEASE_SECONDS,kind,CFG.WORK_MAX_ATTEMPTS,items,items,limit))
+    claimed = [{"item":item,"payload":payload,"attempts":attempts} for item, payload, attempts in cursor.fetchall()]
+    database.database.commit()
+    return claimed
+
+def Claimed(database:DB.PostgresClass,kind:str) -> Iterator[dict[str,Any]]:
+    """Claims and yields items one at a time until the queue has nothing left for this worker."""
+    while True:
+        claimed = Claim(database,kind)
+        if len(claimed) == 0:
+            return
+        yield claimed[0]
+
+def Complete(database:DB.PostgresClass,kind:str,item:str) -> bool:
+    """
+    Marks a leased item as done.
+
+    :return: False if the lease was lost to another worker in the meantime
+    :rtype: Boolean
+    """
+    database.cursor.execute("""UPDATE work_queue SET state = 'done', leased_by = NULL, lease_expires = NULL, finished = now(), last_error = NULL
+        WHERE kind = %s AND item = %s AND leased_by = %s""",(kind,item,WORKER_ID))
+    done = database.cursor.rowcount > 0
+    database.database.commit()
+    return done
+
+def Fail(database:DB.PostgresClass,kind:str,item:str,error:Any) -> bool:
+    """
+    Gives a leased item back after an error. It's retried until WORK_MAX_ATTEMPTS, then marked failed.
+
+    :return: False if the lease was lost to another worker in the meantime
+    :rtype: Boolean
+    """
+    database.cursor.execute("""UPDATE work_queue SET
+            state = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+            finished = CASE WHEN attempts >= %s THEN now() ELSE NULL END,
+            leased_by = NULL, lease_expires = NULL, last_error = %s
+        WHERE kind = %s AND item = %s AND leased_by = %s""",(CFG.WORK_MAX_ATTEMPTS,CFG.WORK_MAX_ATTEMPTS,str(error),kind,item,WORKER_ID))
+    failed = database.cursor.rowcount > 0
+    database.database.commit()
+    return failed
+
+def Progress(database:DB.PostgresClass,kind:str) -> dict[str,int]:
+    """
+    Number of items in each state, across every worker.
+
+    :return: {[State] , [Count]} for pending, leased, done and failed
+    :rtype: Dictionary
+    """
+    database.cursor.execute("SELECT state, count(*) FROM work_queue WHERE kind = %s GROUP BY state",(kind,))
+    counts = {"pending":0,"leased":0,"done":0,"failed":0}
+    counts.update(dict(database.cursor.fetchall()))
+    database.database.commit()
+    return counts
+
+class Heartbeat(threading.Thread):
+    """
+    Renews every lease this worker holds every WORK_HEARTBEAT_SECONDS, on its own database connection.
+    Start it before claiming anything, call Stop() at the end.
+    """
+    def __init__(self):
+        super().__init__(name="Work Queue Heartbeat",daemon=True)
+        self._stop_requested = threading.Event()
+
+    def Stop(self):
+        self._stop_requested.set()
+        self.join()
+
+    def run(self):
+        db:DB.PostgresClass|None = None
+        while not self._stop_requested.wait(CFG.WORK_HEARTBEAT_SECONDS):
+            try:
+                if db is None:
+                    db = DB.PostgresClass()
+                db.cursor.execute("""UPDATE work_queue SET heartbeat = now(), lease_expires = now() + make_interval(secs => %s)
+                    WHERE leased_by = %s AND state = 'leased'""",(CFG.WORK_LEASE_SECONDS,WORKER_ID))
+                db.database.commit()
+            except (psycopg2.OperationalError,psycopg2.InterfaceError) as e:
+                # Try again next beat, the leases have some slack
+                LOG.logger.warning(f"Work queue heartbeat failed: {e}")
+                db = None
+        if db is not None:
+            db.Close()
@@ -2,10 +2,10 @@
 Pre-made file for initializing logging functionality.
 """
 # Import of main package files
-import logging,time,atexit,datetime
+import logging,logging.handlers,queue,time,atexit,datetime
 
 # Import specific items from a package
-from typing import List
+from typing import List,Callable
 from contextlib import contextmanager
 from tqdm import tqdm
 
@@ -36,10 +36,14 @@ class ConsoleFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + crit_fmt + reset
     }
 
+    def __init__(self):
+        super().__init__()
+        # Built once, not per record
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+        self._default = logging.Formatter()
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self._formatters.get(record.levelno,self._default).format(record)
     
 class LogFormatter(logging.Formatter):
     '''Formats the log file outputs based on what type of log object they are'''
@@ -57,10 +61,14 @@ class LogFormatter(logging.Formatter):
         logging.INFO: info_fmt
     }
 
+    def __init__(self):
+        super().__init__()
+        # Built once, not per record
+        self._formatters = {level: logging.Formatter(fmt) for level, fmt in self.FORMATS.items()}
+        self._default = logging.Formatter()
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self._formatters.get(record.levelno,self._default).format(record)
 
 class Summary:
     """
@@ -87,9 +95,52 @@ class TQDMHandler(logging.Handler):
         except Exception:
             self.handleError(record)
 
+class ProgressThrottle:
+    """
+    Wraps a tqdm bar so it's only redrawn every PROGRESS_INTERVAL seconds or PROGRESS_COUNT items, whichever comes first.
+    Use it in loops that tick once per message instead of calling bar.update/set_postfix_str every time.
+
+    :param bar: The tqdm bar to update
+    :type bar: tqdm
+    :param postfix: Builds the postfix text. Only called when the bar is actually redrawn
+    :type postfix: Function returning a String
+    """
+    def __init__(self,bar:tqdm,postfix:Callable[[],str]|None=None):
+        self.bar = bar
+        self.postfix = postfix
+        self._pending:int = 0
+        self._last = time.monotonic()
+
+    def update(self,n:int=1):
+        """Counts n more items, redrawing the bar if it's been long enough."""
+        self._pending += n
+        if self._pending >= CFG.PROGRESS_COUNT or time.monotonic() - self._last >= CFG.PROGRESS_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Redraws the bar with everything counted so far."""
+        if self.postfix is not None:
+            self.bar.set_postfix_str(self.postfix(),refresh=False)
+        self.bar.update(self._pending)
+        self.bar.refresh()
+        self._pending = 0
+        self._last = time.monotonic()
+
 logger = logging.getLogger('Larry')
 logger.setLevel(logging.DEBUG)
 
+# Records are handed to a queue and formatted/written by a background thread, so console and file I/O never
+# hold up the thread that logged them. The real handlers live on the listener (See _Add_Handler).
+_log_queue = queue.SimpleQueue()
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_listener = logging.handlers.QueueListener(_log_queue,respect_handler_level=True)
+logger.addHandler(_queue_handler)
+
+def _Add_Handler(handler:logging.Handler):
+    """Attaches an output handler behind the queue. Records below every handler's level are dropped before queueing."""
+    _listener.handlers = _listener.handlers + (handler,)
+    _queue_handler.setLevel(min(h.level for h in _listener.handlers))
+
 def TimeCurrent():
     """Get the current time at moment of function call
     
@@ -129,7 +180,7 @@ def StreamLog():
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO) if CFG.LOG_VERBOSE == False else ch.setLevel(logging.DEBUG)
     ch.setFormatter(ConsoleFormatter())
-    logger.addHandler(ch)
+    _Add_Handler(ch)
 
 def FileLog(single_filename='log',log_filename='log'):
     """
@@ -146,40 +197,46 @@ def FileLog(single_filename='log',log_filename='log'):
         fh = logging.FileHandler(f'{single_filename}.log',encoding='utf-8')
     fh.setLevel(logging.INFO) if CFG.LOG_VERBOSE == False else fh.setLevel(logging.DEBUG)
     fh.setFormatter(LogFormatter())
-    logger.addHandler(fh)
+    _Add_Handler(fh)
 
 @contextmanager
 def TQDM_Logging():
-    original_handlers = logger.handlers.copy()
+    """Sends console output through tqdm.write while progress bars are up, so log lines don't break the bars."""
+    original_handlers = _listener.handlers
+
+    # Already inside another TQDM_Logging block
+    if any(isinstance(h, TQDMHandler) for h in original_handlers):
+        yield logger
+        return
 
-    stream_handlers = [h for h in logger.handlers if isinstance(h, logging.StreamHandler)]
-    for handler in stream_handlers:
-        logger.removeHandler(handler)
+    # FileHandlers are StreamHandlers too, but they keep writing to the file as-is
+    stream_handlers = [h for h in original_handlers if isinstance(h, logging.StreamHandler) and not isinstance(h, logging.FileHandler)]
 
     tqdm_handler = TQDMHandler()
     tqdm_handler.setLevel(logging.INFO) if CFG.LOG_VERBOSE == False else tqdm_handler.setLevel(logging.DEBUG)
     if stream_handlers:
         tqdm_handler.setFormatter(stream_handlers[0].formatter)
-    
-    logger.addHandler(tqdm_handler)
-    
+
+    _listener.handlers = tuple(h for h in original_handlers if h not in stream_handlers) + (tqdm_handler,)
+
     try:
         yield logger
     finally:
         # Restore original handlers
-        logger.removeHandler(tqdm_handler)
-        for handler in stream_handlers:
-            logger.addHandler(handler)
+        _listener.handlers = original_handlers
 
 StreamLog()
 
 if CFG.LOG == True:
     FileLog(CFG.DEBUG_LOG_FILE,CFG.LOG_NAME)
 
+_listener.start()
+
 time_start = time.time()
 time_epoch = int(round(time_start,0))
 
 logger.info(f'CURRENT TIME OF EXECUTION:\n{TimeCurrent()}\n----------------------')
 
-# Will run TimeDuration function when the program finishes
+# Will run TimeDuration function when the program finishes, then flush the queued log records (atexit runs last-in first-out)
+atexit.register(_listener.stop)
 atexit.register(ProgramComplete)
\ No newline at end of file
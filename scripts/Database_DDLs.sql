@@ -1,3 +1,7 @@
+-- Extensions
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm; -- Used by the message search indexes
+
 -- Table Creation
 
 CREATE TABLE public.emotes (
@@ -23,6 +27,7 @@ CREATE TABLE public.user_ids (
 	processed bool DEFAULT false NOT NULL,
 	"exists" bool DEFAULT true NOT NULL,
 	created timestamp NULL,
+	fingerprint text NULL, -- xxh128 of the canonical API response, used for change detection
 	CONSTRAINT pk_user_ids_id PRIMARY KEY (id)
 );
 CREATE INDEX idx_user_ids_created ON public.user_ids USING btree (created);
@@ -40,6 +45,7 @@ CREATE TABLE public.videos (
 	start_time timestamp NULL,
 	end_time timestamp NULL,
 	duration int8 GENERATED ALWAYS AS (EXTRACT(epoch FROM end_time - start_time)) STORED NULL,
+	fingerprint text NULL, -- xxh128 of the canonical API response, used for change detection
 	CONSTRAINT pk_videos_id PRIMARY KEY (id)
 );
 CREATE INDEX idx_videos_duration ON public.videos USING btree (duration);
@@ -48,13 +54,14 @@ CREATE INDEX idx_videos_schduled ON public.videos USING btree (scheduled_start);
 CREATE INDEX idx_videos_start_time ON public.videos USING btree (start_time);
 CREATE INDEX itx_videos_end_time ON public.videos USING btree (end_time);
 
+-- Messages are hash partitioned by video so per-video ingestion and summaries only touch one partition.
 CREATE TABLE public.messages (
 	message_id text NOT NULL,
 	message text NULL,
 	"timestamp" int8 NULL,
 	time_in_seconds float4 NULL,
 	"type" text NULL,
-	video_id text NULL,
+	video_id text NOT NULL,
 	user_id text NULL,
 	user_name text NULL,
 	user_member_status int8 NULL,
@@ -70,25 +77,134 @@ CASE
     WHEN "timestamp" > '1000000000000000'::bigint THEN to_timestamp(("timestamp" / 1000000)::double precision)
     ELSE to_timestamp("timestamp"::double precision)
 END) STORED NULL,
-	CONSTRAINT pk_messages_message_id PRIMARY KEY (message_id)
-);
+	CONSTRAINT pk_messages_video_id_message_id PRIMARY KEY (video_id, message_id)
+) PARTITION BY HASH (video_id);
+CREATE TABLE public.messages_p00 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 0);
+CREATE TABLE public.messages_p01 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 1);
+CREATE TABLE public.messages_p02 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 2);
+CREATE TABLE public.messages_p03 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 3);
+CREATE TABLE public.messages_p04 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 4);
+CREATE TABLE public.messages_p05 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 5);
+CREATE TABLE public.messages_p06 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 6);
+CREATE TABLE public.messages_p07 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 7);
+CREATE TABLE public.messages_p08 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 8);
+CREATE TABLE public.messages_p09 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 9);
+CREATE TABLE public.messages_p10 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 10);
+CREATE TABLE public.messages_p11 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 11);
+CREATE TABLE public.messages_p12 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 12);
+CREATE TABLE public.messages_p13 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 13);
+CREATE TABLE public.messages_p14 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 14);
+CREATE TABLE public.messages_p15 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 15);
 CREATE INDEX idx_mesages_user_id ON public.messages USING btree (user_id);
-CREATE INDEX idx_mesages_video_id ON public.messages USING btree (video_id);
-CREATE INDEX idx_messages_datetime ON public.messages USING btree (datetime);
+CREATE INDEX idx_messages_message_id ON public.messages USING btree (message_id); -- The nickname backfill walks message_id ranges
+CREATE INDEX idx_messages_datetime ON public.messages USING brin (datetime);
 CREATE INDEX idx_messages_message_text ON public.messages USING btree (message) WHERE (message ~ ':[a-zA-Z0-9_-]+:'::text);
-CREATE INDEX idx_messages_null ON public.messages USING btree (message) WHERE (message IS NOT NULL);
+CREATE INDEX idx_messages_message_trgm ON public.messages USING gin (message gin_trgm_ops);
+CREATE INDEX idx_messages_user_name_lower ON public.messages USING btree (lower(user_name));
+CREATE INDEX idx_messages_search_order ON public.messages USING btree ((COALESCE(datetime, '-infinity'::timestamp)), message_id); -- Search.py paging
 ALTER TABLE public.messages ADD CONSTRAINT fk_messages_user_id_user_ids_id FOREIGN KEY (user_id) REFERENCES public.user_ids(id);
 ALTER TABLE public.messages ADD CONSTRAINT fk_messages_video_id_videos_id FOREIGN KEY (video_id) REFERENCES public.videos(id);
 
 CREATE TABLE public.nickname_matches (
 	matched_nickname text NULL,
+	video_id text NOT NULL,
 	message_id text NULL,
 	index_start int8 NULL,
 	index_end int8 NULL,
 	CONSTRAINT unq_message_id_index_start_index_end UNIQUE (message_id, index_start, index_end)
 );
 CREATE INDEX idx_nickname_matches_message_id ON public.nickname_matches USING btree (message_id);
-ALTER TABLE public.nickname_matches ADD CONSTRAINT fk_nickname_matches_message_id_messages_message_id FOREIGN KEY (message_id) REFERENCES public.messages(message_id);
+ALTER TABLE public.nickname_matches ADD CONSTRAINT fk_nickname_matches_message_id_messages_message_id FOREIGN KEY (video_id, message_id) REFERENCES public.messages(video_id, message_id);
+
+-- Validators for downloaded thumbnails and profile pictures (See Images.py)
+
+CREATE TABLE public.image_cache (
+	artifact text NOT NULL,
+	url text NULL,
+	etag text NULL,
+	last_modified text NULL,
+	hash text NULL,
+	checked timestamp NULL,
+	CONSTRAINT pk_image_cache_artifact PRIMARY KEY (artifact)
+);
+
+-- Nickname backfill bookkeeping (See Nickname_Backfill.py)
+
+CREATE TABLE public.nickname_backfill_state (
+	nickname text NOT NULL,
+	applied timestamp DEFAULT now() NOT NULL,
+	CONSTRAINT pk_nickname_backfill_state_nickname PRIMARY KEY (nickname)
+);
+
+CREATE TABLE public.nickname_backfill_chunks (
+	run_id text NOT NULL,
+	chunk int4 NOT NULL,
+	lower_id text NULL,
+	upper_id text NULL,
+	done bool DEFAULT false NOT NULL,
+	scanned int8 DEFAULT 0 NOT NULL,
+	matched int8 DEFAULT 0 NOT NULL,
+	CONSTRAINT pk_nickname_backfill_chunks_run_id_chunk PRIMARY KEY (run_id, chunk)
+);
+
+-- Shared work queue, lets several Main.py workers split one channel between them (See WorkQueue.py)
+
+CREATE TABLE public.work_queue (
+	kind text NOT NULL,
+	item text NOT NULL,
+	payload jsonb NULL,
+	state text DEFAULT 'pending'::text NOT NULL,
+	attempts int4 DEFAULT 0 NOT NULL,
+	leased_by text NULL,
+	lease_expires timestamptz NULL,
+	heartbeat timestamptz NULL,
+	last_error text NULL,
+	created timestamptz DEFAULT now() NOT NULL,
+	finished timestamptz NULL,
+	CONSTRAINT pk_work_queue_kind_item PRIMARY KEY (kind, item)
+);
+CREATE INDEX idx_work_queue_claim ON public.work_queue USING btree (kind, state, created);
+CREATE INDEX idx_work_queue_leased_by ON public.work_queue USING btree (leased_by) WHERE (state = 'leased'::text);
+
+-- Per-video chat summary, refreshed one video at a time after ingestion (See Database.py: Refresh_Video_Summary)
+
+CREATE TABLE public.video_chat_summary (
+	video_id text NOT NULL,
+	messages int8 NULL,
+	first_message timestamp NULL,
+	last_message timestamp NULL,
+	chat_duration numeric NULL,
+	chats_per_min numeric NULL,
+	unique_users int8 NULL,
+	CONSTRAINT pk_video_chat_summary_video_id PRIMARY KEY (video_id)
+);
+
+-- One row per Main.py run with its throughput numbers (See RunLedger.py, Runs.py)
+
+CREATE TABLE public.runs (
+	run_id int8 GENERATED ALWAYS AS IDENTITY NOT NULL,
+	worker text NOT NULL,
+	channel_id text NOT NULL,
+	members bool NOT NULL,
+	status text DEFAULT 'running'::text NOT NULL,
+	started timestamptz DEFAULT now() NOT NULL,
+	finished timestamptz NULL,
+	seconds numeric NULL,
+	videos int4 NULL,
+	videos_skipped int4 NULL,
+	videos_failed int4 NULL,
+	messages int8 NULL,
+	new_messages int8 NULL,
+	users int4 NULL,
+	new_users int4 NULL,
+	messages_in_table int8 NULL,
+	downloaded_bytes int8 NULL,
+	api_units int4 NULL,
+	peak_memory_mb numeric NULL,
+	stages jsonb NULL,
+	CONSTRAINT pk_runs_run_id PRIMARY KEY (run_id)
+);
+CREATE INDEX idx_runs_channel_started ON public.runs USING btree (channel_id, members, started);
 
 -- Materialized Views
 
@@ -228,22 +344,6 @@ AS SELECT user_name,
   GROUP BY user_name, user_id
 WITH DATA;
 
-CREATE MATERIALIZED VIEW public.video_chat_summary
-TABLESPACE pg_default
-AS SELECT video_id,
-    count(*) AS messages,
-    min(datetime) AS first_message,
-    max(datetime) AS last_message,
-    EXTRACT(epoch FROM max(datetime) - min(datetime)) AS chat_duration,
-        CASE
-            WHEN EXTRACT(epoch FROM max(datetime) - min(datetime)) > 0::numeric THEN count(*)::numeric / (EXTRACT(epoch FROM max(datetime) - min(datetime)) / 60::numeric)
-            ELSE 0::numeric
-        END AS chats_per_min,
-    count(DISTINCT user_id) AS unique_users
-   FROM messages
-  GROUP BY video_id
-WITH DATA;
-
 CREATE OR REPLACE VIEW public.emote_summary_view
 AS SELECT emote,
     uses
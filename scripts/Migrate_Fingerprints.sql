@@ -0,0 +1,5 @@
+-- Adds the content fingerprint columns used for change detection to an existing database. Safe to run more than once.
+-- Existing rows start without a fingerprint, they get one the next time their video/user is processed.
+
+ALTER TABLE public.videos ADD COLUMN IF NOT EXISTS fingerprint text NULL;
+ALTER TABLE public.user_ids ADD COLUMN IF NOT EXISTS fingerprint text NULL;
@@ -0,0 +1,12 @@
+-- Adds the image_cache table used by Images.py to an existing database. Safe to run more than once.
+-- The first run after this downloads every image once more to record its validators, later runs skip unchanged ones.
+
+CREATE TABLE IF NOT EXISTS public.image_cache (
+	artifact text NOT NULL,
+	url text NULL,
+	etag text NULL,
+	last_modified text NULL,
+	hash text NULL,
+	checked timestamp NULL,
+	CONSTRAINT pk_image_cache_artifact PRIMARY KEY (artifact)
+);
@@ -0,0 +1,11 @@
+-- Adds the indexes used by Search.py / modules/Search.py to an existing database.
+-- Safe to run more than once. Building the trigram index on a big messages table takes a while.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_messages_message_trgm ON public.messages USING gin (message gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_messages_user_name_lower ON public.messages USING btree (lower(user_name));
+-- Sort key of the results, see SORT_KEY in modules/Search.py
+CREATE INDEX IF NOT EXISTS idx_messages_search_order ON public.messages USING btree ((COALESCE(datetime, '-infinity'::timestamp)), message_id);
+
+ANALYZE public.messages;
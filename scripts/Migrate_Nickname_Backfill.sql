@@ -0,0 +1,36 @@
+-- Adds the nickname backfill tables to an existing (already partitioned) database and indexes message_id so
+-- message_id ranges can be walked. The primary key stays (video_id, message_id), every per-video query needs it
+-- (Databases that got the short-lived (message_id, video_id) key are switched back, nothing is rebuilt otherwise).
+-- Run with Main.py stopped.
+
+BEGIN;
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'pk_messages_message_id_video_id') THEN
+		ALTER TABLE public.nickname_matches DROP CONSTRAINT IF EXISTS fk_nickname_matches_message_id_messages_message_id;
+		ALTER TABLE public.messages DROP CONSTRAINT pk_messages_message_id_video_id;
+		ALTER TABLE public.messages ADD CONSTRAINT pk_messages_video_id_message_id PRIMARY KEY (video_id, message_id);
+		ALTER TABLE public.nickname_matches ADD CONSTRAINT fk_nickname_matches_message_id_messages_message_id FOREIGN KEY (video_id, message_id) REFERENCES public.messages(video_id, message_id);
+	END IF;
+END $$;
+CREATE INDEX IF NOT EXISTS idx_messages_message_id ON public.messages USING btree (message_id);
+
+CREATE TABLE IF NOT EXISTS public.nickname_backfill_state (
+	nickname text NOT NULL,
+	applied timestamp DEFAULT now() NOT NULL,
+	CONSTRAINT pk_nickname_backfill_state_nickname PRIMARY KEY (nickname)
+);
+
+CREATE TABLE IF NOT EXISTS public.nickname_backfill_chunks (
+	run_id text NOT NULL,
+	chunk int4 NOT NULL,
+	lower_id text NULL,
+	upper_id text NULL,
+	done bool DEFAULT false NOT NULL,
+	scanned int8 DEFAULT 0 NOT NULL,
+	matched int8 DEFAULT 0 NOT NULL,
+	CONSTRAINT pk_nickname_backfill_chunks_run_id_chunk PRIMARY KEY (run_id, chunk)
+);
+
+COMMIT;
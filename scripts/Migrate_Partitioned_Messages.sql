@@ -0,0 +1,313 @@
+-- Migrates an existing database from the single heap "messages" table to the hash partitioned layout in Database_DDLs.sql.
+-- Run once per database (Public and Member's Only), with Main.py stopped. Everything happens in one transaction.
+--
+-- NOTE: The materialized views that read from messages and the views on top of them are dropped and created again
+--       at the bottom of this script, the same as Database_DDLs.sql (video_chat_summary is now a table instead).
+--       Nothing is dropped with CASCADE, so anything else built on messages stops the migration instead of vanishing.
+-- NOTE: Messages without a video_id can't be placed in a partition and are left behind in messages_legacy.
+
+BEGIN;
+
+-- Views and constraints that point at the old table
+DROP VIEW IF EXISTS public.emote_summary_view;
+DROP VIEW IF EXISTS public.message_type_summary_view;
+DROP VIEW IF EXISTS public.user_id_summary_view;
+DROP VIEW IF EXISTS public.user_message_buckets_view;
+DROP VIEW IF EXISTS public.user_name_summary_view;
+DROP VIEW IF EXISTS public.video_chat_summary_view;
+DROP MATERIALIZED VIEW IF EXISTS public.emote_summary;
+DROP MATERIALIZED VIEW IF EXISTS public.message_type_summary;
+DROP MATERIALIZED VIEW IF EXISTS public.user_id_summary;
+DROP MATERIALIZED VIEW IF EXISTS public.user_message_buckets;
+DROP MATERIALIZED VIEW IF EXISTS public.user_name_summary;
+DROP MATERIALIZED VIEW IF EXISTS public.video_chat_summary;
+ALTER TABLE public.nickname_matches DROP CONSTRAINT IF EXISTS fk_nickname_matches_message_id_messages_message_id;
+
+-- Move the old table out of the way (index names are schema wide, so they have to move too)
+ALTER TABLE public.messages RENAME TO messages_legacy;
+ALTER TABLE public.messages_legacy RENAME CONSTRAINT pk_messages_message_id TO pk_messages_legacy_message_id;
+ALTER TABLE public.messages_legacy RENAME CONSTRAINT fk_messages_user_id_user_ids_id TO fk_messages_legacy_user_id_user_ids_id;
+ALTER TABLE public.messages_legacy RENAME CONSTRAINT fk_messages_video_id_videos_id TO fk_messages_legacy_video_id_videos_id;
+ALTER INDEX public.idx_mesages_user_id RENAME TO idx_messages_legacy_user_id;
+ALTER INDEX public.idx_mesages_video_id RENAME TO idx_messages_legacy_video_id;
+ALTER INDEX public.idx_messages_datetime RENAME TO idx_messages_legacy_datetime;
+ALTER INDEX public.idx_messages_message_text RENAME TO idx_messages_legacy_message_text;
+DROP INDEX IF EXISTS public.idx_messages_null;
+
+-- New partitioned table (Same as Database_DDLs.sql)
+CREATE TABLE public.messages (
+	message_id text NOT NULL,
+	message text NULL,
+	"timestamp" int8 NULL,
+	time_in_seconds float4 NULL,
+	"type" text NULL,
+	video_id text NOT NULL,
+	user_id text NULL,
+	user_name text NULL,
+	user_member_status int8 NULL,
+	ismoderator bool DEFAULT false NOT NULL,
+	isverified bool DEFAULT false NOT NULL,
+	isowner bool DEFAULT false NOT NULL,
+	amount float4 NULL,
+	currency text NULL,
+	symbol text NULL,
+	color text NULL,
+	datetime timestamp GENERATED ALWAYS AS (
+CASE
+    WHEN "timestamp" > '1000000000000000'::bigint THEN to_timestamp(("timestamp" / 1000000)::double precision)
+    ELSE to_timestamp("timestamp"::double precision)
+END) STORED NULL,
+	CONSTRAINT pk_messages_video_id_message_id PRIMARY KEY (video_id, message_id)
+) PARTITION BY HASH (video_id);
+CREATE TABLE public.messages_p00 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 0);
+CREATE TABLE public.messages_p01 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 1);
+CREATE TABLE public.messages_p02 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 2);
+CREATE TABLE public.messages_p03 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 3);
+CREATE TABLE public.messages_p04 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 4);
+CREATE TABLE public.messages_p05 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 5);
+CREATE TABLE public.messages_p06 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 6);
+CREATE TABLE public.messages_p07 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 7);
+CREATE TABLE public.messages_p08 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 8);
+CREATE TABLE public.messages_p09 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 9);
+CREATE TABLE public.messages_p10 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 10);
+CREATE TABLE public.messages_p11 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 11);
+CREATE TABLE public.messages_p12 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 12);
+CREATE TABLE public.messages_p13 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 13);
+CREATE TABLE public.messages_p14 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 14);
+CREATE TABLE public.messages_p15 PARTITION OF public.messages FOR VALUES WITH (MODULUS 16, REMAINDER 15);
+
+-- Copy the data over before building the secondary indexes, it's a lot faster that way
+INSERT INTO public.messages (message_id, message, "timestamp", time_in_seconds, "type", video_id, user_id, user_name, user_member_status, ismoderator, isverified, isowner, amount, currency, symbol, color)
+SELECT message_id, message, "timestamp", time_in_seconds, "type", video_id, user_id, user_name, user_member_status, ismoderator, isverified, isowner, amount, currency, symbol, color
+  FROM public.messages_legacy
+ WHERE video_id IS NOT NULL;
+
+CREATE INDEX idx_mesages_user_id ON public.messages USING btree (user_id);
+CREATE INDEX idx_messages_datetime ON public.messages USING brin (datetime);
+CREATE INDEX idx_messages_message_text ON public.messages USING btree (message) WHERE (message ~ ':[a-zA-Z0-9_-]+:'::text);
+ALTER TABLE public.messages ADD CONSTRAINT fk_messages_user_id_user_ids_id FOREIGN KEY (user_id) REFERENCES public.user_ids(id);
+ALTER TABLE public.messages ADD CONSTRAINT fk_messages_video_id_videos_id FOREIGN KEY (video_id) REFERENCES public.videos(id);
+
+-- Nickname matches need the video to point at a partitioned message
+ALTER TABLE public.nickname_matches ADD COLUMN IF NOT EXISTS video_id text NULL;
+UPDATE public.nickname_matches nm
+   SET video_id = m.video_id
+  FROM public.messages_legacy m
+ WHERE nm.message_id = m.message_id
+   AND nm.video_id IS NULL;
+-- Matches of messages left behind in messages_legacy (No video) have nothing to point at, drop them
+DO $$
+DECLARE
+	orphaned int8;
+BEGIN
+	DELETE FROM public.nickname_matches WHERE video_id IS NULL;
+	GET DIAGNOSTICS orphaned = ROW_COUNT;
+	RAISE NOTICE 'Dropped % nickname match(es) of messages without a video', orphaned;
+END $$;
+ALTER TABLE public.nickname_matches ALTER COLUMN video_id SET NOT NULL;
+ALTER TABLE public.nickname_matches ADD CONSTRAINT fk_nickname_matches_message_id_messages_message_id FOREIGN KEY (video_id, message_id) REFERENCES public.messages(video_id, message_id);
+
+-- Per-video chat summary is now a table instead of a materialized view
+CREATE TABLE public.video_chat_summary (
+	video_id text NOT NULL,
+	messages int8 NULL,
+	first_message timestamp NULL,
+	last_message timestamp NULL,
+	chat_duration numeric NULL,
+	chats_per_min numeric NULL,
+	unique_users int8 NULL,
+	CONSTRAINT pk_video_chat_summary_video_id PRIMARY KEY (video_id)
+);
+INSERT INTO public.video_chat_summary
+SELECT video_id,
+    count(*) AS messages,
+    min(datetime) AS first_message,
+    max(datetime) AS last_message,
+    EXTRACT(epoch FROM max(datetime) - min(datetime)) AS chat_duration,
+        CASE
+            WHEN EXTRACT(epoch FROM max(datetime) - min(datetime)) > 0::numeric THEN count(*)::numeric / (EXTRACT(epoch FROM max(datetime) - min(datetime)) / 60::numeric)
+            ELSE 0::numeric
+        END AS chats_per_min,
+    count(DISTINCT user_id) AS unique_users
+   FROM public.messages
+  GROUP BY video_id;
+
+-- Materialized views and views dropped at the top (Same as Database_DDLs.sql)
+CREATE MATERIALIZED VIEW public.emote_summary
+TABLESPACE pg_default
+AS WITH row_chunks AS (
+         SELECT messages.message_id,
+            messages.message,
+            ntile(1000) OVER (ORDER BY messages.message_id) AS chunk_num
+           FROM messages
+          WHERE messages.message ~ ':[a-zA-Z0-9_-]+:'::text
+        ), chunk_results AS (
+         SELECT match_array.match_array[1] AS emote,
+            count(*) AS chunk_count,
+            row_chunks.chunk_num
+           FROM row_chunks,
+            LATERAL regexp_matches(row_chunks.message, ':([a-zA-Z0-9_-]+):'::text, 'g'::text) match_array(match_array)
+          GROUP BY (match_array.match_array[1]), row_chunks.chunk_num
+        )
+ SELECT emote,
+    sum(chunk_count) AS uses
+   FROM chunk_results
+  GROUP BY emote
+  ORDER BY (sum(chunk_count)) DESC
+WITH DATA;
+
+CREATE MATERIALIZED VIEW public.message_type_summary
+TABLESPACE pg_default
+AS SELECT type AS message_type,
+    count(message_id) AS messages
+   FROM messages
+  GROUP BY type
+WITH DATA;
+
+CREATE MATERIALIZED VIEW public.user_id_summary
+TABLESPACE pg_default
+AS SELECT m.user_id,
+    u.latest_name AS username,
+    count(*) AS messages,
+    min(m.datetime) AS first_message,
+    max(m.datetime) AS latest_message,
+    count(DISTINCT m.user_name) AS username_count,
+    max(m.user_member_status) AS highest_membership,
+        CASE
+            WHEN count(*) = 1 THEN '1 message'::text
+            WHEN count(*) >= 2 AND count(*) <= 4 THEN '2-4 messages'::text
+            WHEN count(*) >= 5 AND count(*) <= 9 THEN '5-9 messages'::text
+            WHEN count(*) >= 10 AND count(*) <= 19 THEN '10-19 messages'::text
+            WHEN count(*) >= 20 AND count(*) <= 29 THEN '20-29 messages'::text
+            WHEN count(*) >= 30 AND count(*) <= 39 THEN '30-39 messages'::text
+            WHEN count(*) >= 40 AND count(*) <= 49 THEN '40-49 messages'::text
+            WHEN count(*) >= 50 AND count(*) <= 99 THEN '50-99 messages'::text
+            WHEN count(*) >= 100 AND count(*) <= 199 THEN '100-199 messages'::text
+            WHEN count(*) >= 200 AND count(*) <= 999 THEN '200-999 messages'::text
+            WHEN count(*) >= 1000 AND count(*) <= 1999 THEN '1000-1999 messages'::text
+            WHEN count(*) >= 2000 AND count(*) <= 9999 THEN '2000-9999 messages'::text
+            WHEN count(*) >= 10000 AND count(*) <= 19999 THEN '10000-19999 messages'::text
+            WHEN count(*) >= 20000 AND count(*) <= 99999 THEN '20000-99999 messages'::text
+            WHEN count(*) > 100000 THEN '100000+ messages'::text
+            ELSE 'No messages'::text
+        END AS message_bucket
+   FROM messages m
+     JOIN user_ids u ON m.user_id = u.id
+  GROUP BY m.user_id, u.latest_name
+  ORDER BY (count(*)) DESC
+WITH DATA;
+CREATE UNIQUE INDEX idx_user_id_summary_user_id ON public.user_id_summary USING btree (user_id);
+
+CREATE MATERIALIZED VIEW public.user_message_buckets
+TABLESPACE pg_default
+AS WITH user_message_counts AS (
+         SELECT messages.user_id,
+            count(*) AS total_messages
+           FROM messages
+          GROUP BY messages.user_id
+        )
+ SELECT
+        CASE
+            WHEN total_messages = 1 THEN '1 message'::text
+            WHEN total_messages >= 2 AND total_messages <= 4 THEN '2-4 messages'::text
+            WHEN total_messages >= 5 AND total_messages <= 9 THEN '5-9 messages'::text
+            WHEN total_messages >= 10 AND total_messages <= 19 THEN '10-19 messages'::text
+            WHEN total_messages >= 20 AND total_messages <= 29 THEN '20-29 messages'::text
+            WHEN total_messages >= 30 AND total_messages <= 39 THEN '30-39 messages'::text
+            WHEN total_messages >= 40 AND total_messages <= 49 THEN '40-49 messages'::text
+            WHEN total_messages >= 50 AND total_messages <= 99 THEN '50-99 messages'::text
+            WHEN total_messages >= 100 AND total_messages <= 199 THEN '100-199 messages'::text
+            WHEN total_messages >= 200 AND total_messages <= 999 THEN '200-999 messages'::text
+            WHEN total_messages >= 1000 AND total_messages <= 1999 THEN '1000-1999 messages'::text
+            WHEN total_messages >= 2000 AND total_messages <= 9999 THEN '2000-9999 messages'::text
+            WHEN total_messages >= 10000 AND total_messages <= 19999 THEN '10000-19999 messages'::text
+            WHEN total_messages >= 20000 AND total_messages <= 99999 THEN '20000-99999 messages'::text
+            WHEN total_messages > 100000 THEN '100000+ messages'::text
+            ELSE 'No messages'::text
+        END AS message_bucket,
+    count(*) AS users_in_bucket,
+    min(total_messages) AS min_messages,
+    max(total_messages) AS max_messages,
+    avg(total_messages)::numeric(10,2) AS avg_messages
+   FROM user_message_counts
+  GROUP BY (
+        CASE
+            WHEN total_messages = 1 THEN '1 message'::text
+            WHEN total_messages >= 2 AND total_messages <= 4 THEN '2-4 messages'::text
+            WHEN total_messages >= 5 AND total_messages <= 9 THEN '5-9 messages'::text
+            WHEN total_messages >= 10 AND total_messages <= 19 THEN '10-19 messages'::text
+            WHEN total_messages >= 20 AND total_messages <= 29 THEN '20-29 messages'::text
+            WHEN total_messages >= 30 AND total_messages <= 39 THEN '30-39 messages'::text
+            WHEN total_messages >= 40 AND total_messages <= 49 THEN '40-49 messages'::text
+            WHEN total_messages >= 50 AND total_messages <= 99 THEN '50-99 messages'::text
+            WHEN total_messages >= 100 AND total_messages <= 199 THEN '100-199 messages'::text
+            WHEN total_messages >= 200 AND total_messages <= 999 THEN '200-999 messages'::text
+            WHEN total_messages >= 1000 AND total_messages <= 1999 THEN '1000-1999 messages'::text
+            WHEN total_messages >= 2000 AND total_messages <= 9999 THEN '2000-9999 messages'::text
+            WHEN total_messages >= 10000 AND total_messages <= 19999 THEN '10000-19999 messages'::text
+            WHEN total_messages >= 20000 AND total_messages <= 99999 THEN '20000-99999 messages'::text
+            WHEN total_messages > 100000 THEN '100000+ messages'::text
+            ELSE 'No messages'::text
+        END)
+  ORDER BY (min(total_messages))
+WITH DATA;
+
+CREATE MATERIALIZED VIEW public.user_name_summary
+TABLESPACE pg_default
+AS SELECT user_name,
+    user_id,
+    count(message) AS messages
+   FROM messages
+  GROUP BY user_name, user_id
+WITH DATA;
+
+CREATE OR REPLACE VIEW public.emote_summary_view
+AS SELECT emote,
+    uses
+   FROM emote_summary;
+
+CREATE OR REPLACE VIEW public.message_type_summary_view
+AS SELECT message_type,
+    messages
+   FROM message_type_summary;
+
+CREATE OR REPLACE VIEW public.user_id_summary_view
+AS SELECT user_id,
+    username,
+    messages,
+    first_message,
+    latest_message,
+    username_count,
+    highest_membership,
+    message_bucket
+   FROM user_id_summary;
+
+CREATE OR REPLACE VIEW public.user_message_buckets_view
+AS SELECT message_bucket,
+    users_in_bucket,
+    min_messages,
+    max_messages,
+    avg_messages
+   FROM user_message_buckets;
+
+CREATE OR REPLACE VIEW public.user_name_summary_view
+AS SELECT user_name,
+    user_id,
+    messages
+   FROM user_name_summary;
+
+CREATE OR REPLACE VIEW public.video_chat_summary_view
+AS SELECT video_id,
+    messages,
+    first_message,
+    last_message,
+    chat_duration,
+    chats_per_min,
+    unique_users
+   FROM video_chat_summary;
+
+COMMIT;
+
+-- Once everything checks out:
+-- DROP TABLE public.messages_legacy;
+-- VACUUM ANALYZE public.messages;
@@ -0,0 +1,27 @@
+-- Adds the run ledger to an existing database. Safe to run more than once.
+-- Main.py records every run's numbers here, Runs.py reports on them.
+
+CREATE TABLE IF NOT EXISTS public.runs (
+	run_id int8 GENERATED ALWAYS AS IDENTITY NOT NULL,
+	worker text NOT NULL,
+	channel_id text NOT NULL,
+	members bool NOT NULL,
+	status text DEFAULT 'running'::text NOT NULL,
+	started timestamptz DEFAULT now() NOT NULL,
+	finished timestamptz NULL,
+	seconds numeric NULL,
+	videos int4 NULL,
+	videos_skipped int4 NULL,
+	videos_failed int4 NULL,
+	messages int8 NULL,
+	new_messages int8 NULL,
+	users int4 NULL,
+	new_users int4 NULL,
+	messages_in_table int8 NULL,
+	downloaded_bytes int8 NULL,
+	api_units int4 NULL,
+	peak_memory_mb numeric NULL,
+	stages jsonb NULL,
+	CONSTRAINT pk_runs_run_id PRIMARY KEY (run_id)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_channel_started ON public.runs USING btree (channel_id, members, started);
@@ -0,0 +1,19 @@
+-- Adds the shared work queue to an existing database. Safe to run more than once.
+-- Every Main.py worker pointed at the database claims its videos and user batches from this table.
+
+CREATE TABLE IF NOT EXISTS public.work_queue (
+	kind text NOT NULL,
+	item text NOT NULL,
+	payload jsonb NULL,
+	state text DEFAULT 'pending'::text NOT NULL,
+	attempts int4 DEFAULT 0 NOT NULL,
+	leased_by text NULL,
+	lease_expires timestamptz NULL,
+	heartbeat timestamptz NULL,
+	last_error text NULL,
+	created timestamptz DEFAULT now() NOT NULL,
+	finished timestamptz NULL,
+	CONSTRAINT pk_work_queue_kind_item PRIMARY KEY (kind, item)
+);
+CREATE INDEX IF NOT EXISTS idx_work_queue_claim ON public.work_queue USING btree (kind, state, created);
+CREATE INDEX IF NOT EXISTS idx_work_queue_leased_by ON public.work_queue USING btree (leased_by) WHERE (state = 'leased'::text);
@@ -2,5 +2,7 @@ refresh materialized view emote_summary;
 refresh materialized view message_type_summary;
 refresh materialized view user_id_summary;
 refresh materialized view user_name_summary;
-refresh materialized view video_chat_summary;
-refresh materialized view nickname_summary;
\ No newline at end of file
+refresh materialized view nickname_summary;
+
+-- video_chat_summary is a table kept up to date per video by Main.py. To rebuild it from scratch:
+-- insert into video_chat_summary select video_id, count(*), min(datetime), max(datetime), extract(epoch from max(datetime) - min(datetime)), case when extract(epoch from max(datetime) - min(datetime)) > 0 then count(*)::numeric / (extract(epoch from max(datetime) - min(datetime)) / 60) else 0 end, count(distinct user_id) from messages group by video_id on conflict (video_id) do update set messages = excluded.messages, first_message = excluded.first_message, last_message = excluded.last_message, chat_duration = excluded.chat_duration, chats_per_min = excluded.chats_per_min, unique_users = excluded.unique_users;
\ No newline at end of file